@@ -913,6 +913,7 @@ Required Arguments:
 
 Optional Arguments:
 
+    --rule-stats                       Report the execution cost of the rules and matchers
     --debug                            Enable Debug logger output
 
 Example:
@@ -961,6 +962,9 @@ Example:
         action=UniqueSetAction,
         default=set())
 
+    # Allow reporting the execution cost of each rule and matcher
+    lambda_test_parser.add_argument('--rule-stats', action='store_true', help=ARGPARSE_SUPPRESS)
+
     # Allow verbose output for the CLI with the --debug option
     test_filter_group.add_argument('--debug', action='store_true', help=ARGPARSE_SUPPRESS)
 
@@ -1201,6 +1205,74 @@ Examples:
 
     athena_parser.add_argument('--debug', action='store_true', help=ARGPARSE_SUPPRESS)
 
+def _add_benchmark_subparser(subparsers):
+    """Add the benchmark subparser: manage.py benchmark [options]"""
+    benchmark_usage = 'manage.py benchmark [options]'
+    benchmark_description = ("""
+StreamAlertCLI v{}
+Benchmark the throughput of the Rule Processor using synthetic records generated
+for each log type in conf/logs.json, or of the Alert Processor using synthetic alerts
+sent to every output, with mocked AWS services and a local HTTP server
+
+Available Options:
+
+    --processor                 The processor to benchmark: rule or alert (default: rule)
+    --records                   Number of records included in each event (default: 100)
+    --iterations                Number of times each event is processed (default: 10)
+    --log-types                 Name of log types to benchmark, separated by spaces
+    --alerts                    Number of alerts sent to each output (default: 100)
+    --outputs                   Name of outputs to benchmark, separated by spaces
+    --output                    Path of the file to save the results to, as JSON
+                                  (default: <processor>_processor_benchmark.json)
+    --baseline                  Path of the results of a previous benchmark to compare against
+    --cold-start                Measure the import time of the Rule Processor and of each rule
+                                  module, with and without lazy rule loading, in new processes
+                                  (default output: rule_processor_cold_start.json)
+    --debug                     Enable Debug logger output
+
+Examples:
+
+    manage.py benchmark --log-types cloudtrail:events osquery:differential
+    manage.py benchmark --output new.json --baseline rule_processor_benchmark.json
+    manage.py benchmark --processor alert --outputs slack pagerduty
+    manage.py benchmark --cold-start --iterations 5
+
+""".format(version))
+    benchmark_parser = subparsers.add_parser(
+        'benchmark',
+        description=benchmark_description,
+        usage=benchmark_usage,
+        formatter_class=RawTextHelpFormatter,
+        help=ARGPARSE_SUPPRESS)
+
+    # set the name of this parser to 'benchmark'
+    benchmark_parser.set_defaults(command='benchmark')
+
+    benchmark_parser.add_argument(
+        '--processor', choices=['alert', 'rule'], default='rule', help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument('--records', type=int, default=100, help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument('--iterations', type=int, default=10, help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument(
+        '--log-types', nargs='+', help=ARGPARSE_SUPPRESS, action=UniqueSetAction, default=set())
+
+    benchmark_parser.add_argument('--alerts', type=int, default=100, help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument(
+        '--outputs', nargs='+', help=ARGPARSE_SUPPRESS, action=UniqueSetAction, default=set())
+
+    benchmark_parser.add_argument('--output', help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument('--baseline', help=ARGPARSE_SUPPRESS)
+
+    benchmark_parser.add_argument('--cold-start', action='store_true', help=ARGPARSE_SUPPRESS)
+
+    # allow verbose output for the CLI with the --debug option
+    benchmark_parser.add_argument('--debug', action='store_true', help=ARGPARSE_SUPPRESS)
+
+
 def _add_threat_intel_subparser(subparsers):
     """Add Threat Intel subparser: manage.py threat_intel [subcommand]"""
     threat_intel_usage = 'manage.py threat_intel [subcommand]'
@@ -1421,6 +1493,7 @@ Available Commands:
 
     manage.py app                        Create, list, or update a StreamAlert app integration function
     manage.py athena                     Configure Athena for StreamAlert
+    manage.py benchmark                  Benchmark the throughput of the Rule or Alert Processor
     manage.py configure                  Configure Global StreamAlert settings
     manage.py create-alarm               Add a CloudWatch alarm for predefined metrics
     manage.py kinesis                    Configure Kinesis for StreamAlert
@@ -1465,6 +1538,7 @@ For additional details on the available commands, try:
     _add_kinesis_subparser(subparsers)
     _add_threat_intel_subparser(subparsers)
     _add_threat_intel_downloader_subparser(subparsers)
+    _add_benchmark_subparser(subparsers)
 
     return parser
 
@@ -16,20 +16,28 @@ limitations under the License.
 from collections import OrderedDict
 import json
 
+import boto3
+from botocore.exceptions import ClientError
+
 from stream_alert.alert_processor import LOGGER
 from stream_alert.alert_processor.helpers import validate_alert
 from stream_alert.alert_processor.outputs.output_base import StreamAlertOutput
-from stream_alert.shared import NORMALIZATION_KEY
+from stream_alert.shared import ALERT_REFERENCE_KEY, NORMALIZATION_KEY
+
+# Stop polling the alerts queue when less than this much time (ms) remains
+MIN_REMAINING_TIME_MS = 30000
+# Long poll the alerts queue instead of returning immediately when it is empty
+QUEUE_WAIT_TIME_SECONDS = 10
 
 
 def handler(event, context):
     """StreamAlert Alert Processor
 
     Args:
-        event (dict): contains a 'Records' top level key that holds
-            all of the records for this event. Each record dict then
-            contains a 'Message' key pointing to the alert payload that
-            has been sent from the main StreamAlert Rule processor function
+        event (dict): contains an 'alerts' top level key that holds the list
+            of alert payloads sent from the main StreamAlert Rule processor
+            function. An event without this key is treated as a single alert.
+            Scheduled events send the alerts waiting on the alerts queue.
         context (AWSLambdaContext): basically a namedtuple of properties from AWS
 
     Returns:
@@ -38,6 +46,10 @@ def handler(event, context):
             indicates if sending was successful and the second value is the
             output configuration info (ie - 'slack:sample_channel')
     """
+    # The function is invoked on a schedule when the alerts queue is enabled
+    if isinstance(event, dict) and event.get('detail-type') == 'Scheduled Event':
+        return queue_handler(event, context)
+
     # A failure to load the config will log the error in load_output_config
     # and return here
     config = _load_output_config()
@@ -47,8 +59,124 @@ def handler(event, context):
     region = context.invoked_function_arn.split(':')[3]
     function_name = context.function_name
 
-    # Return the current list of statuses back to the caller
-    return list(run(event, region, function_name, config))
+    # The rule processor sends alerts in batches
+    if isinstance(event, dict) and 'alerts' in event:
+        alerts = event['alerts']
+    else:
+        alerts = [event]
+
+    # Return the current list of statuses for all alerts back to the caller
+    statuses = []
+    for alert in _resolve_alerts(alerts, region):
+        statuses.extend(run(alert, region, function_name, config))
+
+    return statuses
+
+
+def queue_handler(_, context):
+    """StreamAlert Alert Processor entry point for alerts sent through an SQS queue
+
+    This is called by `handler` for the scheduled events that are created when the
+    alerts queue is enabled. Messages are received from the
+    '<prefix>_<cluster>_streamalert_alerts' queue, ten at a time, until the queue
+    is empty or the function is about to time out.
+    Each message body has the same {"alerts": [...]} format as a direct invocation.
+
+    A message is only deleted once all of its alerts were sent to their outputs.
+    Otherwise it is left on the queue, to be received again after its visibility
+    timeout, so alerts may be sent to some outputs more than once.
+
+    Args:
+        context (AWSLambdaContext): basically a namedtuple of properties from AWS
+
+    Returns:
+        list: Status values for all alerts that were processed, as in `handler`
+    """
+    config = _load_output_config()
+    if not config:
+        return
+
+    region = context.invoked_function_arn.split(':')[3]
+    function_name = context.function_name
+    queue_name = function_name.replace('_streamalert_alert_processor', '_streamalert_alerts')
+
+    client_sqs = boto3.client('sqs', region_name=region)
+    queue_url = client_sqs.get_queue_url(QueueName=queue_name)['QueueUrl']
+
+    statuses = []
+    while context.get_remaining_time_in_millis() > MIN_REMAINING_TIME_MS:
+        messages = client_sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=QUEUE_WAIT_TIME_SECONDS
+        ).get('Messages', [])
+        if not messages:
+            break
+
+        processed = []
+        for message in messages:
+            try:
+                alerts = json.loads(message['Body'])['alerts']
+            except (KeyError, ValueError):
+                # Malformed messages are also deleted so they are not received again
+                LOGGER.error('Invalid message received from \'%s\': %s',
+                             queue_name, message['Body'])
+                processed.append(message)
+                continue
+
+            message_statuses = []
+            for alert in _resolve_alerts(alerts, region):
+                message_statuses.extend(run(alert, region, function_name, config))
+            statuses.extend(message_statuses)
+
+            if all(sent for sent, _ in message_statuses):
+                processed.append(message)
+            else:
+                LOGGER.error('Failed to send alerts from message %s, leaving it on '
+                             '\'%s\' to be retried', message['MessageId'], queue_name)
+
+        if processed:
+            client_sqs.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                         for index, message in enumerate(processed)]
+            )
+
+    return statuses
+
+
+def _resolve_alerts(alerts, region):
+    """Replace references to alerts that were offloaded to S3 with the alerts
+
+    The rule processor writes alerts that are too large to be sent directly
+    to S3 and sends a reference in their place:
+        {"streamalert:alert_reference": {"bucket": "...", "key": "..."}}
+
+    Args:
+        alerts (list): Alerts, or references to alerts, received from the rule processor
+        region (str): The AWS region of the currently executing Lambda function
+
+    Yields:
+        dict: Each alert, with references replaced by the alert stored in S3.
+            Alerts that cannot be fetched are logged and skipped.
+    """
+    client_s3 = None
+    for alert in alerts:
+        reference = alert.get(ALERT_REFERENCE_KEY) if isinstance(alert, dict) else None
+        if not reference:
+            yield alert
+            continue
+
+        client_s3 = client_s3 or boto3.client('s3', region_name=region)
+        try:
+            response = client_s3.get_object(Bucket=reference['bucket'], Key=reference['key'])
+            alert = json.loads(response['Body'].read())
+        except (ClientError, ValueError) as err:
+            LOGGER.exception('An error occurred while loading large alert from '
+                             '\'s3://%s/%s\': %s', reference['bucket'], reference['key'], err)
+            continue
+
+        yield alert
 
 
 def run(alert, region, function_name, config):
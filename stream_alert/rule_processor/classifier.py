@@ -19,7 +19,7 @@ import json
 from stream_alert.rule_processor import LOGGER, LOGGER_DEBUG_ENABLED
 from stream_alert.rule_processor.parsers import get_parser
 from stream_alert.rule_processor.threat_intel import StreamThreatIntel
-from stream_alert.shared.stats import time_me
+from stream_alert.shared.stats import TIMERS
 
 # Set the below to True when we want to support matching on multiple schemas
 # and then log_patterns will be used as a fall back for key/value matching
@@ -32,6 +32,29 @@ class StreamClassifier(object):
     def __init__(self, config):
         self._config = config
         self._entity_log_sources = []
+        # Names of the logs for each combination of log sources, from the config snapshot
+        # if available, otherwise built as each combination is encountered
+        self._classifier_plans = config.get('derived', {}).get('classifier_plans', {})
+
+    @staticmethod
+    def build_classifier_plans(config):
+        """Map the log sources of each entity to the names of the logs they can contain
+
+        Args:
+            config (dict): Loaded StreamAlert config
+
+        Returns:
+            dict: Map of the tuple of log sources of an entity to the list of log names,
+                in the order they are declared in logs.json
+        """
+        plans = {}
+        for entities in config['sources'].itervalues():
+            for entity in entities.itervalues():
+                log_sources = tuple(entity['logs'])
+                if log_sources not in plans:
+                    plans[log_sources] = [log_name for log_name in config['logs']
+                                          if log_name.split(':')[0] in log_sources]
+        return plans
 
     @staticmethod
     def extract_service_and_entity(raw_record):
@@ -122,10 +145,35 @@ class StreamClassifier(object):
         # Get the logs configuration
         logs = self._config['logs']
 
-        return OrderedDict((source, logs[source]) for source in logs.keys()
-                           if source.split(':')[0] in self._entity_log_sources)
+        log_sources = tuple(self._entity_log_sources)
+        log_names = self._classifier_plans.get(log_sources)
+        if log_names is None:
+            log_names = [log_name for log_name in logs
+                         if log_name.split(':')[0] in log_sources]
+            self._classifier_plans[log_sources] = log_names
+
+        return OrderedDict((log_name, logs[log_name]) for log_name in log_names)
+
+    def get_json_stream_paths(self):
+        """Return the paths of JSON arrays to stream for the log sources of the entity
+
+        Streamed records are already decoded, so streaming is only enabled
+        when all of the entity's log types use the json parser.
+
+        Returns:
+            list: Sorted `json_stream_path` options of the entity's log types
+        """
+        log_info = self.get_log_info_for_source()
+        if any(attributes['parser'] != 'json' for attributes in log_info.itervalues()):
+            return []
+
+        return sorted({
+            attributes['configuration']['json_stream_path']
+            for attributes in log_info.itervalues()
+            if attributes.get('configuration', {}).get('json_stream_path')
+        })
 
-    @time_me
+    @TIMERS.timed('classify')
     def classify_record(self, payload):
         """Classify and type raw record passed into StreamAlert.
 
@@ -192,7 +240,7 @@ class StreamClassifier(object):
 
         return schema_matches[0]
 
-    @time_me
+    @TIMERS.timed('classify_schemas')
     def _process_log_schemas(self, payload):
         """Get any log schemas that matched this log format
 
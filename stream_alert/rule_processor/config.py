@@ -15,13 +15,47 @@ limitations under the License.
 """
 from collections import OrderedDict
 import json
+import marshal
 import os
 
+from stream_alert.rule_processor import LOGGER
+from stream_alert.rule_processor.classifier import StreamClassifier
+from stream_alert.rule_processor.firehose import StreamAlertFirehose
+from stream_alert.rule_processor.threat_intel import StreamThreatIntel
+
+# Name of the config snapshot written to the conf directory of the deployment package
+CONFIG_SNAPSHOT = 'config_snapshot.marshal'
+
 
 class ConfigError(Exception):
     """Exception class for config file errors"""
 
 
+class SnapshotLogs(OrderedDict):
+    """Logs loaded from a config snapshot, with each log decoded when first accessed
+
+    Decoding the schemas of all logs into OrderedDicts is the most expensive part
+    of loading the config, while a Rule Processor only classifies the logs sent
+    by its sources. Each value is stored as JSON until it is accessed.
+    """
+
+    def __getitem__(self, log_name):
+        value = OrderedDict.__getitem__(self, log_name)
+        if isinstance(value, basestring):
+            value = json.loads(value, object_pairs_hook=OrderedDict)
+            OrderedDict.__setitem__(self, log_name, value)
+        return value
+
+    def get(self, log_name, default=None):
+        return self[log_name] if log_name in self else default
+
+    def __eq__(self, other):
+        return self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self == other
+
+
 def load_config(conf_dir='conf/'):
     """Load the configuration for StreamAlert.
 
@@ -33,16 +67,43 @@ def load_config(conf_dir='conf/'):
     `logs` declare the schema for the listed log types in `sources`.  Each
     key denotes the name of the log type, and includes 'keys' used to match
     rules to log fields.
+
+    If the `conf` directory contains a config snapshot, written when the
+    deployment package is created, the validated config is loaded from it
+    along with the structures derived from it, under the 'derived' key.
+    """
+    config = _load_config_snapshot(conf_dir)
+    if config:
+        return config
+
+    cluster = os.environ.get('CLUSTER', '')
+    config = _load_config_files(conf_dir, [cluster] if cluster else [])
+
+    # Validate the config. This will raise an exception on any errors,
+    # which bubbles up and will immediately break execution of the function
+    _validate_config(config)
+
+    return config
+
+
+def _load_config_files(conf_dir, clusters):
+    """Load the JSON configuration files
+
+    Args:
+        conf_dir (str): Path of the configuration directory
+        clusters (list): Names of the clusters to load the config for
+
+    Returns:
+        dict: The loaded, but not validated, config
     """
     conf_files = ('sources', 'logs', 'types', 'global', 'clusters')
     config = dict()
     for base_name in conf_files:
         if base_name == 'clusters':
-            # Load current cluster config into memory for threat intel
+            # Load cluster config into memory for threat intel
             path = os.path.join(conf_dir, base_name)
             config['clusters'] = {}
-            cluster = os.environ.get('CLUSTER', '')
-            if cluster:
+            for cluster in clusters:
                 cluster_conf_path = '{}.json'.format(os.path.join(path, cluster))
                 with open(cluster_conf_path) as data:
                     try:
@@ -59,10 +120,125 @@ def load_config(conf_dir='conf/'):
                 except ValueError:
                     raise ConfigError('Invalid JSON format for {}.json'.format(base_name))
 
-    # Validate the config. This will raise an exception on any errors,
-    # which bubbles up and will immediately break execution of the function
+    return config
+
+
+def _derive_config(config):
+    """Derive the structures built from the config when the Rule Processor starts
+
+    Args:
+        config (dict): Loaded and validated config
+
+    Returns:
+        dict: The classifier plans, normalized type mappings and Firehose log names
+    """
+    normalized_types, normalized_ioc_types = StreamThreatIntel.normalized_type_mappings(
+        config['types'])
+    firehose_config = config['global'].get('infrastructure', {}).get('firehose', {})
+
+    return {
+        'classifier_plans': StreamClassifier.build_classifier_plans(config),
+        'normalized_types': normalized_types,
+        'normalized_ioc_types': normalized_ioc_types,
+        'firehose': {
+            'enabled_logs': StreamAlertFirehose.load_enabled_log_sources(
+                firehose_config, config['logs']),
+            'log_names': {log_name: StreamAlertFirehose.firehose_log_name(log_name)
+                          for log_name in config['logs']}
+        }
+    }
+
+
+def _marshalable(value):
+    """Convert any OrderedDicts in a loaded config value to a form that can be marshaled
+
+    marshal has no OrderedDict type, so each one is stored as a tuple wrapping its list
+    of (key, value) pairs. JSON config never contains tuples, so this is unambiguous.
+    """
+    if isinstance(value, OrderedDict):
+        return ([(key, _marshalable(item)) for key, item in value.iteritems()],)
+
+    if isinstance(value, dict):
+        return {key: _marshalable(item) for key, item in value.iteritems()}
+
+    if isinstance(value, list):
+        return [_marshalable(item) for item in value]
+
+    return value
+
+
+def _unmarshaled(value):
+    """Rebuild the OrderedDicts of a config value converted with `_marshalable`"""
+    if isinstance(value, tuple):
+        return OrderedDict((key, _unmarshaled(item)) for key, item in value[0])
+
+    if isinstance(value, dict):
+        return {key: _unmarshaled(item) for key, item in value.iteritems()}
+
+    if isinstance(value, list):
+        return [_unmarshaled(item) for item in value]
+
+    return value
+
+
+def write_config_snapshot(conf_dir='conf/'):
+    """Validate the config for all clusters and write it to a snapshot with its derived structures
+
+    The snapshot is written with marshal, which is only readable by the same
+    version of Python, so it is generated when the deployment package is created.
+    Each log is kept as JSON in its declared order, to be decoded when first used.
+
+    Args:
+        conf_dir (str): Path of the configuration directory to load and write the snapshot to
+    """
+    clusters_dir = os.path.join(conf_dir, 'clusters')
+    clusters = sorted(os.path.splitext(file_name)[0] for file_name in os.listdir(clusters_dir)
+                      if file_name.endswith('.json'))
+
+    config = _load_config_files(conf_dir, clusters)
     _validate_config(config)
 
+    snapshot = {
+        'config': _marshalable({key: value for key, value in config.iteritems()
+                                if key != 'logs'}),
+        'logs': [(log_name, json.dumps(log_config))
+                 for log_name, log_config in config['logs'].iteritems()],
+        'derived': _derive_config(config)
+    }
+    with open(os.path.join(conf_dir, CONFIG_SNAPSHOT), 'wb') as snapshot_file:
+        marshal.dump(snapshot, snapshot_file)
+
+
+def _load_config_snapshot(conf_dir):
+    """Load the config from the snapshot in the configuration directory, if one exists
+
+    Args:
+        conf_dir (str): Path of the configuration directory
+
+    Returns:
+        dict: The loaded config, or None if the snapshot is missing or could not be loaded
+    """
+    path = os.path.join(conf_dir, CONFIG_SNAPSHOT)
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'rb') as snapshot_file:
+        try:
+            snapshot = marshal.load(snapshot_file)
+        except (EOFError, TypeError, ValueError) as err:
+            LOGGER.error('Invalid config snapshot %s, loading JSON files: %s', path, err)
+            return
+
+    config = _unmarshaled(snapshot['config'])
+    cluster = os.environ.get('CLUSTER', '')
+    if cluster and cluster not in config['clusters']:
+        LOGGER.error('Cluster %s not found in config snapshot, loading JSON files', cluster)
+        return
+
+    config['clusters'] = {cluster: config['clusters'][cluster]} if cluster else {}
+    config['logs'] = SnapshotLogs(snapshot['logs'])
+    config['derived'] = snapshot['derived']
+
     return config
 
 
@@ -14,8 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from collections import defaultdict
+from datetime import datetime
 import json
+from Queue import Queue
 import re
+from threading import Thread
+import uuid
 
 import backoff
 import boto3
@@ -36,6 +40,11 @@ class StreamAlertFirehose(object):
     # This is necessary for sanitization of data prior to searching in Athena.
     SPECIAL_CHAR_REGEX = re.compile(r'\W')
     SPECIAL_CHAR_SUB = '_'
+    # Cache of sanitized keys by original key, shared by all instances
+    _SANITIZED_KEYS = {}
+    MAX_SANITIZED_KEYS = 10000
+    # Cache of Delivery Stream log names by log name, shared by all instances
+    _LOG_NAMES = {}
     # For PutRecordBatch backoff
     MAX_BACKOFF_ATTEMPTS = 10
     # Adds a max of 20 seconds more to the Lambda function
@@ -43,17 +52,47 @@ class StreamAlertFirehose(object):
     # Set Firehose Limits: http://bit.ly/2fw5UY2
     MAX_BATCH_COUNT = 500
     MAX_BATCH_SIZE = 4000 * 1000
-    # The subtraction of 2 accounts for the newline at the end
-    MAX_RECORD_SIZE = 1000 * 1000 - 2
-
-    def __init__(self, region, firehose_config, log_sources):
+    # This includes the newline at the end of each record
+    MAX_RECORD_SIZE = 1000 * 1000
+    # Number of threads used to send to different Delivery Streams concurrently
+    MAX_WORKERS = 8
+    # Bound the number of batches waiting to be sent by each worker
+    MAX_QUEUED_BATCHES = 2
+
+    def __init__(self, region, firehose_config, log_sources, derived=None):
         self._firehose_client = boto3.client('firehose', region_name=region)
-        # Expand enabled logs into specific subtypes
-        self._enabled_logs = self._load_enabled_log_sources(firehose_config, log_sources)
-        # Create a dictionary to hold parsed payloads by log type.
+        # The enabled logs and log names may already be derived in the config snapshot
+        if derived:
+            self._LOG_NAMES.update(derived['log_names'])
+            self._enabled_logs = derived['enabled_logs']
+        else:
+            # Expand enabled logs into specific subtypes
+            self._enabled_logs = self.load_enabled_log_sources(firehose_config, log_sources)
+        # Create a dictionary to hold serialized payloads by log type.
         # Firehose needs this information to send to its corresponding
         # delivery stream.
         self.categorized_payloads = defaultdict(list)
+        # Records that can not be sent are written to S3 if a dead letter bucket is set
+        self._dead_letter_bucket = firehose_config.get('dead_letter_bucket')
+        self._dead_letter_prefix = firehose_config.get('dead_letter_prefix', 'dead_letter')
+        if self._dead_letter_bucket:
+            self._s3_client = boto3.client('s3', region_name=region)
+        # Size, in bytes, of the serialized records buffered for each log type
+        self._payload_sizes = defaultdict(int)
+        # When enabled, many newline delimited records are packed into each
+        # Firehose record to reduce the number of billed 5KB units
+        self._aggregate_records = firehose_config.get('aggregate_records', False)
+        self._aggregates = defaultdict(list)
+        self._aggregate_sizes = defaultdict(int)
+        # Request queue and thread for each worker that has been started, by index
+        self._workers = {}
+
+    def reset(self):
+        """Discard any records that were not sent by the previous invocation"""
+        self.categorized_payloads.clear()
+        self._payload_sizes.clear()
+        self._aggregates.clear()
+        self._aggregate_sizes.clear()
 
     @property
     def enabled_logs(self):
@@ -63,54 +102,54 @@ class StreamAlertFirehose(object):
             list: casts the set of enabled logs into a list for JSON serialization"""
         return list(self._enabled_logs)
 
-    def _segment_records_by_size(self, record_batch):
-        """Segment record groups by size
+    @classmethod
+    def _serialize_record(cls, record):
+        """Sanitize and serialize a record to send to Firehose
 
         Args:
-            record_batch (list): The original record batch to measure and segment
+            record (dict): Parsed record
 
         Returns:
-            generator: Used to iterate on each newly segmented group
+            str: The JSON serialized record, or None if it exceeds the Firehose record size
         """
-        split_factor = 1
-        len_batch = len(record_batch)
+        # The newline at the end is required by Firehose,
+        # otherwise all records will be on a single line and
+        # unsearchable in Athena.
+        data = json.dumps(cls.sanitize_keys(record), separators=(',', ':')) + '\n'
+        if len(data) > cls.MAX_RECORD_SIZE:
+            # Show the first 1k bytes in order to not overload CloudWatch logs
+            LOGGER.error('The following record is too large'
+                         'be sent to Firehose: %s', data[:1000])
+            MetricLogger.log_metric(FUNCTION_NAME,
+                                    MetricLogger.FIREHOSE_FAILED_RECORDS,
+                                    1)
+            return
 
-        # Sample the first batch of records to determine the split factor.
-        # Generally, it's very rare for a group of records to have
-        # drastically different sizes in a single Lambda invocation.
-        while len(json.dumps(record_batch[:len_batch / split_factor],
-                             separators=(",", ":"))) > self.MAX_BATCH_SIZE:
-            split_factor += 1
+        return data
 
-        return self._segment_records_by_count(record_batch, len_batch / split_factor)
+    @classmethod
+    def _sanitize_key(cls, key):
+        """Remove special characters from a key, caching the result
 
-    @staticmethod
-    def _segment_records_by_count(record_list, max_count):
-        """Segment records by length
+        Keys are nearly identical across records since they come from the log
+        schemas, so each unique key only needs to be sanitized once.
 
         Args:
-            record_list (list): The original records list to be segmented
-            max_count (int): The max amount of records to yield per group
+            key (str): Original key from a parsed record
+
+        Returns:
+            str: The sanitized key
         """
-        for index in range(0, len(record_list), max_count):
-            yield record_list[index:index + max_count]
+        sanitized_key = cls._SANITIZED_KEYS.get(key)
+        if sanitized_key is None:
+            # Avoid unbounded growth from records with arbitrary keys
+            if len(cls._SANITIZED_KEYS) >= cls.MAX_SANITIZED_KEYS:
+                cls._SANITIZED_KEYS.clear()
 
-    @classmethod
-    def _limit_record_size(cls, batch):
-        """Limits the batch size sent to Firehose by popping large records
+            sanitized_key = cls.SPECIAL_CHAR_REGEX.sub(cls.SPECIAL_CHAR_SUB, key)
+            cls._SANITIZED_KEYS[key] = sanitized_key
 
-        Args:
-            batch (list): Record batch to iterate on
-        """
-        for index, record in enumerate(batch):
-            if len(json.dumps(record, separators=(",", ":"))) > cls.MAX_RECORD_SIZE:
-                # Show the first 1k bytes in order to not overload CloudWatch logs
-                LOGGER.error('The following record is too large'
-                             'be sent to Firehose: %s', str(record)[:1000])
-                MetricLogger.log_metric(FUNCTION_NAME,
-                                        MetricLogger.FIREHOSE_FAILED_RECORDS,
-                                        1)
-                batch.pop(index)
+        return sanitized_key
 
     @classmethod
     def sanitize_keys(cls, record):
@@ -123,97 +162,168 @@ class StreamAlertFirehose(object):
             record (dict): Original parsed record
 
         Returns:
-            dict: A sanitized record
+            dict: A sanitized record. This is the original record if none of
+                its keys, including those of nested objects, required sanitization.
         """
-        new_record = {}
+        sanitized_items = []
+        changed = False
         for key, value in record.iteritems():
-            sanitized_key = re.sub(cls.SPECIAL_CHAR_REGEX, cls.SPECIAL_CHAR_SUB, key)
+            sanitized_key = cls._sanitize_key(key)
 
             # Handle nested objects
             if isinstance(value, dict):
-                new_record[sanitized_key] = cls.sanitize_keys(record[key])
-            else:
-                new_record[sanitized_key] = record[key]
+                sanitized_value = cls.sanitize_keys(value)
+                changed = changed or sanitized_value is not value
+                value = sanitized_value
+
+            changed = changed or sanitized_key != key
+            sanitized_items.append((sanitized_key, value))
 
-        return new_record
+        return dict(sanitized_items) if changed else record
 
     def _firehose_request_helper(self, stream_name, record_batch):
         """Send record batches to Firehose
 
+        Records that fail to be put are retried with backoff, without resending
+        the records in the batch that succeeded. Requests that raise an error are
+        retried within the same budget of attempts. Records that still fail after
+        the final attempt are written to the dead letter location in S3, if configured.
+
         Args:
             stream_name (str): The name of the Delivery Stream to send to
-            record_batch (list): The records to send
+            record_batch (list): The serialized records to send
         """
-        resp = {}
-        record_batch_size = len(record_batch)
+        # The records remaining to be sent, updated in place after each attempt
+        pending_records = list(record_batch)
+        attempts = [0]
         exceptions_to_backoff = (ClientError, ConnectionError)
 
         @backoff.on_predicate(backoff.fibo,
-                              lambda resp: resp['FailedPutCount'] > 0,
+                              lambda failed_count: failed_count > 0,
                               max_tries=self.MAX_BACKOFF_ATTEMPTS,
                               max_value=self.MAX_BACKOFF_FIBO_VALUE,
                               jitter=backoff.full_jitter,
                               on_backoff=backoff_handler,
                               on_success=success_handler,
                               on_giveup=giveup_handler)
-        @backoff.on_exception(backoff.fibo,
-                              exceptions_to_backoff,
-                              max_tries=self.MAX_BACKOFF_ATTEMPTS,
-                              jitter=backoff.full_jitter,
-                              on_backoff=backoff_handler,
-                              on_success=success_handler,
-                              on_giveup=giveup_handler)
         def firehose_request_wrapper():
-            """Firehose request wrapper to use with backoff"""
+            """Firehose request wrapper to use with backoff
+
+            Returns:
+                int: The number of records that failed to be put in this attempt
+            """
             LOGGER.info('[Firehose] Sending %d records to %s',
-                        record_batch_size,
+                        len(pending_records),
                         stream_name)
-            return self._firehose_client.put_record_batch(
-                DeliveryStreamName=stream_name,
-                # The newline at the end is required by Firehose,
-                # otherwise all records will be on a single line and
-                # unsearchable in Athena.
-                Records=[{'Data': json.dumps(self.sanitize_keys(record),
-                                             separators=(",", ":")) + '\n'}
-                         for record
-                         in record_batch])
-
-        # The try/except here is to catch the raised error at the
-        # end of the backoff.
-        try:
-            resp = firehose_request_wrapper()
-        except exceptions_to_backoff as firehose_err:
-            LOGGER.error(firehose_err)
+            attempts[0] += 1
+            try:
+                resp = self._firehose_client.put_record_batch(
+                    DeliveryStreamName=stream_name,
+                    Records=[{'Data': data} for data in pending_records])
+            except exceptions_to_backoff as firehose_err:
+                # All of the pending records are retried
+                LOGGER.error(firehose_err)
+                return len(pending_records)
+
+            if resp.get('FailedPutCount', 0) > 0:
+                # Responses are in the same order as the records in the request
+                failed_records = [data for data, response
+                                  in zip(pending_records, resp['RequestResponses'])
+                                  if response.get('ErrorCode')]
+            else:
+                failed_records = []
+
+            failed_count = self._record_count(failed_records)
+            sent_count = self._record_count(pending_records) - failed_count
             MetricLogger.log_metric(FUNCTION_NAME,
-                                    MetricLogger.FIREHOSE_FAILED_RECORDS,
-                                    record_batch_size)
+                                    MetricLogger.FIREHOSE_RECORDS_SENT,
+                                    sent_count)
+            if failed_records and attempts[0] < self.MAX_BACKOFF_ATTEMPTS:
+                MetricLogger.log_metric(FUNCTION_NAME,
+                                        MetricLogger.FIREHOSE_RETRIED_RECORDS,
+                                        failed_count)
+
+            if sent_count:
+                LOGGER.info('[Firehose] Successfully sent %d messages to %s with RequestId [%s]',
+                            sent_count,
+                            stream_name,
+                            resp.get('ResponseMetadata', {}).get('RequestId', ''))
+
+            pending_records[:] = failed_records
+            return len(failed_records)
+
+        firehose_request_wrapper()
+
+        if not pending_records:
             return
 
         # Error handle if failures occured in PutRecordBatch after
         # several backoff attempts
-        if resp.get('FailedPutCount') > 0:
-            failed_records = [failed
-                              for failed
-                              in resp['RequestResponses']
-                              if failed.get('ErrorCode')]
-            MetricLogger.log_metric(FUNCTION_NAME,
-                                    MetricLogger.FIREHOSE_FAILED_RECORDS,
-                                    resp['FailedPutCount'])
-            # Only print the first 100 failed records to Cloudwatch logs
-            LOGGER.error('[Firehose] The following records failed to put to '
-                         'the Delivery Stream %s: %s',
-                         stream_name,
-                         json.dumps(failed_records[:100], indent=2))
-        else:
-            MetricLogger.log_metric(FUNCTION_NAME,
-                                    MetricLogger.FIREHOSE_RECORDS_SENT,
-                                    record_batch_size)
-            LOGGER.info('[Firehose] Successfully sent %d messages to %s with RequestId [%s]',
-                        record_batch_size,
-                        stream_name,
-                        resp.get('ResponseMetadata', {}).get('RequestId', ''))
+        MetricLogger.log_metric(FUNCTION_NAME,
+                                MetricLogger.FIREHOSE_FAILED_RECORDS,
+                                self._record_count(pending_records))
+        # Only print the first 100 failed records to Cloudwatch logs
+        LOGGER.error('[Firehose] The following records failed to put to '
+                     'the Delivery Stream %s: %s',
+                     stream_name,
+                     json.dumps(pending_records[:100], indent=2))
+
+        self._write_dead_letter(stream_name, pending_records)
+
+    def _record_count(self, record_batch):
+        """Count the parsed records within a batch of Firehose records
+
+        Args:
+            record_batch (list): Serialized Firehose records
+
+        Returns:
+            int: The number of parsed records. When records are aggregated, each
+                Firehose record holds many newline delimited records.
+        """
+        if not self._aggregate_records:
+            return len(record_batch)
+
+        # Newlines within values are escaped by JSON serialization, so each
+        # newline marks the end of a record
+        return sum(data.count('\n') for data in record_batch)
+
+    def _write_dead_letter(self, stream_name, records):
+        """Write records that could not be sent to Firehose to the dead letter location
+
+        The records are written as a single newline delimited object, in the same
+        format that Firehose delivers to S3, so they can easily be replayed.
+
+        Args:
+            stream_name (str): The name of the Delivery Stream the records were sent to
+            records (list): The serialized records that failed to be sent
+        """
+        if not self._dead_letter_bucket:
+            return
+
+        key = '{}/{}/dt={}/{}.json'.format(self._dead_letter_prefix,
+                                           stream_name,
+                                           datetime.utcnow().strftime('%Y-%m-%d-%H'),
+                                           uuid.uuid4())
+        try:
+            self._s3_client.put_object(Bucket=self._dead_letter_bucket,
+                                       Key=key,
+                                       Body=''.join(records))
+        except ClientError as err:
+            LOGGER.error('[Firehose] Failed to write %d records to dead letter '
+                         'location s3://%s/%s: %s',
+                         len(records),
+                         self._dead_letter_bucket,
+                         key,
+                         err.response)
+            return
 
-    def firehose_log_name(self, log_name):
+        LOGGER.info('[Firehose] Wrote %d failed records to dead letter location s3://%s/%s',
+                    len(records),
+                    self._dead_letter_bucket,
+                    key)
+
+    @classmethod
+    def firehose_log_name(cls, log_name):
         """Convert conventional log names into Firehose delievery stream names
 
         Args:
@@ -222,7 +332,12 @@ class StreamAlertFirehose(object):
         Returns
             str: Converted name which corresponds to a Firehose Delievery Stream
         """
-        return re.sub(self.SPECIAL_CHAR_REGEX, '_', log_name)
+        firehose_log_name = cls._LOG_NAMES.get(log_name)
+        if firehose_log_name is None:
+            firehose_log_name = re.sub(cls.SPECIAL_CHAR_REGEX, '_', log_name)
+            cls._LOG_NAMES[log_name] = firehose_log_name
+
+        return firehose_log_name
 
     def enabled_log_source(self, log_source_name):
         """Check that the incoming record is an enabled log source for Firehose
@@ -233,9 +348,10 @@ class StreamAlertFirehose(object):
         Returns:
             bool: Whether or not the log source is enabled to send to Firehose
         """
-        return self.firehose_log_name(log_source_name) in self.enabled_logs
+        return self.firehose_log_name(log_source_name) in self._enabled_logs
 
-    def _load_enabled_log_sources(self, firehose_config, log_sources):
+    @classmethod
+    def load_enabled_log_sources(cls, firehose_config, log_sources):
         """Load and expand all declared and enabled Firehose log sources
 
         Args:
@@ -243,7 +359,7 @@ class StreamAlertFirehose(object):
             log_sources (dict): Loaded logs.json file
 
         Returns:
-            set: Disabled logs
+            set: Enabled logs, expanded to all subtypes
         """
         enabled_logs = set()
         for enabled_log in firehose_config.get('enabled_logs', []):
@@ -251,7 +367,7 @@ class StreamAlertFirehose(object):
 
             # Expand to all subtypes
             if len(enabled_log_parts) == 1:
-                expanded_logs = [self.firehose_log_name(log_name) for log_name
+                expanded_logs = [cls.firehose_log_name(log_name) for log_name
                                  in log_sources
                                  if log_name.split(':')[0] == enabled_log_parts[0]]
                 # If the list comprehension is Falsey, it means no matching logs
@@ -265,24 +381,162 @@ class StreamAlertFirehose(object):
                 if enabled_log not in log_sources:
                     LOGGER.error('Enabled Firehose log %s not declared in logs.json', enabled_log)
 
-                enabled_logs.add(self.firehose_log_name('_'.join(enabled_log_parts)))
+                enabled_logs.add(cls.firehose_log_name('_'.join(enabled_log_parts)))
 
         return enabled_logs
 
+    def add_records(self, log_type, records):
+        """Buffer classified records, sending them as soon as a full batch is available
+
+        Each record is sanitized and serialized once when it is added, and batches
+        are packed using the exact serialized size. Records for a log type are sent
+        once they reach the PutRecordBatch count or size limit, which keeps the
+        buffered records bounded regardless of the number of records processed in
+        a single invocation.
+
+        Args:
+            log_type (str): The log type of the records, as declared in logs.json
+            records (list): Parsed records to send to the log type's Delivery Stream
+        """
+        for record in records:
+            data = self._serialize_record(record)
+            if not data:
+                continue
+
+            if self._aggregate_records:
+                self._aggregate_record(log_type, data)
+            else:
+                self._buffer_record(log_type, data)
+
+    def _aggregate_record(self, log_type, data):
+        """Pack a serialized record into the current aggregate Firehose record
+
+        The aggregate is buffered to be sent once the next record would exceed
+        the Firehose record size limit. Since each record ends with a newline,
+        the aggregate is delivered to S3 exactly as the individual records would be.
+
+        Args:
+            log_type (str): The log type of the record
+            data (str): The serialized record
+        """
+        aggregate = self._aggregates[log_type]
+        if aggregate and self._aggregate_sizes[log_type] + len(data) > self.MAX_RECORD_SIZE:
+            self._buffer_aggregate(log_type)
+
+        aggregate.append(data)
+        self._aggregate_sizes[log_type] += len(data)
+
+    def _buffer_aggregate(self, log_type):
+        """Buffer the current aggregate Firehose record for a log type to be sent
+
+        Args:
+            log_type (str): The log type of the aggregate
+        """
+        aggregate = self._aggregates[log_type]
+        if not aggregate:
+            return
+
+        self._buffer_record(log_type, ''.join(aggregate))
+        del aggregate[:]
+        self._aggregate_sizes[log_type] = 0
+
+    def _buffer_record(self, log_type, data):
+        """Buffer a serialized Firehose record, sending the batch if it is full
+
+        Args:
+            log_type (str): The log type of the record
+            data (str): The serialized Firehose record
+        """
+        buffered_records = self.categorized_payloads[log_type]
+        if (buffered_records and
+                self._payload_sizes[log_type] + len(data) > self.MAX_BATCH_SIZE):
+            self._flush_log_type(log_type)
+
+        buffered_records.append(data)
+        self._payload_sizes[log_type] += len(data)
+
+        if len(buffered_records) >= self.MAX_BATCH_COUNT:
+            self._flush_log_type(log_type)
+
+    def _flush_log_type(self, log_type):
+        """Send and clear the buffered records for a log type
+
+        The buffered records always fit within a single PutRecordBatch request.
+
+        Args:
+            log_type (str): The log type of the buffered records
+        """
+        records = self.categorized_payloads[log_type]
+        if not records:
+            return
+
+        # This same substitution method is used when naming the Delivery Streams
+        stream_name = 'streamalert_data_{}'.format(self.firehose_log_name(log_type))
+        self._queue_request(stream_name, records[:])
+
+        del records[:]
+        self._payload_sizes[log_type] = 0
+
+    def _queue_request(self, stream_name, record_batch):
+        """Queue a batch of records to be sent by a worker thread
+
+        All batches for a Delivery Stream are sent by the same worker, which keeps
+        them in order, while different Delivery Streams are sent concurrently.
+
+        Args:
+            stream_name (str): The name of the Delivery Stream to send to
+            record_batch (list): The serialized records to send
+        """
+        index = hash(stream_name) % self.MAX_WORKERS
+        if index not in self._workers:
+            request_queue = Queue(maxsize=self.MAX_QUEUED_BATCHES)
+            worker = Thread(target=self._worker, args=(request_queue,))
+            worker.daemon = True
+            worker.start()
+            self._workers[index] = (request_queue, worker)
+
+        self._workers[index][0].put((stream_name, record_batch))
+
+    def _worker(self, request_queue):
+        """Send queued batches of records until signaled to exit
+
+        Args:
+            request_queue (Queue): The queue of (stream name, record batch) to send
+        """
+        while True:
+            request = request_queue.get()
+            if request is None:
+                return
+
+            stream_name, record_batch = request
+            try:
+                self._firehose_request_helper(stream_name, record_batch)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('[Firehose] An error occurred while sending %d records to %s',
+                                 len(record_batch), stream_name)
+                MetricLogger.log_metric(FUNCTION_NAME,
+                                        MetricLogger.FIREHOSE_FAILED_RECORDS,
+                                        self._record_count(record_batch))
+
     def send(self):
-        """Send all classified records to a respective Firehose Delivery Stream"""
-        delivery_stream_name_pattern = 'streamalert_data_{}'
+        """Send all remaining classified records to a respective Firehose Delivery Stream
+
+        This waits for all queued batches to be sent before returning.
+        """
+        for log_type in self._aggregates:
+            self._buffer_aggregate(log_type)
 
         # Iterate through each set of categorized payloads.
         # Each batch will be processed to their specific Firehose, which lands the data
         # in a specific prefix in S3.
-        for log_type, records in self.categorized_payloads.iteritems():
-            # This same substitution method is used when naming the Delivery Streams
-            formatted_log_type = self.firehose_log_name(log_type)
-
-            # Process each record batch in the categorized payload set
-            for record_batch in self._segment_records_by_count(records, self.MAX_BATCH_COUNT):
-                stream_name = delivery_stream_name_pattern.format(formatted_log_type)
-                self._limit_record_size(record_batch)
-                for sized_batch in self._segment_records_by_size(record_batch):
-                    self._firehose_request_helper(stream_name, sized_batch)
+        for log_type in self.categorized_payloads:
+            self._flush_log_type(log_type)
+
+        # Signal each worker to exit once its queue has been drained
+        for request_queue, _ in self._workers.itervalues():
+            request_queue.put(None)
+
+        for _, worker in self._workers.itervalues():
+            worker.join()
+
+        self._workers.clear()
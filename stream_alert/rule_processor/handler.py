@@ -23,7 +23,8 @@ from stream_alert.rule_processor.firehose import StreamAlertFirehose
 from stream_alert.rule_processor.payload import load_stream_payload
 from stream_alert.rule_processor.rules_engine import StreamRules
 from stream_alert.rule_processor.sink import StreamSink
-from stream_alert.shared.metrics import MetricLogger
+from stream_alert.shared.metrics import METRICS, MetricLogger
+from stream_alert.shared.stats import MATCHER_STATS, RULE_STATS, TIMERS
 
 
 class StreamAlert(object):
@@ -49,7 +50,7 @@ class StreamAlert(object):
 
         # Instantiate the sink here to handle sending the triggered alerts to the
         # alert processor
-        self.sinker = StreamSink(self.env)
+        self.sinker = StreamSink(self.env, self.config)
 
         # Instantiate a classifier that is used for this run
         self.classifier = StreamClassifier(config=self.config)
@@ -64,9 +65,23 @@ class StreamAlert(object):
         # StreamAlert class as an instance property
         self._rule_engine = StreamRules(self.config)
 
-        # Firehose client attribute
+        # Firehose client attribute, created on the first run if Firehose is enabled
         self._firehose_client = None
 
+    def _reset(self):
+        """Reset the state of the previous invocation
+
+        The sink, classifier, rules engine and Firehose client, along with their
+        AWS clients, are kept to be reused by warm invocations of the function.
+        """
+        self._failed_record_count = 0
+        self._processed_record_count = 0
+        self._processed_size = 0
+        self._alerts = []
+        self.sinker.reset()
+        if self._firehose_client:
+            self._firehose_client.reset()
+
     def run(self, event):
         """StreamAlert Lambda function handler.
 
@@ -82,16 +97,20 @@ class StreamAlert(object):
         Returns:
             bool: True if all logs being parsed match a schema
         """
+        self._reset()
+
         records = event.get('Records', [])
         LOGGER.debug('Number of incoming records: %d', len(records))
         if not records:
             return False
 
         firehose_config = self.config['global'].get('infrastructure', {}).get('firehose', {})
-        if firehose_config.get('enabled'):
-            self._firehose_client = StreamAlertFirehose(self.env['lambda_region'],
-                                                        firehose_config,
-                                                        self.config['logs'])
+        if firehose_config.get('enabled') and not self._firehose_client:
+            self._firehose_client = StreamAlertFirehose(
+                self.env['lambda_region'],
+                firehose_config,
+                self.config['logs'],
+                derived=self.config.get('derived', {}).get('firehose'))
 
         payload_with_normalized_records = []
         for raw_record in records:
@@ -113,8 +132,12 @@ class StreamAlert(object):
             if not self.classifier.load_sources(service, entity):
                 continue
 
+            # Objects in S3 can hold JSON documents whose records are streamed
+            json_stream_paths = self.classifier.get_json_stream_paths() if service == 's3' else None
+
             # Create the StreamPayload to use for encapsulating parsed info
-            payload = load_stream_payload(service, entity, raw_record)
+            payload = load_stream_payload(service, entity, raw_record,
+                                          json_stream_paths=json_stream_paths)
             if not payload:
                 continue
 
@@ -122,11 +145,20 @@ class StreamAlert(object):
 
         LOGGER.info('Got %d normalized records', len(payload_with_normalized_records))
         # Apply Threat Intel to normalized records in the end of Rule Processor invocation
+        start = TIMERS.start()
         record_alerts = self._rule_engine.threat_intel_match(payload_with_normalized_records)
+        TIMERS.stop('threat_intel', start)
         self._alerts.extend(record_alerts)
+
+        start = TIMERS.start()
         if record_alerts and self.enable_alert_processor:
             self.sinker.sink(record_alerts)
 
+        # Send any alerts remaining in the sink's current batch
+        if self.enable_alert_processor:
+            self.sinker.flush()
+        TIMERS.stop('sink', start)
+
         MetricLogger.log_metric(FUNCTION_NAME,
                                 MetricLogger.TOTAL_RECORDS,
                                 self._processed_record_count)
@@ -153,7 +185,16 @@ class StreamAlert(object):
             LOGGER.debug('Alerts:\n%s', json.dumps(self._alerts, indent=2))
 
         if self._firehose_client:
+            start = TIMERS.start()
             self._firehose_client.send()
+            TIMERS.stop('firehose', start)
+
+        # Log the time spent in each stage, then publish all
+        # metrics buffered during this invocation, if enabled
+        TIMERS.report()
+        RULE_STATS.report()
+        MATCHER_STATS.report()
+        METRICS.flush()
 
         return self._failed_record_count == 0
 
@@ -172,9 +213,9 @@ class StreamAlert(object):
             payload (StreamPayload): StreamAlert payload object being processed
         """
         payload_with_normalized_records = []
-        for record in payload.pre_parse():
+        for record in TIMERS.timed_iter('pre_parse', payload.pre_parse()):
             # Increment the processed size using the length of this record
-            self._processed_size += len(record.pre_parsed_record)
+            self._processed_size += record.pre_parsed_size()
             self.classifier.classify_record(record)
             if not record.valid:
                 if self.env['lambda_alias'] != 'development':
@@ -186,6 +227,8 @@ class StreamAlert(object):
 
             # Increment the total processed records to get an accurate assessment of throughput
             self._processed_record_count += len(record.records)
+            METRICS.increment(MetricLogger.TOTAL_RECORDS, len(record.records),
+                              {'LogSource': record.log_source})
 
             LOGGER.debug(
                 'Classified and Parsed Payload: <Valid: %s, Log Source: %s, Entity: %s>',
@@ -193,7 +236,9 @@ class StreamAlert(object):
                 record.log_source,
                 record.entity)
 
+            start = TIMERS.start()
             record_alerts, normalized_records = self._rule_engine.process(record)
+            TIMERS.stop('rules', start)
 
             payload_with_normalized_records.extend(normalized_records)
 
@@ -205,8 +250,9 @@ class StreamAlert(object):
             if self._firehose_client:
                 # Only send payloads with enabled log sources
                 if self._firehose_client.enabled_log_source(payload.log_source):
-                    self._firehose_client.categorized_payloads[payload.log_source].extend(
-                        payload.records)
+                    start = TIMERS.start()
+                    self._firehose_client.add_records(payload.log_source, payload.records)
+                    TIMERS.stop('firehose', start)
 
             if not record_alerts:
                 continue
@@ -215,6 +261,8 @@ class StreamAlert(object):
             self._alerts.extend(record_alerts)
 
             if self.enable_alert_processor:
+                start = TIMERS.start()
                 self.sinker.sink(record_alerts)
+                TIMERS.stop('sink', start)
 
         return payload_with_normalized_records
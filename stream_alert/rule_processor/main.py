@@ -13,10 +13,29 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from collections import OrderedDict
 import importlib
+import json
 import os
+import time
 
+from stream_alert.rule_processor import LOGGER
+from stream_alert.rule_processor.config import load_config
 from stream_alert.rule_processor.handler import StreamAlert
+from stream_alert.rule_processor.rules_engine import StreamRules
+
+# Name of the rule manifest written to the root of the deployment package
+RULES_MANIFEST = 'rules_manifest.json'
+
+try:
+    LAZY_RULE_LOADING = bool(int(os.environ.get('LAZY_RULE_LOADING', 0)))
+except ValueError as err:
+    LAZY_RULE_LOADING = False
+    LOGGER.error('Invalid value for LAZY_RULE_LOADING, lazy rule loading is disabled: %s',
+                 err.message)
+
+# Map of each imported rule module to the time in milliseconds it took to import
+RULE_IMPORT_TIMES = OrderedDict()
 
 
 def _python_rule_paths():
@@ -45,15 +64,141 @@ def _path_to_module(path):
     return os.path.splitext(path)[0].replace('/', '.')
 
 
-def _import_rules():
-    """Dynamically import all rules files."""
+def _import_module(module):
+    """Import a rule module and record how long the import took"""
+    start = time.time()
+    importlib.import_module(module)
+    RULE_IMPORT_TIMES[module] = round((time.time() - start) * 1000, 4)
+
+
+def build_rules_manifest():
+    """Import all rules files and map each module to the logs and datatypes of its rules
+
+    Modules without any rules, such as matchers, map to empty lists and are
+    always imported when loading rules lazily.
+
+    Returns:
+        dict: Map of module name to a dict with the sorted 'logs' and 'datatypes'
+            of the rules defined in that module
+    """
+    manifest = {}
     for path in _python_rule_paths():
-        importlib.import_module(_path_to_module(path))
+        module = _path_to_module(path)
+        importlib.import_module(module)
+        manifest[module] = {'logs': set(), 'datatypes': set()}
+
+    for rule_attrs in StreamRules.get_rules().itervalues():
+        module_info = manifest.get(rule_attrs.rule_function.__module__)
+        if module_info is None:
+            continue
+        module_info['logs'].update(rule_attrs.logs or [])
+        module_info['datatypes'].update(rule_attrs.datatypes or [])
+
+    return {module: {key: sorted(values) for key, values in info.iteritems()}
+            for module, info in manifest.iteritems()}
+
+
+def _load_rules_manifest(path=RULES_MANIFEST):
+    """Load the rule manifest generated when the deployment package was created
+
+    Returns:
+        dict: The loaded manifest, or None if it does not exist or is invalid
+    """
+    if not os.path.exists(path):
+        return
+
+    with open(path) as manifest_file:
+        try:
+            return json.load(manifest_file)
+        except ValueError:
+            LOGGER.error('Invalid JSON format for %s, all rules will be imported', path)
+
+
+def _configured_datatypes(config):
+    """Return the log types and normalized datatypes of all configured sources
+
+    Args:
+        config (dict): Loaded StreamAlert config
+
+    Returns:
+        tuple: (set of log types, set of normalized datatypes)
+    """
+    prefixes = set()
+    for entities in config['sources'].itervalues():
+        for entity in entities.itervalues():
+            prefixes.update(entity['logs'])
+
+    log_types = {log_type for log_type in config['logs']
+                 if log_type.split(':')[0] in prefixes}
+    # Types may be qualified with an IOC type, ie: 'sourceAddress:ioc_ip'
+    datatypes = set()
+    for prefix, normalized_types in config['types'].iteritems():
+        if prefix in prefixes:
+            datatypes.update(datatype.split(':')[0] for datatype in normalized_types)
+
+    return log_types, datatypes
+
+
+def _select_rule_modules(manifest, config):
+    """Select the rule modules that can match records from the configured sources
+
+    A module is selected if it has no rules, or if any of its rules apply
+    to one of the configured log types or normalized datatypes.
+
+    Returns:
+        list: Sorted names of the modules to import
+    """
+    log_types, datatypes = _configured_datatypes(config)
+
+    return sorted(
+        module for module, info in manifest.iteritems()
+        if not (info['logs'] or info['datatypes'])
+        or log_types.intersection(info['logs'])
+        or datatypes.intersection(info['datatypes'])
+    )
+
+
+def _import_rules():
+    """Dynamically import rules files
+
+    If lazy rule loading is enabled and the deployment package includes a
+    rule manifest, only modules with rules for the configured sources are
+    imported. Otherwise, all rules files are imported.
+    """
+    start = time.time()
+
+    manifest = _load_rules_manifest() if LAZY_RULE_LOADING else None
+    if manifest is not None:
+        # Keep the loaded config for the handler to use on the first invocation
+        StreamAlert.config = StreamAlert.config or load_config()
+        modules = _select_rule_modules(manifest, StreamAlert.config)
+        LOGGER.debug('Lazily importing %d of %d rule modules', len(modules), len(manifest))
+    else:
+        modules = [_path_to_module(path) for path in _python_rule_paths()]
+
+    for module in modules:
+        _import_module(module)
+
+    LOGGER.debug('Imported %d rule modules in %.2fms: %s', len(modules),
+                 (time.time() - start) * 1000, json.dumps(RULE_IMPORT_TIMES))
 
 
 _import_rules()
 
 
+# StreamAlert instances by invoked function ARN, reused by warm invocations
+_PROCESSORS = {}
+
+
 def handler(event, context):
-    """Main Lambda handler function"""
-    StreamAlert(context).run(event)
+    """Main Lambda handler function
+
+    The StreamAlert instance, along with its AWS clients, is created on the first
+    invocation of a container and reused by the following warm invocations.
+    """
+    processor = _PROCESSORS.get(context.invoked_function_arn)
+    if processor is None:
+        processor = StreamAlert(context)
+        _PROCESSORS[context.invoked_function_arn] = processor
+
+    processor.run(event)
@@ -24,7 +24,7 @@ import StringIO
 import jsonpath_rw
 
 from stream_alert.rule_processor import LOGGER, LOGGER_DEBUG_ENABLED
-from stream_alert.shared.stats import time_me
+from stream_alert.shared.stats import TIMERS
 
 PARSERS = {}
 ENVELOPE_KEY = 'streamalert:envelope_keys'
@@ -199,7 +199,7 @@ class JSONParser(ParserBase):
                     # Set default value
                     record[key_name] = _default_optional_values(schema[key_name])
 
-    @time_me
+    @TIMERS.timed('parse_json_records')
     def _parse_records(self, schema, json_payload):
         """Identify and extract nested payloads from parsed JSON records.
 
@@ -289,7 +289,7 @@ class JSONParser(ParserBase):
 
         return json_records
 
-    @time_me
+    @TIMERS.timed('parse_json')
     def parse(self, schema, data):
         """Parse a string into a list of JSON payloads.
 
@@ -17,8 +17,12 @@ from abc import ABCMeta, abstractmethod, abstractproperty
 from logging import DEBUG as LOG_LEVEL_DEBUG
 from urllib import unquote
 import base64
+import bz2
 import gzip
+import hashlib
+import json
 import os
+import re
 import tempfile
 import time
 import zlib
@@ -28,14 +32,215 @@ import boto3
 from stream_alert.rule_processor import FUNCTION_NAME, LOGGER
 from stream_alert.shared.metrics import MetricLogger
 
+# Records produced with the Kinesis Producer Library (KPL) aggregation
+# begin with this magic number and end with a 16 byte MD5 digest
+KPL_MAGIC = '\xf3\x89\x9a\xc2'
+KPL_DIGEST_SIZE = 16
+KPL_MIN_SIZE = len(KPL_MAGIC) + KPL_DIGEST_SIZE
 
-def load_stream_payload(service, entity, raw_record):
+# Magic bytes used to detect the codec of compressed data
+GZIP_MAGIC = '\x1f\x8b\x08'
+BZ2_MAGIC = 'BZh'
+BZ2_BLOCK_MAGICS = {'1AY&SY', '\x17rE8P\x90'}
+CODEC_SNIFF_SIZE = 64
+BASE64_PATTERN = re.compile(r'^[A-Za-z0-9+/]+={0,2}$')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def detect_codec(data):
+    """Detect the codec of the data from its leading magic bytes
+
+    zlib streams have no magic number, so the two byte header checksum is verified
+    and a small prefix of the data is decompressed to rule out plain text.
+
+    Args:
+        data (str): The data, or at least its first `CODEC_SNIFF_SIZE` bytes
+
+    Returns:
+        str: One of 'gzip', 'bz2' or 'zlib', or None if the data is not compressed
+    """
+    if data.startswith(GZIP_MAGIC):
+        return 'gzip'
+
+    if (data.startswith(BZ2_MAGIC) and data[3:4].isdigit() and
+            data[4:10] in BZ2_BLOCK_MAGICS):
+        return 'bz2'
+
+    if len(data) < 2:
+        return
+
+    # The compression method must be deflate with no preset dictionary
+    cmf, flg = ord(data[0]), ord(data[1])
+    if cmf & 0x0f != 8 or cmf >> 4 > 7 or flg & 0x20 or (cmf << 8 | flg) % 31:
+        return
+
+    try:
+        zlib.decompressobj().decompress(data[:CODEC_SNIFF_SIZE])
+    except zlib.error:
+        return
+
+    return 'zlib'
+
+
+_DECOMPRESSORS = {
+    'gzip': lambda data: zlib.decompress(data, 16 + zlib.MAX_WBITS),
+    'bz2': bz2.decompress,
+    'zlib': zlib.decompress
+}
+
+
+def decode_data(data):
+    """Decompress the data using the codec detected from its magic bytes
+
+    Args:
+        data: The raw data of a record. Only str values can be compressed,
+            anything else is returned as is.
+
+    Returns:
+        The decompressed data, or the original data if it is not compressed
+    """
+    if not isinstance(data, str):
+        return data
+
+    codec = detect_codec(data)
+    if not codec:
+        return data
+
+    try:
+        return _DECOMPRESSORS[codec](data)
+    except (IOError, ValueError, zlib.error) as err:
+        LOGGER.debug('Failed to decompress %s data, treating it as plain data: %s', codec, err)
+        return data
+
+
+def decode_text(data):
+    """Decompress data received through a text transport, such as SNS messages or app logs
+
+    Binary data can only be sent through these transports once base64 encoded, so
+    base64 text is decoded and decompressed when its content is compressed.
+
+    Args:
+        data: The raw data of a record. Only str and unicode values can be compressed,
+            anything else is returned as is.
+
+    Returns:
+        The decompressed data, or the original data if it is not compressed
+    """
+    if not isinstance(data, basestring):
+        return data
+
+    try:
+        raw = data.encode('ascii') if isinstance(data, unicode) else data
+    except UnicodeEncodeError:
+        return data
+
+    if detect_codec(raw):
+        return decode_data(raw)
+
+    if len(raw) % 4 or not BASE64_PATTERN.match(raw):
+        return data
+
+    decoded = base64.b64decode(raw)
+    if not detect_codec(decoded):
+        return data
+
+    result = decode_data(decoded)
+    return data if result is decoded else result
+
+
+def open_decoded(path):
+    """Open a file for reading, decompressing it with the codec detected from its magic bytes
+
+    Args:
+        path (str): Path to the file on disk
+
+    Returns:
+        file: A file-like object supporting `read`, line iteration and `with` statements
+    """
+    with open(path, 'rb') as data:
+        codec = detect_codec(data.read(CODEC_SNIFF_SIZE))
+
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+
+    if codec == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+
+    if codec == 'zlib':
+        return ZlibFile(path)
+
+    return open(path, 'rb')
+
+
+class ZlibFile(object):
+    """Read only file object that incrementally decompresses a zlib stream on disk"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._decompressor = zlib.decompressobj()
+        self._buffer = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __iter__(self):
+        pending = ''
+        for data in iter(lambda: self.read(READ_CHUNK_SIZE), ''):
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+
+        if pending:
+            yield pending
+
+    def _fill(self):
+        """Decompress the next chunk of the file into the buffer
+
+        Returns:
+            bool: False if the end of the stream was already reached
+        """
+        if not self._decompressor:
+            return False
+
+        chunk = self._file.read(READ_CHUNK_SIZE)
+        if chunk:
+            self._buffer += self._decompressor.decompress(chunk)
+        else:
+            self._buffer += self._decompressor.flush()
+            self._decompressor = None
+
+        return True
+
+    def read(self, size=-1):
+        """Read up to size bytes of decompressed data, or all remaining data if negative"""
+        while (size < 0 or len(self._buffer) < size) and self._fill():
+            pass
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        """Close the underlying file"""
+        self._file.close()
+
+
+def load_stream_payload(service, entity, raw_record, **kwargs):
     """Returns the right StreamPayload subclass for this service
 
     Args:
         service (str): service name to load class for
         entity (str): entity for this service
         raw_record (str): record raw payload data
+
+    Keyword Args:
+        json_stream_paths (list): Paths of JSON arrays to stream from S3 objects
     """
     payload_map = {'s3': S3Payload,
                    'sns': SnsPayload,
@@ -46,7 +251,7 @@ def load_stream_payload(service, entity, raw_record):
         LOGGER.error('Service payload not supported: %s', service)
         return
 
-    return payload_map[service](raw_record=raw_record, entity=entity)
+    return payload_map[service](raw_record=raw_record, entity=entity, **kwargs)
 
 
 class StreamPayload(object):
@@ -77,6 +282,7 @@ class StreamPayload(object):
         self.raw_record = kwargs['raw_record']
         self.entity = kwargs['entity']
         self.pre_parsed_record = None
+        self._pre_parsed_size = None
 
         self._refresh_record(None)
 
@@ -112,7 +318,18 @@ class StreamPayload(object):
                 payloads, such as those similar to S3.
         """
 
-    def _refresh_record(self, new_record):
+    def pre_parsed_size(self):
+        """Size of the currently loaded record, in bytes for raw records
+
+        Returns:
+            int: The size of the record
+        """
+        if self._pre_parsed_size is not None:
+            return self._pre_parsed_size
+
+        return len(self.pre_parsed_record)
+
+    def _refresh_record(self, new_record, size=None):
         """Replace the currently loaded record with a new one.
 
         Used mainly when S3 is used as a source, due to looping over files
@@ -121,14 +338,76 @@ class StreamPayload(object):
 
         Args:
             new_record (str): A new raw record to be parsed
+            size (int): Size of the record in bytes, if it was already decoded
         """
         self.pre_parsed_record = new_record
+        self._pre_parsed_size = size
         self.log_source = None
         self.records = None
         self.type = None
         self.valid = False
 
 
+class RecordContext(object):
+    """The source of classified records, shared by all records parsed from a payload
+
+    Records that are kept after their payload has moved on to the next record,
+    such as normalized records for threat intel, reference this instead of a copy
+    of the payload, so the raw and parsed data of the payload is not kept alive.
+    """
+    __slots__ = ('log_source', 'type', 'entity', '_service')
+
+    def __init__(self, payload):
+        """
+        Args:
+            payload (StreamPayload): A classified payload
+        """
+        self.log_source = payload.log_source
+        self.type = payload.type
+        self.entity = payload.entity
+        self._service = payload.service()
+
+    def service(self):
+        """Returns the name of the service the records were sent from, like a payload"""
+        return self._service
+
+
+class NormalizedRecord(object):
+    """A normalized record with the context of the payload it was parsed from
+
+    This provides the attributes of a payload used for threat intel and alerts.
+    """
+    __slots__ = ('context', 'pre_parsed_record')
+
+    def __init__(self, context, record):
+        """
+        Args:
+            context (RecordContext): The context shared by records from the same payload
+            record (dict): The record, including its normalized types
+        """
+        self.context = context
+        self.pre_parsed_record = record
+
+    @property
+    def log_source(self):
+        """The log source of the payload the record was parsed from"""
+        return self.context.log_source
+
+    @property
+    def type(self):
+        """The type of the payload the record was parsed from"""
+        return self.context.type
+
+    @property
+    def entity(self):
+        """The entity of the payload the record was parsed from"""
+        return self.context.entity
+
+    def service(self):
+        """Returns the name of the service the record was sent from"""
+        return self.context.service()
+
+
 class S3ObjectSizeError(Exception):
     """Exception indicating the S3 object is too large to process"""
 
@@ -137,6 +416,15 @@ class S3Payload(StreamPayload):
     """S3Payload class"""
     s3_object_size = 0
 
+    def __init__(self, **kwargs):
+        """
+        Keyword Args:
+            json_stream_paths (list): Paths of JSON arrays whose elements should be
+                streamed as individual records from objects holding JSON documents
+        """
+        super(S3Payload, self).__init__(**kwargs)
+        self.json_stream_paths = kwargs.get('json_stream_paths')
+
     def service(self):
         return 's3'
 
@@ -154,9 +442,10 @@ class S3Payload(StreamPayload):
         """
         s3_file = self._get_object()
         line_num, processed_size = 0, 0
-        for line_num, data in self._read_downloaded_s3_object(s3_file):
+        for line_num, data, size in self._read_downloaded_s3_object(s3_file,
+                                                                    self.json_stream_paths):
 
-            self._refresh_record(data)
+            self._refresh_record(data, size)
             yield self
 
             # Only do the extra calculations below if debug logging is enabled
@@ -164,8 +453,8 @@ class S3Payload(StreamPayload):
                 continue
 
             # Add the current data to the total processed size
-            # +1 to account for line feed
-            processed_size += (len(data) + 1)
+            # +1 to account for line feed or array separator
+            processed_size += (size + 1)
 
             # Log a debug message on every 100 lines processed
             if line_num % 100 == 0:
@@ -246,25 +535,37 @@ class S3Payload(StreamPayload):
         return self._download_object(region, bucket, key)
 
     @staticmethod
-    def _read_downloaded_s3_object(s3_object):
+    def _read_downloaded_s3_object(s3_object, json_stream_paths=None):
         """Read lines from a downloaded file from S3
 
-        Supports reading both gzipped files and plaintext files.
+        Supports reading gzip, bz2 and zlib compressed files as well as plaintext
+        files, based on the magic bytes of the file rather than its extension.
+
+        If the file starts with a JSON document containing an array at one of the
+        `json_stream_paths`, the elements of the array are streamed instead of lines.
 
         Args:
             s3_object (str): A full path to the downloaded file.
+            json_stream_paths (list): Paths of JSON arrays to stream.
 
         Yields:
-            (str) Lines from the downloaded s3 object.
+            tuple: The record number, the line or streamed JSON record from the
+                downloaded s3 object, and its size in bytes.
         """
-        _, extension = os.path.splitext(s3_object)
-
-        if extension == '.gz':
-            for num, line in enumerate(gzip.open(s3_object, 'r'), start=1):
-                yield num, line.rstrip()
-        else:
-            for num, line in enumerate(open(s3_object, 'r'), start=1):
-                yield num, line.rstrip()
+        streamed = False
+        if json_stream_paths:
+            with open_decoded(s3_object) as s3_file:
+                json_stream = JSONArrayStream(s3_file, json_stream_paths)
+                if json_stream.find():
+                    streamed = True
+                    for num, (record, size) in enumerate(json_stream, start=1):
+                        yield num, record, size
+
+        if not streamed:
+            with open_decoded(s3_object) as s3_file:
+                for num, line in enumerate(s3_file, start=1):
+                    line = line.rstrip()
+                    yield num, line, len(line)
 
         # AWS Lambda apparently does not reallocate disk space when files are
         # removed using os.remove(), so we must truncate them before removal
@@ -277,6 +578,229 @@ class S3Payload(StreamPayload):
             LOGGER.error('Failed to remove temp S3 file: %s', s3_object)
 
 
+class JSONArrayStream(object):
+    """Incrementally parse a file of JSON documents, yielding each element of an
+    array at one of the configured paths as an individual record
+
+    Each record is a copy of its document where the array only holds that element.
+    Only the current element is held in memory, along with the keys preceding the
+    array in its enclosing objects. Keys following the array are skipped.
+    Documents of the file that do not contain any of the arrays are yielded whole.
+    Each record is yielded along with the size in bytes of the JSON it was parsed from.
+    """
+    _DECODER = json.JSONDecoder()
+    _END = object()
+    _PARTIAL_ENDS = {'', '.', 'e', 'E', '-', '+'} | set('0123456789')
+
+    def __init__(self, json_file, paths):
+        """
+        Args:
+            json_file (file): A file-like object to read the JSON documents from
+            paths (list): Dotted paths of object keys leading to the arrays to stream
+        """
+        self._file = json_file
+        self._paths = {tuple(path.split('.')) for path in paths}
+        self._prefixes = {path[:index] for path in self._paths for index in range(1, len(path))}
+        self._buffer = ''
+        self._pos = 0
+        self._offset = 0
+        self._envelopes = []
+        self._path = None
+
+    def __iter__(self):
+        while True:
+            try:
+                record = self._next_record()
+            except ValueError as err:
+                LOGGER.error('Failed to stream JSON records: %s', err)
+                return
+
+            if record is self._END:
+                return
+
+            yield record
+
+    def find(self):
+        """Advance to the first element of the array within the first document
+
+        Returns:
+            bool: True if the first document is an object containing an
+                array at one of the paths
+        """
+        try:
+            return self._find(())
+        except ValueError as err:
+            LOGGER.debug('No JSON array to stream: %s', err)
+            return False
+
+    def _fill(self, size=None):
+        """Read the next chunk of the file into the buffer
+
+        Args:
+            size (int): Number of bytes to read, READ_CHUNK_SIZE by default
+
+        Returns:
+            bool: False if the end of the file was reached
+        """
+        chunk = self._file.read(size or READ_CHUNK_SIZE)
+        if not chunk:
+            return False
+
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _tell(self):
+        """Return the offset of the current position within the file"""
+        return self._offset + self._pos
+
+    def _peek(self):
+        """Skip whitespace and return the next character, or an empty string at the end"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        """Consume the next character, which must be the expected one"""
+        if self._peek() != char:
+            raise ValueError('Expecting {!r} delimiter'.format(char))
+        self._pos += 1
+
+    def _value(self):
+        """Decode the next JSON value, reading more of the file until it is complete
+
+        Each attempt decodes the value from its start, so the amount read is doubled
+        while the value is incomplete to keep the total work linear in its size.
+        """
+        self._peek()
+        size = READ_CHUNK_SIZE
+        while True:
+            try:
+                value, end = self._DECODER.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+
+            # A number cut at the end of the buffer could continue in the next chunk
+            if self._buffer[end:end + 1] in self._PARTIAL_ENDS and self._fill(size):
+                size *= 2
+                continue
+
+            self._pos = end
+            return value
+
+    def _find(self, prefix):
+        """Parse an object until reaching an array at one of the paths
+
+        Args:
+            prefix (tuple): Keys of the enclosing objects
+
+        Returns:
+            bool: True if an array was reached, False once the end of the object is reached
+        """
+        if self._peek() != '{':
+            return False
+
+        self._pos += 1
+        envelope = {}
+        self._envelopes.append(envelope)
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._pos += 1
+                return False
+
+            if char == ',':
+                self._pos += 1
+                continue
+
+            key = self._value()
+            if not isinstance(key, basestring):
+                raise ValueError('Expecting property name')
+
+            self._expect(':')
+            path = prefix + (key,)
+            char = self._peek()
+            if path in self._paths and char == '[':
+                self._pos += 1
+                self._path = path
+                return True
+
+            if path in self._prefixes and char == '{':
+                if self._find(path):
+                    return True
+                envelope[key] = self._envelopes.pop()
+            else:
+                envelope[key] = self._value()
+
+    def _skip_objects(self, count):
+        """Skip the remaining keys of the enclosing objects"""
+        for _ in range(count):
+            while True:
+                char = self._peek()
+                if char == '}':
+                    self._pos += 1
+                    break
+
+                if char == ',':
+                    self._pos += 1
+                    continue
+
+                self._value()
+                self._expect(':')
+                self._value()
+
+    def _next_record(self):
+        """Parse the next element of the current array, or the next document
+
+        Returns:
+            tuple: The record and the size of its JSON in bytes
+        """
+        while True:
+            if self._path:
+                char = self._peek()
+                if char == ',':
+                    self._pos += 1
+                    char = self._peek()
+
+                if char != ']':
+                    start = self._tell()
+                    element = self._value()
+                    return self._wrap(element), self._tell() - start
+
+                self._pos += 1
+                self._skip_objects(len(self._path))
+                self._path = None
+
+            del self._envelopes[:]
+            if not self._peek():
+                return self._END
+
+            start = self._tell()
+            if not self._find(()):
+                document = self._envelopes[0] if self._envelopes else self._value()
+                return document, self._tell() - start
+
+    def _wrap(self, element):
+        """Copy the enclosing objects of the current array, holding only this element"""
+        record = [element]
+        for key, envelope in reversed(zip(self._path, self._envelopes)):
+            node = envelope.copy()
+            node[key] = record
+            record = node
+
+        return record
+
+
 class SnsPayload(StreamPayload):
     """SnsPayload class"""
 
@@ -295,7 +819,7 @@ class SnsPayload(StreamPayload):
             self.raw_record['Sns']['MessageId'],
             self.raw_record['EventSubscriptionArn'])
 
-        self.pre_parsed_record = self.raw_record['Sns']['Message']
+        self.pre_parsed_record = decode_text(self.raw_record['Sns']['Message'])
 
         yield self
 
@@ -317,14 +841,113 @@ class KinesisPayload(StreamPayload):
         LOGGER.debug('Pre-parsing record from Kinesis. eventID: %s, eventSourceARN: %s',
                      self.raw_record['eventID'], self.raw_record['eventSourceARN'])
 
-        # Kinesis records have to potential to be gzipped, so try to decompress
         record = base64.b64decode(self.raw_record['kinesis']['data'])
+
+        user_records = self._deaggregate(record)
+        if user_records is None:
+            self.pre_parsed_record = decode_data(record)
+            yield self
+            return
+
+        # Records produced with KPL aggregation contain many user records
+        for data in user_records:
+            self._refresh_record(decode_data(data))
+            yield self
+
+        MetricLogger.log_metric(FUNCTION_NAME, MetricLogger.TOTAL_KINESIS_USER_RECORDS,
+                                len(user_records))
+
+    @staticmethod
+    def _deaggregate(record):
+        """Extract the user records from a record produced with KPL aggregation
+
+        Aggregated records are the magic number, followed by a protobuf encoded
+        `AggregatedRecord` message and the MD5 digest of that message. The data
+        of each user record is field 3 of a `Record`, which is itself the
+        repeated field 3 of the `AggregatedRecord`.
+
+        Args:
+            record (str): Base64 decoded data of the Kinesis record
+
+        Returns:
+            list: The data of each user record, or None if this record
+                was not produced with KPL aggregation
+        """
+        if not record.startswith(KPL_MAGIC) or len(record) < KPL_MIN_SIZE:
+            return
+
+        end = len(record) - KPL_DIGEST_SIZE
+        if hashlib.md5(record[len(KPL_MAGIC):end]).digest() != record[end:]:
+            return
+
         try:
-            self.pre_parsed_record = zlib.decompress(record, 47)
-        except zlib.error:
-            self.pre_parsed_record = record
+            return [
+                record[data_start:data_end]
+                for field, start, stop in _protobuf_fields(record, len(KPL_MAGIC), end)
+                if field == 3
+                for sub_field, data_start, data_end in _protobuf_fields(record, start, stop)
+                if sub_field == 3
+            ]
+        except ValueError as err:
+            LOGGER.error('Invalid KPL aggregated record: %s', err)
 
-        yield self
+
+def _read_varint(data, pos, end):
+    """Read a protobuf base 128 varint from the data
+
+    Args:
+        data (str): Protobuf encoded data
+        pos (int): Offset of the varint within the data
+        end (int): Offset the varint cannot extend past
+
+    Returns:
+        tuple: The decoded value and the offset following the varint
+    """
+    value = shift = 0
+    while pos < end:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+    raise ValueError('truncated varint at offset {}'.format(pos))
+
+
+def _protobuf_fields(data, pos, end):
+    """Iterate over the length delimited fields of a protobuf encoded message
+
+    Fields of any other wire type are skipped.
+
+    Args:
+        data (str): Protobuf encoded data
+        pos (int): Offset of the message within the data
+        end (int): Offset of the end of the message
+
+    Yields:
+        tuple: The field number, and the start and end offsets of its value
+    """
+    while pos < end:
+        key, pos = _read_varint(data, pos, end)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            _, pos = _read_varint(data, pos, end)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos, end)
+            if pos + length > end:
+                raise ValueError('truncated field {} at offset {}'.format(field, pos))
+            yield field, pos, pos + length
+            pos += length
+        else:
+            raise ValueError('unsupported wire type {} at offset {}'.format(wire_type, pos))
+
+    if pos != end:
+        raise ValueError('truncated message at offset {}'.format(end))
 
 
 class StreamAlertAppPayload(StreamPayload):
@@ -345,7 +968,7 @@ class StreamAlertAppPayload(StreamPayload):
         """
         for data in self.raw_record['logs']:
 
-            self._refresh_record(data)
+            self._refresh_record(decode_text(data))
             yield self
 
         MetricLogger.log_metric(FUNCTION_NAME, MetricLogger.TOTAL_STREAM_ALERT_APP_RECORDS,
@@ -14,12 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from collections import namedtuple
-from copy import copy
 import json
+import time
 
 from stream_alert.rule_processor import LOGGER
+from stream_alert.rule_processor.payload import NormalizedRecord, RecordContext
 from stream_alert.rule_processor.threat_intel import StreamThreatIntel
 from stream_alert.shared import NORMALIZATION_KEY
+from stream_alert.shared.metrics import METRICS, MetricLogger
+from stream_alert.shared.stats import MATCHER_STATS, RULE_STATS
 
 DEFAULT_RULE_DESCRIPTION = 'No rule description provided'
 
@@ -153,11 +156,16 @@ class StreamRules(object):
         for matcher in rule.matchers:
             matcher_function = self.__matchers.get(matcher)
             if matcher_function:
+                start = time.time() if MATCHER_STATS.enabled else None
+                error = False
                 try:
                     matcher_result = matcher_function(record)
                 except Exception as err:  # pylint: disable=broad-except
                     matcher_result = False
+                    error = True
                     LOGGER.error('%s: %s', matcher_function.__name__, err.message)
+                if start is not None:
+                    MATCHER_STATS.record(matcher, time.time() - start, matcher_result, error)
                 if not matcher_result:
                     return False
             else:
@@ -283,6 +291,8 @@ class StreamRules(object):
         Returns:
             bool: The return function of the rule
         """
+        start = time.time() if RULE_STATS.enabled else None
+        error = False
         try:
             if rule.context:
                 rule_result = rule.rule_function(record, rule.context)
@@ -290,9 +300,12 @@ class StreamRules(object):
                 rule_result = rule.rule_function(record)
         except Exception:  # pylint: disable=broad-except
             rule_result = False
+            error = True
             LOGGER.exception(
                 'Encountered error with rule: %s',
                 rule.rule_function.__name__)
+        if start is not None:
+            RULE_STATS.record(rule.rule_name, time.time() - start, rule_result, error)
         return rule_result
 
     @staticmethod
@@ -334,22 +347,25 @@ class StreamRules(object):
 
         return True
 
-    def process(self, input_payload):
+    def process(self, payload):
         """Process rules on a record.
 
         Gather a list of rules based on the record's datasource type.
         For each rule, evaluate the record through all listed matchers
         and the rule itself to determine if a match occurs.
 
+        Args:
+            payload (StreamPayload): A classified payload, which is only used
+                during this call and not kept
+
         Returns:
             A tuple(list, list).
                 First return is a list of alerts.
-                Second return is a list of payload instance with normalized records.
+                Second return is a list of NormalizedRecord instances.
         """
         alerts = []
         # store normalized records for future process in Threat Intel
         normalized_records = []
-        payload = copy(input_payload)
 
         rules = [rule_attrs for rule_attrs in self.__rules.values()
                  if rule_attrs.logs is None or payload.log_source in rule_attrs.logs]
@@ -358,6 +374,10 @@ class StreamRules(object):
             LOGGER.debug('No rules to process for %s', payload)
             return alerts, normalized_records
 
+        # The payload metadata (log_source, type, service and entity) is returned
+        # along with normalized records for threat detection, and is shared by
+        # all of the normalized records from this payload
+        context = None
         for record in payload.records:
             # One record may be added to normalized records list multiple time due
             # to each record is processed by all rules.
@@ -383,15 +403,9 @@ class StreamRules(object):
                     record_copy = record.copy()
                     record_copy[NORMALIZATION_KEY] = types_result
                     if self._threat_intel and not normalized_record_appended:
-                        # A copy of payload which includes payload metadata.
-                        # The payload metadata includes log_source, type, service,
-                        # and entity. The metadata will be returned to along with
-                        # normalized record for threat detection.
-                        payload_copy = copy(input_payload)
-                        payload_copy.pre_parsed_record = record_copy
-                        payload_copy.records = None
-                        payload_copy.raw_record = None
-                        normalized_records.append(payload_copy)
+                        if context is None:
+                            context = RecordContext(payload)
+                        normalized_records.append(NormalizedRecord(context, record_copy))
                         normalized_record_appended = True
                 else:
                     record_copy = record
@@ -404,11 +418,10 @@ class StreamRules(object):
         """Apply Threat Intelligence on normalized records
 
         Args:
-            payload_with_normalized_records (list): A list of payload instances.
-                And it pre_parsed_record is replaced by normalized record. The
-                reason to pass a copy of payload into Threat Intelligence is because
-                alerts require to include payload metadata (payload.log_source,
-                payload.type, payload.service and payload.entity).
+            payload_with_normalized_records (list): A list of NormalizedRecord instances,
+                whose pre_parsed_record is the normalized record. The payload metadata
+                (log_source, type, service and entity) is kept with each record because
+                alerts require it.
 
         Returns:
             list: A list of alerts triggered by Threat Intelligence.
@@ -457,6 +470,7 @@ class StreamRules(object):
                 'context': rule.context}
 
             alerts.append(alert)
+            METRICS.increment(MetricLogger.TRIGGERED_ALERTS, dimensions={'Rule': rule.rule_name})
 
     @staticmethod
     def check_alerts_duplication(record, rule, alerts):
@@ -13,51 +13,278 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
 import json
+from Queue import Queue
+from threading import Lock, Thread
+import uuid
 
 import boto3
 from botocore.exceptions import ClientError
 
-from stream_alert.rule_processor import LOGGER
+from stream_alert.rule_processor import FUNCTION_NAME, LOGGER
+from stream_alert.shared import ALERT_REFERENCE_KEY
+from stream_alert.shared.metrics import MetricLogger
 
+# Alerts are sent to the alert processor as a list within this wrapper
+PAYLOAD_TEMPLATE = '{{"alerts":[{}]}}'
 
-class StreamSink(object):
-    """StreamSink class is used for sending actual alerts to the alert processor"""
 
-    def __init__(self, env):
-        """StreamSink initializer
+def load_alert_transport(env, config=None):
+    """Returns the transport to use for sending alerts to the alert processor
+
+    The Lambda transport is used unless the alerts queue is enabled with
+        "alerts_queue": {"enabled": true}
+    within the 'infrastructure' settings of the global config.
+
+    If the alerts queue cannot be found, an error is logged and the Lambda
+    transport is used instead.
+
+    Args:
+        env (dict): loaded dictionary containing environment information
+        config (dict): loaded StreamAlert config
+    """
+    queue_config = ((config or {}).get('global', {}).get('infrastructure', {})
+                    .get('alerts_queue', {}))
+    if queue_config.get('enabled'):
+        try:
+            return SQSAlertTransport(env)
+        except ClientError as err:
+            LOGGER.error('Unable to load the alerts queue, sending alerts to the alert '
+                         'processor function instead. Error is: %s', err.response)
 
+    return LambdaAlertTransport(env)
+
+
+class AlertTransport(object):
+    """Base class for transports that send batches of serialized alerts to the
+    alert processor
+
+    Attributes:
+        MAX_BATCH_SIZE (int): The max size, in bytes, of a batch sent in one request
+        MAX_BATCH_COUNT (int): The max number of alerts sent in one request, if limited
+        BATCH_OVERHEAD (int): Bytes added once per batch when it is sent
+        ALERT_OVERHEAD (int): Bytes added to each alert when it is sent
+    """
+    __metaclass__ = ABCMeta
+    MAX_BATCH_SIZE = 0
+    MAX_BATCH_COUNT = None
+    BATCH_OVERHEAD = 0
+    ALERT_OVERHEAD = 0
+
+    def __init__(self, env):
+        """
         Args:
             env (dict): loaded dictionary containing environment information
         """
         self.env = env
+
+    @abstractmethod
+    def send(self, alerts):
+        """Send a batch of alerts to the alert processor
+
+        Args:
+            alerts (list): JSON serialized alerts that fit within the batch limits
+
+        Returns:
+            int: The number of alerts that were successfully sent
+        """
+
+
+class LambdaAlertTransport(AlertTransport):
+    """Send each batch of alerts in an asynchronous invocation of the alert processor"""
+    # Lambda limits the payload of asynchronous (Event) invocations to 128KB
+    MAX_BATCH_SIZE = 128 * 1024
+    BATCH_OVERHEAD = len(PAYLOAD_TEMPLATE.format(''))
+    # Account for the comma separating each alert from the previous one
+    ALERT_OVERHEAD = 1
+
+    def __init__(self, env):
+        super(LambdaAlertTransport, self).__init__(env)
         self.client_lambda = boto3.client('lambda',
                                           region_name=self.env['lambda_region'])
         self.function = self.env['lambda_function_name'].replace(
             '_streamalert_rule_processor', '_streamalert_alert_processor')
 
+    def __str__(self):
+        return self.function
+
+    def send(self, alerts):
+        """Invoke the alert processor with a batch of alerts
+
+        Args:
+            alerts (list): JSON serialized alerts to send in the payload
+
+        Returns:
+            int: The number of alerts that were successfully sent
+        """
+        data = PAYLOAD_TEMPLATE.format(','.join(alerts))
+        try:
+            response = self.client_lambda.invoke(
+                FunctionName=self.function,
+                InvocationType='Event',
+                Payload=data,
+                Qualifier='production'
+            )
+
+        except ClientError as err:
+            LOGGER.exception('An error occurred while sending %d alert(s) to '
+                             '\'%s:production\'. Error is: %s. Alerts: %s',
+                             len(alerts),
+                             self.function,
+                             err.response,
+                             data)
+            return 0
+
+        if response['ResponseMetadata']['HTTPStatusCode'] != 202:
+            LOGGER.error('Failed to send %d alert(s) to \'%s\': %s',
+                         len(alerts), self.function, data)
+            return 0
+
+        if self.env['lambda_alias'] != 'development':
+            LOGGER.info('Sent %d alert(s) to \'%s\' with Lambda request ID \'%s\'',
+                        len(alerts),
+                        self.function,
+                        response['ResponseMetadata']['RequestId'])
+
+        return len(alerts)
+
+
+class SQSAlertTransport(AlertTransport):
+    """Send alerts to an SQS queue that is consumed by the alert processor
+
+    Each alert is sent as its own message, in batches of up to 10 messages.
+    The queue for a cluster is named '<prefix>_<cluster>_streamalert_alerts'.
+    """
+    # SendMessageBatch limits both the count and total size of the messages
+    MAX_BATCH_SIZE = 256 * 1024
+    MAX_BATCH_COUNT = 10
+    ALERT_OVERHEAD = len(PAYLOAD_TEMPLATE.format(''))
+
+    def __init__(self, env):
+        super(SQSAlertTransport, self).__init__(env)
+        self.client_sqs = boto3.client('sqs', region_name=self.env['lambda_region'])
+        self.queue_name = self.env['lambda_function_name'].replace(
+            '_streamalert_rule_processor', '_streamalert_alerts')
+        self.queue_url = self.client_sqs.get_queue_url(QueueName=self.queue_name)['QueueUrl']
+
+    def __str__(self):
+        return self.queue_name
+
+    def send(self, alerts):
+        """Send a batch of alerts to the queue with SendMessageBatch
+
+        Args:
+            alerts (list): JSON serialized alerts, each sent as a separate message
+
+        Returns:
+            int: The number of alerts that were successfully sent
+        """
+        try:
+            response = self.client_sqs.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(index), 'MessageBody': PAYLOAD_TEMPLATE.format(alert)}
+                         for index, alert in enumerate(alerts)]
+            )
+
+        except ClientError as err:
+            LOGGER.exception('An error occurred while sending %d alert(s) to '
+                             '\'%s\'. Error is: %s',
+                             len(alerts),
+                             self.queue_name,
+                             err.response)
+            return 0
+
+        if response.get('Failed'):
+            LOGGER.error('Failed to send %d alert(s) to \'%s\': %s',
+                         len(response['Failed']),
+                         self.queue_name,
+                         json.dumps(response['Failed']))
+
+        sent_count = len(response.get('Successful', []))
+        if sent_count and self.env['lambda_alias'] != 'development':
+            LOGGER.info('Sent %d alert(s) to \'%s\'', sent_count, self.queue_name)
+
+        return sent_count
+
+
+class StreamSink(object):
+    """StreamSink class is used for sending actual alerts to the alert processor
+
+    Batches of alerts are sent by a bounded pool of worker threads, allowing the
+    rule processor to continue classifying records while alerts are in flight.
+    """
+    # Number of threads used to send alerts concurrently
+    MAX_WORKERS = 8
+    # Bound the number of batches waiting to be sent, blocking the rule processor
+    # if alerts are being triggered faster than they can be sent
+    MAX_QUEUED_BATCHES = MAX_WORKERS * 2
+
+    def __init__(self, env, config=None):
+        """StreamSink initializer
+
+        Large alerts can be offloaded to S3 by enabling the following within the
+        'infrastructure' settings of the global config:
+            "large_alerts": {
+                "enabled": true,
+                "bucket": "<prefix>.streamalerts",  # optional
+                "size_threshold": 65536             # optional
+            }
+        Alerts that are too large for the transport, or larger than the optional
+        threshold, are written to the bucket and only a reference to them is sent.
+
+        Args:
+            env (dict): loaded dictionary containing environment information
+            config (dict): loaded StreamAlert config, used to select the alert transport
+        """
+        self.env = env
+        self._transport = load_alert_transport(env, config)
+
+        large_alerts = ((config or {}).get('global', {}).get('infrastructure', {})
+                        .get('large_alerts', {}))
+        self._offload_bucket = None
+        if large_alerts.get('enabled'):
+            self._offload_bucket = large_alerts.get(
+                'bucket', '{}.streamalerts'.format(config['global']['account']['prefix']))
+            self._offload_threshold = large_alerts.get('size_threshold')
+            self._client_s3 = boto3.client('s3', region_name=self.env['lambda_region'])
+        self._batch = []
+        self._batch_size = self._transport.BATCH_OVERHEAD
+        self._queue = Queue(maxsize=self.MAX_QUEUED_BATCHES)
+        self._workers = []
+        self._lock = Lock()
+        self._sent_count = 0
+        self._failed_count = 0
+
     def sink(self, alerts):
         """Sink triggered alerts from the StreamRules engine.
 
+        Alerts are serialized and packed into batches that are queued to be sent
+        to the alert processor as soon as they reach the transport's batch limits.
+        Any remaining alerts are sent when `flush` is called.
+
         Args:
             alerts (list): a list of dictionaries representating json alerts
 
         Sends a message to the alert processor with the following JSON format:
             {
-                "record": record,
-                "metadata": {
-                    "rule_name": rule.rule_name,
-                    "rule_description": rule.rule_function.__doc__,
-                    "log": str(payload.log_source),
-                    "outputs": rule.outputs,
-                    "type": payload.type,
-                    "source": {
-                        "service": payload.service,
-                        "entity": payload.entity
+                "alerts": [
+                    {
+                        "record": record,
+                        "rule_name": rule.rule_name,
+                        "rule_description": rule.rule_function.__doc__,
+                        "log_source": str(payload.log_source),
+                        "log_type": payload.type,
+                        "outputs": rule.outputs,
+                        "source_service": payload.service(),
+                        "source_entity": payload.entity,
+                        "context": rule.context
                     }
-                }
+                ]
             }
         """
+        transport = self._transport
         for alert in alerts:
             try:
                 data = json.dumps(alert, default=lambda o: o.__dict__)
@@ -68,28 +295,130 @@ class StreamSink(object):
                              alert)
                 continue
 
-            try:
-                response = self.client_lambda.invoke(
-                    FunctionName=self.function,
-                    InvocationType='Event',
-                    Payload=data,
-                    Qualifier='production'
-                )
-
-            except ClientError as err:
-                LOGGER.exception('An error occurred while sending alert to '
-                                 '\'%s:production\'. Error is: %s. Alert: %s',
-                                 self.function,
-                                 err.response,
-                                 data)
-                continue
+            alert_size = len(data) + transport.ALERT_OVERHEAD
+            if self._should_offload(alert_size):
+                data = self._offload(data)
+                if not data:
+                    continue
+                alert_size = len(data) + transport.ALERT_OVERHEAD
 
-            if response['ResponseMetadata']['HTTPStatusCode'] != 202:
-                LOGGER.error('Failed to send alert to \'%s\': %s',
-                             self.function, data)
+            if transport.BATCH_OVERHEAD + alert_size > transport.MAX_BATCH_SIZE:
+                LOGGER.error('Alert is too large to send to \'%s\' (%d bytes). Alert: %s',
+                             transport, len(data), data[:1000])
                 continue
 
-            if self.env['lambda_alias'] != 'development':
-                LOGGER.info('Sent alert to \'%s\' with Lambda request ID \'%s\'',
-                            self.function,
-                            response['ResponseMetadata']['RequestId'])
+            if (self._batch_size + alert_size > transport.MAX_BATCH_SIZE or
+                    len(self._batch) == transport.MAX_BATCH_COUNT):
+                self._queue_batch()
+
+            self._batch.append(data)
+            self._batch_size += alert_size
+
+    def reset(self):
+        """Discard any alerts that were not sent by the previous invocation"""
+        del self._batch[:]
+        self._batch_size = self._transport.BATCH_OVERHEAD
+        self._sent_count, self._failed_count = 0, 0
+
+    def _should_offload(self, alert_size):
+        """Check if an alert should be written to S3 instead of being sent directly
+
+        Args:
+            alert_size (int): Size, in bytes, the serialized alert adds to a batch
+
+        Returns:
+            bool: True if offloading is enabled and the alert exceeds the
+                configured threshold or is too large to be sent by the transport
+        """
+        if not self._offload_bucket:
+            return False
+
+        if self._offload_threshold is not None and alert_size > self._offload_threshold:
+            return True
+
+        return self._transport.BATCH_OVERHEAD + alert_size > self._transport.MAX_BATCH_SIZE
+
+    def _offload(self, data):
+        """Write a serialized alert to S3 and return a reference to it
+
+        The alert processor fetches the alert from S3 when it receives the reference.
+
+        Args:
+            data (str): JSON serialized alert
+
+        Returns:
+            str: JSON serialized reference to the alert, or None if the upload failed
+        """
+        key = 'large_alerts/dt={}/{}.json'.format(
+            datetime.utcnow().strftime('%Y-%m-%d-%H'), uuid.uuid4())
+        try:
+            self._client_s3.put_object(Bucket=self._offload_bucket, Key=key, Body=data)
+        except ClientError as err:
+            LOGGER.exception('An error occurred while writing large alert to '
+                             '\'%s\'. Error is: %s. Alert: %s',
+                             self._offload_bucket,
+                             err.response,
+                             data[:1000])
+            return
+
+        LOGGER.debug('Wrote large alert (%d bytes) to \'s3://%s/%s\'',
+                     len(data), self._offload_bucket, key)
+
+        return json.dumps({ALERT_REFERENCE_KEY: {'bucket': self._offload_bucket, 'key': key}})
+
+    def flush(self):
+        """Send any pending alerts and wait for all queued batches to be sent
+
+        The counts of alerts sent and failed since the last flush are logged as metrics.
+        """
+        self._queue_batch()
+
+        # Signal each worker to exit once the queue has been drained
+        for _ in self._workers:
+            self._queue.put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+        del self._workers[:]
+
+        MetricLogger.log_metric(FUNCTION_NAME, MetricLogger.SENT_ALERTS, self._sent_count)
+        MetricLogger.log_metric(FUNCTION_NAME, MetricLogger.FAILED_ALERTS, self._failed_count)
+
+        self._sent_count, self._failed_count = 0, 0
+
+    def _queue_batch(self):
+        """Queue the current batch of alerts to be sent by a worker thread"""
+        if not self._batch:
+            return
+
+        batch = self._batch
+        self._batch = []
+        self._batch_size = self._transport.BATCH_OVERHEAD
+
+        # Start a new worker for each queued batch until the pool is full
+        if len(self._workers) < self.MAX_WORKERS:
+            worker = Thread(target=self._worker)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        self._queue.put(batch)
+
+    def _worker(self):
+        """Send queued batches of alerts until signaled to exit"""
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+
+            try:
+                sent_count = self._transport.send(batch)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception('An error occurred while sending %d alert(s) to \'%s\'',
+                                 len(batch), self._transport)
+                sent_count = 0
+
+            with self._lock:
+                self._sent_count += sent_count
+                self._failed_count += len(batch) - sent_count
@@ -13,7 +13,12 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from bisect import bisect_left, bisect_right
+import csv
 import os
+import socket
+import struct
+import zlib
 
 import backoff
 import boto3
@@ -67,7 +72,7 @@ def exceptions_to_giveup(err):
     return err.response['Error']['Code'] in error_code
 
 class StreamThreatIntel(object):
-    """Load intelligence from csv.gz files into a dictionary."""
+    """Match normalized records against IOCs stored in a DynamoDB table."""
     IOC_KEY = 'streamalert:ioc'
 
     EXCEPTIONS_TO_BACKOFF = (ClientError,)
@@ -79,9 +84,11 @@ class StreamThreatIntel(object):
     # Class variable stores mapping between CEF normalized types and IOC types
     __normalized_ioc_types_mapping = {}
 
-    def __init__(self, table, region='us-east-1'):
-        self.dynamodb = boto3.client('dynamodb', region)
+    def __init__(self, table=None, region='us-east-1'):
+        # Subclasses that do not query DynamoDB do not provide a table
+        self.dynamodb = boto3.client('dynamodb', region) if table else None
         self._table = table
+        self._region = region
 
     def threat_detection(self, records):
         """Public instance method to run threat intelligence against normalized records
@@ -183,7 +190,11 @@ class StreamThreatIntel(object):
         Returns:
             No return. Class variables will be set after config been processed.
         """
-        if config.get('types'):
+        derived = config.get('derived', {})
+        if 'normalized_types' in derived:
+            cls.__normalized_types = derived['normalized_types']
+            cls.__normalized_ioc_types_mapping = derived['normalized_ioc_types']
+        elif config.get('types'):
             cls._process_types_config(config['types'])
 
         # Threat Intel will be disabled for the cluster if it is explicitly
@@ -193,12 +204,27 @@ class StreamThreatIntel(object):
                             ['rule_processor'].get('enable_threat_intel', True)):
             return False
 
-        if (config.get('global')
+        if not (config.get('global')
                 and config['global'].get('threat_intel')
-                and config['global']['threat_intel'].get('enabled')
-                and config['global']['threat_intel'].get('dynamodb_table')):
-            return cls(config['global']['threat_intel']['dynamodb_table'],
-                       config['global']['account'].get('region', 'us-east-1'))
+                and config['global']['threat_intel'].get('enabled')):
+            return False
+
+        threat_intel_config = config['global']['threat_intel']
+        region = config['global']['account'].get('region', 'us-east-1')
+        backend = threat_intel_config.get('backend', 'dynamodb')
+
+        if backend == 'local':
+            if not threat_intel_config.get('ioc_files'):
+                LOGGER.error('Threat Intel \'local\' backend requires \'ioc_files\'')
+                return False
+            return StreamThreatIntelLocal(threat_intel_config['ioc_files'], region)
+
+        if backend != 'dynamodb':
+            LOGGER.error('Unsupported Threat Intel backend: %s', backend)
+            return False
+
+        if threat_intel_config.get('dynamodb_table'):
+            return StreamThreatIntel(threat_intel_config['dynamodb_table'], region)
 
         return False
 
@@ -209,6 +235,24 @@ class StreamThreatIntel(object):
         Args:
             config (dict): StreamAlert config contains global and types settings.
         """
+        normalized_types_mapping, normalized_ioc_types_mapping = cls.normalized_type_mappings(
+            config)
+
+        # Class variable stores mapping between CEF normalized types and IOC types
+        cls.__normalized_ioc_types_mapping = normalized_ioc_types_mapping
+        # Class variable stores Data Normalization types mapping.
+        cls.__normalized_types = normalized_types_mapping
+
+    @classmethod
+    def normalized_type_mappings(cls, config):
+        """Class method to build the normalized types and IOC types mappings from types conf
+
+        Args:
+            config (dict): Loaded types.json file
+
+        Returns:
+            tuple: (dict of normalized types by log source, dict of IOC type by normalized type)
+        """
         normalized_ioc_types_mapping = {}
         normalized_types_mapping = {}
         for log_src, mapping in config.iteritems():
@@ -223,10 +267,7 @@ class StreamThreatIntel(object):
                 sub_normalized_types[norm_type] = orig_types
             normalized_types_mapping[log_src] = sub_normalized_types
 
-        # Class variable stores mapping between CEF normalized types and IOC types
-        cls.__normalized_ioc_types_mapping = normalized_ioc_types_mapping
-        # Class variable stores Data Normalization types mapping.
-        cls.__normalized_types = normalized_types_mapping
+        return normalized_types_mapping, normalized_ioc_types_mapping
 
     @staticmethod
     def _validate_type_mapping(mapping_str):
@@ -267,18 +308,59 @@ class StreamThreatIntel(object):
             ioc_collections (list): A list of StreamIoc instances.
         """
         LOGGER.debug('[Threat Inel] Rule Processor queries %d IOCs', len(ioc_collections))
+        # Domains are queried along with all of their parent domains in the same
+        # batches, so subdomains of listed domains match without extra round trips
+        query_values = []
+        unique_values = set()
+        for ioc in ioc_collections:
+            for value in self._lookup_values(ioc):
+                if value not in unique_values:
+                    unique_values.add(value)
+                    query_values.append(value)
+
+        sub_types = {}
         # Segment data before calling DynamoDB table with batch_get_item.
-        for subset in self._segment(ioc_collections):
-            query_values = []
-            for ioc in subset:
-                if ioc.value not in query_values:
-                    query_values.append(ioc.value)
+        for subset in self._segment(query_values):
+            query_result = self._query_with_unprocessed_keys(subset)
+            if query_result is None:
+                break
+
+            for ioc in query_result:
+                sub_types[ioc[PRIMARY_KEY]] = ioc[SUB_TYPE_KEY]
+
+        self._match_iocs(ioc_collections, lambda _, value: sub_types.get(value))
+
+    def _query_with_unprocessed_keys(self, query_values):
+        """Query DynamoDB table and re-query once with any unprocessed keys
+
+        Args:
+            query_values (list): A list of unique IOC values, up to MAX_QUERY_CNT
 
-            query_result = []
+        Returns:
+            list: A list of dict returned from the dynamodb table query, or None
+                if an error occurred while querying.
+        """
+        query_result = []
 
-            query_error_msg = 'An error occured while quering dynamodb table. Error is: %s'
+        query_error_msg = 'An error occured while quering dynamodb table. Error is: %s'
+        try:
+            result, unprocesed_keys = self._query(query_values)
+            query_result.extend(result)
+        except ClientError as err:
+            LOGGER.error(query_error_msg, err.response)
+            return
+        except ParamValidationError as err:
+            LOGGER.error(query_error_msg, err)
+            return
+
+        # If there are unprocessed keys, we will re-query once with unprocessed
+        # keys only
+        if unprocesed_keys:
+            deserializer = self._deserialize(unprocesed_keys[self._table]['Keys'])
+            query_values = [elem[PRIMARY_KEY] for elem in deserializer]
+            query_error_msg = 'An error occured while processing unprocesed_keys. Error is: %s'
             try:
-                result, unprocesed_keys = self._query(query_values)
+                result, _ = self._query(query_values)
                 query_result.extend(result)
             except ClientError as err:
                 LOGGER.error(query_error_msg, err.response)
@@ -287,28 +369,48 @@ class StreamThreatIntel(object):
                 LOGGER.error(query_error_msg, err)
                 return
 
-            # If there are unprocessed keys, we will re-query once with unprocessed
-            # keys only
-            if unprocesed_keys:
-                deserializer = self._deserialize(unprocesed_keys[self._table]['Keys'])
-                query_values = [elem[PRIMARY_KEY] for elem in deserializer]
-                query_error_msg = 'An error occured while processing unprocesed_keys. Error is: %s'
-                try:
-                    result, _ = self._query(query_values)
-                    query_result.extend(result)
-                except ClientError as err:
-                    LOGGER.error(query_error_msg, err.response)
-                    return
-                except ParamValidationError as err:
-                    LOGGER.error(query_error_msg, err)
-                    return
-
-            for value in ioc_collections:
-                for ioc in query_result:
-                    if value.value == ioc[PRIMARY_KEY]:
-                        value.sub_type = ioc[SUB_TYPE_KEY]
-                        value.is_ioc = True
-                        continue
+        return query_result
+
+    @staticmethod
+    def _lookup_values(ioc):
+        """Get the values to look up for an IOC
+
+        Domains are looked up along with each of their parent domains so that
+        subdomains of a listed domain are also detected. Top level domains
+        are not looked up on their own.
+
+        Example:
+            'a.b.evil.com' -> ['a.b.evil.com', 'b.evil.com', 'evil.com']
+
+        Args:
+            ioc (StreamIoc): The IOC to get lookup values for
+
+        Returns:
+            list: Values to look up, starting with the IOC value itself
+        """
+        if ioc.ioc_type != 'domain':
+            return [ioc.value]
+
+        labels = ioc.value.rstrip('.').split('.')
+        parents = ['.'.join(labels[index:]) for index in range(1, len(labels) - 1)]
+        return [ioc.value] + parents
+
+    @classmethod
+    def _match_iocs(cls, ioc_collections, lookup):
+        """Flag the IOCs whose value, or any parent domain, was found
+
+        Args:
+            ioc_collections (list): A list of StreamIoc instances.
+            lookup (callable): Function accepting an IOC type and value and
+                returning the sub type if the value is a known IOC, otherwise None
+        """
+        for ioc in ioc_collections:
+            for value in cls._lookup_values(ioc):
+                sub_type = lookup(ioc.ioc_type, value)
+                if sub_type:
+                    ioc.sub_type = sub_type
+                    ioc.is_ioc = True
+                    break
 
     @staticmethod
     def _segment(ioc_collections):
@@ -316,10 +418,10 @@ class StreamThreatIntel(object):
         Batch query to dynamodb supports up to 100 items.
 
         Args:
-            ioc_collections (list): A list of StreamIoc instances
+            ioc_collections (list): A list of IOC values
 
         Returns:
-            list: List of subset of StreamIoc instances
+            list: List of subset of IOC values
         """
         result = []
         end = len(ioc_collections)
@@ -419,3 +521,278 @@ class StreamThreatIntel(object):
             return ip_addr.is_unicast() and not ip_addr.is_private()
         except: # pylint: disable=bare-except
             return False
+
+
+def parse_ip_network(value):
+    """Parse an IP address or CIDR block into an integer range
+
+    socket.inet_pton is used instead of netaddr since it is considerably
+    faster when loading hundreds of thousands of networks.
+
+    Args:
+        value (str): IP address or network in CIDR notation, ie: '10.0.0.0/8'
+
+    Returns:
+        tuple: (version, first, last) where first and last are the integer
+            values of the first and last address, or None if the value is invalid
+    """
+    address, _, prefix = value.partition('/')
+    for version, family, bits in ((4, socket.AF_INET, 32), (6, socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError):
+            continue
+
+        high, low = struct.unpack('!QQ', packed) if version == 6 else (0, 0)
+        number = (high << 64 | low) if version == 6 else struct.unpack('!I', packed)[0]
+
+        prefix_len = bits
+        if prefix:
+            if not prefix.isdigit() or int(prefix) > bits:
+                return
+            prefix_len = int(prefix)
+
+        host_mask = (1 << (bits - prefix_len)) - 1
+        first = number & ~host_mask
+        return version, first, first | host_mask
+
+
+class IpRangeIndex(object):
+    """Interval index of IP networks (CIDR blocks) for a single IP version
+
+    Networks are flattened into disjoint ranges kept in sorted start/end integer
+    lists, so a lookup is a single bisect. Where networks are nested, the most
+    specific network determines the sub type for the addresses it covers.
+    """
+    def __init__(self, networks):
+        """Build the index
+
+        Args:
+            networks (list): Tuples of (first, last, sub_type) where first and last
+                are the integer values of the first and last address of a network
+        """
+        self._starts = []
+        self._ends = []
+        self._sub_types = []
+
+        # Sorting by start, then widest first, places each network
+        # after any network that contains it
+        stack = []
+        cursor = None
+        for first, last, sub_type in sorted(networks, key=lambda net: (net[0], -net[1])):
+            # Close any networks that end before this one starts
+            while stack and stack[-1][0] < first:
+                cursor = self._close(stack.pop(), cursor)
+
+            # Emit the part of the enclosing network preceding this one
+            if stack and cursor < first:
+                self._add(cursor, first - 1, stack[-1][1])
+
+            stack.append((last, sub_type))
+            cursor = first
+
+        while stack:
+            cursor = self._close(stack.pop(), cursor)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _close(self, network, cursor):
+        """Emit the remainder of a network and return the next uncovered address"""
+        last, sub_type = network
+        if cursor <= last:
+            self._add(cursor, last, sub_type)
+        return max(cursor, last + 1)
+
+    def _add(self, start, end, sub_type):
+        self._starts.append(start)
+        self._ends.append(end)
+        self._sub_types.append(sub_type)
+
+    def lookup(self, address):
+        """Find the network containing an address
+
+        Args:
+            address (int): Integer value of the IP address
+
+        Returns:
+            str: The sub type of the containing network, otherwise None
+        """
+        index = bisect_right(self._starts, address) - 1
+        if index >= 0 and address <= self._ends[index]:
+            return self._sub_types[index]
+
+
+class IocIndex(object):
+    """Compact in-memory IOC index partitioned by IOC type
+
+    Values for each IOC type are kept in a sorted list, with a parallel
+    list holding the sub type of each value, and are searched with bisect.
+    IP IOCs in CIDR form are stored in an IpRangeIndex per IP version.
+    """
+    def __init__(self, iocs=None):
+        """Build the index
+
+        Args:
+            iocs (iterable): Tuples of (value, ioc_type, sub_type)
+        """
+        self._values = {}
+        self._sub_types = {}
+        self._ip_ranges = {}
+
+        partitioned = {}
+        networks = {}
+        for value, ioc_type, sub_type in iocs or []:
+            # Many IOCs share the same sub type, so intern it to save memory
+            sub_type = intern(sub_type)
+            if ioc_type == 'ip' and '/' in value:
+                network = parse_ip_network(value)
+                if not network:
+                    LOGGER.error('[Threat Intel] Invalid IP network IOC: %s', value)
+                    continue
+                version, first, last = network
+                networks.setdefault(version, []).append((first, last, sub_type))
+                continue
+
+            partitioned.setdefault(ioc_type, {})[value.lower()] = sub_type
+
+        for ioc_type, values in partitioned.iteritems():
+            sorted_values = sorted(values)
+            self._values[ioc_type] = sorted_values
+            self._sub_types[ioc_type] = [values[value] for value in sorted_values]
+
+        for version, version_networks in networks.iteritems():
+            self._ip_ranges[version] = IpRangeIndex(version_networks)
+
+        self._count = (sum(len(values) for values in self._values.itervalues()) +
+                       sum(len(version_networks) for version_networks in networks.itervalues()))
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, ioc_type, value):
+        """Look up a single value in the index
+
+        Args:
+            ioc_type (str): Type of IOC, 'domain', 'ip' or 'md5'
+            value (str): Lower cased IOC value
+
+        Returns:
+            str: The sub type of the IOC if the value is present, otherwise None
+        """
+        values = self._values.get(ioc_type)
+        if values:
+            index = bisect_left(values, value)
+            if index < len(values) and values[index] == value:
+                return self._sub_types[ioc_type][index]
+
+        if ioc_type == 'ip' and self._ip_ranges:
+            return self._lookup_ip_range(value)
+
+    def _lookup_ip_range(self, value):
+        """Look up an IP address in the IP network ranges
+
+        Args:
+            value (str): IP address
+
+        Returns:
+            str: The sub type of the containing network, otherwise None
+        """
+        address = parse_ip_network(value)
+        if not address:
+            return
+
+        version, number, _ = address
+        ranges = self._ip_ranges.get(version)
+        if ranges:
+            return ranges.lookup(number)
+
+
+class StreamThreatIntelLocal(StreamThreatIntel):
+    """Match normalized records against IOCs loaded from csv.gz files into memory
+
+    Each line in an IOC file has the format 'ioc_value,sub_type[,source]' and
+    the IOC type is derived from the sub type, ie: 'c2_domain' -> 'domain'.
+    IP IOCs may also be networks in CIDR notation, ie: '10.0.0.0/8,mal_ip'.
+    Files are read from the deployment package (ie: files within the conf/
+    directory) or from S3 when given in the form 's3://bucket/key'. Files that
+    cannot be read are skipped, and the index is reloaded on the next invocation.
+    """
+    # Loaded indexes are cached per set of files so warm containers
+    # do not reload them on every invocation
+    __index_cache = {}
+
+    def __init__(self, ioc_files, region='us-east-1'):
+        super(StreamThreatIntelLocal, self).__init__(region=region)
+        self._ioc_files = tuple(ioc_files)
+        self._load_failed = False
+        self._index = self._load_index()
+
+    def _load_index(self):
+        """Load the IOC index for the configured files, using the cache if available
+
+        Returns:
+            IocIndex: Index containing all IOCs from the configured files
+        """
+        if self._ioc_files not in self.__index_cache:
+            iocs = (ioc for ioc_file in self._ioc_files
+                    for ioc in self._read_ioc_file(ioc_file))
+            index = IocIndex(iocs)
+            ioc_count = len(index)
+            if ioc_count:
+                LOGGER.info('[Threat Intel] Loaded %d IOCs from %d file(s)',
+                            ioc_count, len(self._ioc_files))
+            else:
+                LOGGER.error('[Threat Intel] No IOCs were loaded from %d file(s), '
+                             'records will not match any IOCs', len(self._ioc_files))
+
+            # Do not cache a partial index so missing files are retried
+            if self._load_failed:
+                return index
+
+            self.__index_cache[self._ioc_files] = index
+
+        return self.__index_cache[self._ioc_files]
+
+    def _read_ioc_file(self, ioc_file):
+        """Read IOCs from a local or S3 hosted csv.gz file
+
+        Args:
+            ioc_file (str): Path to a local file or an 's3://bucket/key' location
+
+        Yields:
+            tuple: (value, ioc_type, sub_type) for each IOC in the file
+        """
+        try:
+            if ioc_file.startswith('s3://'):
+                bucket, _, key = ioc_file[len('s3://'):].partition('/')
+                client = boto3.client('s3', region_name=self._region)
+                data = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            else:
+                with open(ioc_file, 'rb') as ioc_fh:
+                    data = ioc_fh.read()
+        except (ClientError, IOError) as err:
+            LOGGER.error('[Threat Intel] Unable to read IOC file %s: %s', ioc_file, err)
+            self._load_failed = True
+            return
+
+        # Support both gzipped and plaintext files
+        try:
+            data = zlib.decompress(data, 47)
+        except zlib.error:
+            pass
+
+        for row in csv.reader(data.splitlines()):
+            if len(row) < 2 or not row[0]:
+                continue
+            value, sub_type = row[0].strip(), row[1].strip()
+            yield value, sub_type.split('_')[-1], sub_type
+
+    def _process_ioc(self, ioc_collections):
+        """Check if any info is malicious by looking it up in the in-memory index
+
+        Args:
+            ioc_collections (list): A list of StreamIoc instances.
+        """
+        LOGGER.debug('[Threat Intel] Rule Processor looks up %d IOCs', len(ioc_collections))
+        self._match_iocs(ioc_collections, self._index.lookup)
@@ -13,7 +13,16 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+import json
 import os
+import sys
+from threading import Lock
+import time
+
+import boto3
+from botocore.exceptions import ClientError
 
 from stream_alert.shared import (
     ALERT_PROCESSOR_NAME,
@@ -40,6 +49,13 @@ except ValueError as err:
 if not ENABLE_METRICS:
     LOGGER.debug('Logging of metric data is currently disabled.')
 
+# The format used to publish metrics:
+#   'log' - one log line per metric, picked up by CloudWatch Logs metric filters
+#   'emf' - buffered and printed once per invocation in the Embedded Metric Format
+#   'api' - buffered and sent once per invocation with CloudWatch PutMetricData
+METRICS_FORMAT = os.environ.get('METRICS_FORMAT', 'log').lower()
+METRICS_NAMESPACE = 'StreamAlert'
+
 
 class MetricLogger(object):
     """Class to hold metric logging to be picked up by log metric filters.
@@ -54,10 +70,17 @@ class MetricLogger(object):
     TOTAL_PROCESSED_SIZE = 'TotalProcessedSize'
     TOTAL_RECORDS = 'TotalRecords'
     TOTAL_S3_RECORDS = 'TotalS3Records'
+    TOTAL_KINESIS_USER_RECORDS = 'TotalKinesisUserRecords'
     TOTAL_STREAM_ALERT_APP_RECORDS = 'TotalStreamAlertAppRecords'
     TRIGGERED_ALERTS = 'TriggeredAlerts'
+    SENT_ALERTS = 'SentAlerts'
+    FAILED_ALERTS = 'FailedAlerts'
     FIREHOSE_RECORDS_SENT = 'FirehoseRecordsSent'
     FIREHOSE_FAILED_RECORDS = 'FirehoseFailedRecords'
+    FIREHOSE_RETRIED_RECORDS = 'FirehoseRetriedRecords'
+    STAGE_TIME = 'StageTime'
+    RULE_TIME = 'RuleTime'
+    MATCHER_TIME = 'MatcherTime'
 
     _default_filter = '{{ $.metric_name = "{}" }}'
     _default_value_lookup = '$.metric_value'
@@ -82,19 +105,33 @@ class MetricLogger(object):
                             _default_value_lookup),
             TOTAL_S3_RECORDS: (_default_filter.format(TOTAL_S3_RECORDS),
                                _default_value_lookup),
+            TOTAL_KINESIS_USER_RECORDS: (_default_filter.format(TOTAL_KINESIS_USER_RECORDS),
+                                         _default_value_lookup),
             TRIGGERED_ALERTS: (_default_filter.format(TRIGGERED_ALERTS),
                                _default_value_lookup),
+            SENT_ALERTS: (_default_filter.format(SENT_ALERTS),
+                          _default_value_lookup),
+            FAILED_ALERTS: (_default_filter.format(FAILED_ALERTS),
+                            _default_value_lookup),
             FIREHOSE_RECORDS_SENT: (_default_filter.format(FIREHOSE_RECORDS_SENT),
                                     _default_value_lookup),
             FIREHOSE_FAILED_RECORDS: (_default_filter.format(FIREHOSE_FAILED_RECORDS),
                                       _default_value_lookup),
+            FIREHOSE_RETRIED_RECORDS: (_default_filter.format(FIREHOSE_RETRIED_RECORDS),
+                                       _default_value_lookup),
             TOTAL_STREAM_ALERT_APP_RECORDS:
-                (_default_filter.format(TOTAL_STREAM_ALERT_APP_RECORDS), _default_value_lookup)
+                (_default_filter.format(TOTAL_STREAM_ALERT_APP_RECORDS), _default_value_lookup),
+            STAGE_TIME: (_default_filter.format(STAGE_TIME),
+                         _default_value_lookup),
+            RULE_TIME: (_default_filter.format(RULE_TIME),
+                        _default_value_lookup),
+            MATCHER_TIME: (_default_filter.format(MATCHER_TIME),
+                           _default_value_lookup)
         }
     }
 
     @classmethod
-    def log_metric(cls, lambda_function, metric_name, value):
+    def log_metric(cls, lambda_function, metric_name, value, dimensions=None):
         """Log a metric using the logger the list of metrics to be sent to CloudWatch
 
         Args:
@@ -102,6 +139,9 @@ class MetricLogger(object):
             value (num): Numeric information to post to metric. AWS expects
                 this to be of type 'float' but will accept any numeric value that
                 is not super small (negative) or super large.
+            dimensions (dict): Additional dimensions for this metric. These are
+                published with buffered metrics, and only included in the log
+                line otherwise since metric filters aggregate all values.
         """
         # Do not log any metrics if they have been disabled by the user
         if not ENABLE_METRICS:
@@ -122,10 +162,265 @@ class MetricLogger(object):
                                    for value in cls._available_metrics[lambda_function]))
             return
 
+        # Only the rule processor publishes the buffered metrics at the end of each
+        # invocation, so other functions always log their metrics individually
+        if METRICS.enabled and lambda_function == RULE_PROCESSOR_NAME:
+            # Each logged value is a sample, as each log line is with metric filters
+            all_dimensions = {'Function': FUNC_PREFIXES[lambda_function]}
+            all_dimensions.update(dimensions or {})
+            METRICS.observe(metric_name, value, all_dimensions)
+            return
+
         # Use a default format for logging this metric that will get picked up by the filters
+        if dimensions:
+            LOGGER.info('{"metric_name": "%s", "metric_value": %s, "dimensions": %s}',
+                        metric_name, value, json.dumps(dimensions, sort_keys=True))
+            return
+
         LOGGER.info('{"metric_name": "%s", "metric_value": %s}', metric_name, value)
 
     @classmethod
     def get_available_metrics(cls):
         """Return the protected dictionary of metrics for all functions"""
         return cls._available_metrics
+
+
+class MetricRegistry(object):
+    """Aggregate metrics in memory and publish them once per invocation
+
+    Counters are summed and histograms keep every observed value. Values logged
+    with `MetricLogger.log_metric` are observed, while counters hold the totals
+    that are only published per dimension, such as the log source or rule name.
+    All metrics also have the registry's default dimensions.
+    Nothing is recorded if the registry has no sink.
+    """
+
+    def __init__(self, sink=None, default_dimensions=None):
+        """
+        Args:
+            sink (MetricSink): Destination for the aggregated metrics when flushed
+            default_dimensions (dict): Dimensions added to every metric
+        """
+        self._sink = sink
+        self._default_dimensions = default_dimensions or {}
+        self._lock = Lock()
+        self._counters = defaultdict(float)
+        self._histograms = defaultdict(list)
+
+    @property
+    def enabled(self):
+        """Whether metrics are being recorded"""
+        return self._sink is not None
+
+    def _key(self, name, dimensions):
+        """Return a hashable key for the metric name and its full set of dimensions"""
+        if dimensions:
+            all_dimensions = self._default_dimensions.copy()
+            all_dimensions.update(dimensions)
+        else:
+            all_dimensions = self._default_dimensions
+
+        return name, tuple(sorted(all_dimensions.iteritems()))
+
+    def increment(self, name, value=1, dimensions=None):
+        """Add to a counter
+
+        Args:
+            name (str): Name of the metric
+            value (num): Amount to add to the counter
+            dimensions (dict): Additional dimensions for this metric
+        """
+        if not self._sink:
+            return
+
+        key = self._key(name, dimensions)
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, dimensions=None):
+        """Record a value in a histogram
+
+        Args:
+            name (str): Name of the metric
+            value (num): The observed value
+            dimensions (dict): Additional dimensions for this metric
+        """
+        if not self._sink:
+            return
+
+        key = self._key(name, dimensions)
+        with self._lock:
+            self._histograms[key].append(value)
+
+    def flush(self):
+        """Publish all aggregated metrics to the sink and reset the registry"""
+        if not self._sink:
+            return
+
+        with self._lock:
+            metrics = [(name, dict(dimensions), [value])
+                       for (name, dimensions), value in self._counters.iteritems()]
+            metrics.extend((name, dict(dimensions), values)
+                           for (name, dimensions), values in self._histograms.iteritems())
+
+            self._counters.clear()
+            self._histograms.clear()
+
+        if metrics:
+            self._sink.publish(metrics)
+
+
+class MetricSink(object):
+    """Base class for publishing aggregated metrics"""
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def publish(self, metrics):
+        """Publish aggregated metrics
+
+        Args:
+            metrics (list): Tuples of (name, dimensions, values) where values is
+                the list of values for the metric. Counters have a single value.
+        """
+
+
+class EmbeddedMetricSink(MetricSink):
+    """Print metrics to stdout in the CloudWatch Embedded Metric Format
+
+    Lambda sends stdout to CloudWatch Logs, which extracts the metrics without
+    any metric filters or API calls.
+    """
+    # Limits on the number of metrics per document and values per metric
+    MAX_METRICS = 100
+    MAX_VALUES = 100
+
+    def __init__(self, namespace=METRICS_NAMESPACE, stream=None):
+        self._namespace = namespace
+        self._stream = stream or sys.stdout
+
+    def publish(self, metrics):
+        """Print one document per set of dimensions, splitting at the EMF limits"""
+        by_dimensions = defaultdict(list)
+        for name, dimensions, values in metrics:
+            by_dimensions[tuple(sorted(dimensions.iteritems()))].append((name, values))
+
+        timestamp = int(time.time() * 1000)
+        for dimensions, dimension_metrics in by_dimensions.iteritems():
+            # Values beyond the limit for a metric are moved to subsequent documents
+            chunks = [(name, values[index:index + self.MAX_VALUES])
+                      for name, values in dimension_metrics
+                      for index in range(0, len(values), self.MAX_VALUES)]
+
+            while chunks:
+                document = dict(dimensions)
+                names = []
+                remaining = []
+                for name, values in chunks:
+                    if name in document or len(names) == self.MAX_METRICS:
+                        remaining.append((name, values))
+                        continue
+                    document[name] = values[0] if len(values) == 1 else values
+                    names.append(name)
+
+                document['_aws'] = {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self._namespace,
+                        'Dimensions': [[key for key, _ in dimensions]],
+                        'Metrics': [{'Name': name} for name in names]
+                    }]
+                }
+                self._stream.write(json.dumps(document, separators=(',', ':')) + '\n')
+                chunks = remaining
+
+
+class PutMetricDataSink(MetricSink):
+    """Send metrics to CloudWatch with batched PutMetricData calls
+
+    Histograms are sent as statistic sets, so a single datum describes all values.
+    """
+    # PutMetricData accepts at most 20 datums per call
+    MAX_DATUMS = 20
+
+    def __init__(self, namespace=METRICS_NAMESPACE, region=None):
+        self._namespace = namespace
+        self._client = boto3.client(
+            'cloudwatch', region_name=region or os.environ.get('AWS_DEFAULT_REGION'))
+
+    def publish(self, metrics):
+        """Send the metrics in batches of up to 20"""
+        datums = []
+        for name, dimensions, values in metrics:
+            datum = {
+                'MetricName': name,
+                'Dimensions': [{'Name': key, 'Value': str(value)}
+                               for key, value in sorted(dimensions.iteritems())]
+            }
+            if len(values) == 1:
+                datum['Value'] = values[0]
+            else:
+                datum['StatisticValues'] = {
+                    'SampleCount': len(values),
+                    'Sum': sum(values),
+                    'Minimum': min(values),
+                    'Maximum': max(values)
+                }
+            datums.append(datum)
+
+        for index in range(0, len(datums), self.MAX_DATUMS):
+            try:
+                self._client.put_metric_data(Namespace=self._namespace,
+                                             MetricData=datums[index:index + self.MAX_DATUMS])
+            except ClientError as err:
+                LOGGER.error('Failed to send %d metric(s) to CloudWatch: %s',
+                             len(datums[index:index + self.MAX_DATUMS]),
+                             err.response)
+
+
+class LocalMetricSink(MetricSink):
+    """Keep published metrics in memory, allowing tests to check metric values"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def publish(self, metrics):
+        self.metrics.extend(metrics)
+
+    def get(self, name, dimensions=None):
+        """Return all values published for a metric
+
+        Args:
+            name (str): Name of the metric
+            dimensions (dict): If provided, only metrics with these dimensions are included
+        """
+        return [value
+                for metric_name, metric_dimensions, values in self.metrics
+                if metric_name == name and (dimensions is None or
+                                            metric_dimensions == dimensions)
+                for value in values]
+
+
+def load_metric_sink(metrics_format=METRICS_FORMAT):
+    """Return the sink for the configured metrics format
+
+    Args:
+        metrics_format (str): One of 'log', 'emf' or 'api'
+
+    Returns:
+        MetricSink: The sink to use, or None if metrics are logged individually
+    """
+    if not ENABLE_METRICS or metrics_format == 'log':
+        return
+
+    if metrics_format == 'emf':
+        return EmbeddedMetricSink()
+
+    if metrics_format == 'api':
+        return PutMetricDataSink()
+
+    LOGGER.error('Invalid metrics format \'%s\', expected one of: log, emf, api',
+                 metrics_format)
+
+
+# The registry used to buffer metrics for the current invocation
+METRICS = MetricRegistry(load_metric_sink(), {'Cluster': CLUSTER})
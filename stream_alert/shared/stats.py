@@ -13,26 +13,250 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+from functools import wraps
+import json
+import os
 import time
 
-from stream_alert.shared import LOGGER
+from stream_alert.shared import LOGGER, RULE_PROCESSOR_NAME
+from stream_alert.shared.metrics import MetricLogger
 
+try:
+    ENABLE_STAGE_TIMERS = bool(int(os.environ.get('ENABLE_STAGE_TIMERS', 0)))
+except ValueError as err:
+    ENABLE_STAGE_TIMERS = False
+    LOGGER.error('Invalid value for stage timer toggling, expected 0 or 1: %s',
+                 err.message)
 
-def time_me(func):
-    """Timing decorator for wrapping a function"""
+try:
+    ENABLE_RULE_STATS = bool(int(os.environ.get('ENABLE_RULE_STATS', 0)))
+except ValueError as err:
+    ENABLE_RULE_STATS = False
+    LOGGER.error('Invalid value for rule stats toggling, expected 0 or 1: %s',
+                 err.message)
 
-    def timed(*args, **kw):
-        """Wrapping function"""
-        time_start = time.time()
-        result = func(*args, **kw)
-        time_end = time.time()
 
-        message = '(module) {} (method) {} (time): {:>.4f}ms'.format(
-            func.__module__, func.__name__, (time_end - time_start) * 1000
-        )
+class StageTimers(object):
+    """Accumulate the time spent in named stages of processing
 
-        LOGGER.debug(message)
+    For each stage, the number of times it was timed along with the total and
+    max time are kept until `report` is called, typically once per invocation.
+    When disabled, timing a stage costs a single attribute check.
 
-        return result
+    Timers are not thread safe and should only be used from the main thread.
+    """
 
-    return timed
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # Map of stage name to [count, total seconds, max seconds]
+        self._stages = {}
+
+    def start(self):
+        """Start timing a stage
+
+        Returns:
+            float: The start time to pass to `stop`, or None if timers are disabled
+        """
+        if not self.enabled:
+            return
+
+        return time.time()
+
+    def stop(self, stage, start):
+        """Stop timing a stage and record the elapsed time
+
+        Args:
+            stage (str): Name of the stage
+            start (float): The value returned from `start`
+        """
+        if start is None:
+            return
+
+        elapsed = time.time() - start
+        stats = self._stages.get(stage)
+        if stats is None:
+            self._stages[stage] = [1, elapsed, elapsed]
+            return
+
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+
+    def timed(self, stage):
+        """Decorator to time each call of a function as a stage
+
+        Args:
+            stage (str): Name of the stage
+        """
+        def decorator(func):
+            """Wrap the function with a timer"""
+            @wraps(func)
+            def timed(*args, **kwargs):
+                """Time the wrapped function if timers are enabled"""
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                start = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.stop(stage, start)
+
+            return timed
+
+        return decorator
+
+    def timed_iter(self, stage, iterable):
+        """Time the production of each item of an iterable, such as a generator
+
+        Time spent by the caller processing each item is not included.
+
+        Args:
+            stage (str): Name of the stage
+            iterable (iterable): The items to time
+        """
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop(stage, start)
+
+            yield item
+
+    def stats(self):
+        """Return the accumulated stats for each stage
+
+        Returns:
+            dict: Map of stage name to a dict with the 'count', 'total_ms' and 'max_ms'
+        """
+        return {stage: {'count': count,
+                        'total_ms': round(total * 1000, 4),
+                        'max_ms': round(max_time * 1000, 4)}
+                for stage, (count, total, max_time) in self._stages.iteritems()}
+
+    def report(self):
+        """Log the per stage breakdown, record the totals as metrics and reset all stages"""
+        if not self._stages:
+            return
+
+        stats = self.stats()
+        LOGGER.info('[Stage Timers] %s', json.dumps(stats, sort_keys=True))
+        for stage, stage_stats in stats.iteritems():
+            MetricLogger.log_metric(RULE_PROCESSOR_NAME, MetricLogger.STAGE_TIME,
+                                    stage_stats['total_ms'], {'Stage': stage})
+
+        self.reset()
+
+    def reset(self):
+        """Clear all accumulated stages"""
+        self._stages.clear()
+
+
+class CallStats(object):
+    """Accumulate the execution cost of named callables, such as rules or matchers
+
+    For each name, the number of calls along with the cumulative time, the number
+    of calls that raised an exception and the number of calls that returned a
+    truthy value (hits) are kept until `report` is called.
+
+    Stats are not thread safe and should only be used from the main thread.
+    """
+
+    def __init__(self, kind, metric_name, enabled=False):
+        """
+        Args:
+            kind (str): What is being called, used as the dimension of the metric
+            metric_name (str): The MetricLogger metric the cumulative times are logged to
+            enabled (bool): Whether calls are being recorded
+        """
+        self.kind = kind
+        self.metric_name = metric_name
+        self.enabled = enabled
+        # Map of name to [calls, total seconds, exceptions, hits]
+        self._calls = {}
+
+    def record(self, name, elapsed, hit, error=False):
+        """Record a single call
+
+        Args:
+            name (str): Name of the rule or matcher that was called
+            elapsed (float): Time spent in the call, in seconds
+            hit (bool): True if the call returned a truthy value
+            error (bool): True if the call raised an exception
+        """
+        stats = self._calls.get(name)
+        if stats is None:
+            stats = self._calls[name] = [0, 0.0, 0, 0]
+
+        stats[0] += 1
+        stats[1] += elapsed
+        if error:
+            stats[2] += 1
+        if hit:
+            stats[3] += 1
+
+    def stats(self):
+        """Return the accumulated stats for each name
+
+        Returns:
+            dict: Map of name to a dict with the 'calls', 'total_ms', 'avg_ms',
+                'exceptions' and 'hit_rate'
+        """
+        return {name: {'calls': calls,
+                       'total_ms': round(total * 1000, 4),
+                       'avg_ms': round(total * 1000 / calls, 4),
+                       'exceptions': exceptions,
+                       'hit_rate': round(float(hits) / calls, 4)}
+                for name, (calls, total, exceptions, hits) in self._calls.iteritems()}
+
+    def top(self, count=10):
+        """Return the stats for the most expensive names, by cumulative time
+
+        Args:
+            count (int): Maximum number of entries to return
+
+        Returns:
+            list: Tuples of (name, stats dict), most expensive first
+        """
+        return sorted(self.stats().iteritems(),
+                      key=lambda item: item[1]['total_ms'],
+                      reverse=True)[:count]
+
+    def report(self, count=10):
+        """Log the most expensive names, record their totals as metrics and reset
+
+        Args:
+            count (int): Number of the most expensive names to report
+        """
+        if not self._calls:
+            return
+
+        top = self.top(count)
+        LOGGER.info('[%s Stats] %s', self.kind, json.dumps(top))
+        for name, call_stats in top:
+            MetricLogger.log_metric(RULE_PROCESSOR_NAME, self.metric_name,
+                                    call_stats['total_ms'], {self.kind: name})
+
+        self.reset()
+
+    def reset(self):
+        """Clear all accumulated stats"""
+        self._calls.clear()
+
+
+# The timers used to instrument stages of the current invocation
+TIMERS = StageTimers(ENABLE_STAGE_TIMERS)
+
+# The execution cost of each rule and matcher for the current invocation
+RULE_STATS = CallStats('Rule', MetricLogger.RULE_TIME, ENABLE_RULE_STATS)
+MATCHER_STATS = CallStats('Matcher', MetricLogger.MATCHER_TIME, ENABLE_RULE_STATS)
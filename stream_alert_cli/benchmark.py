@@ -0,0 +1,757 @@
+"""
+Copyright 2017-present, Airbnb Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+import csv
+from datetime import datetime
+import json
+import logging
+import os
+import resource
+import shutil
+from StringIO import StringIO
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urlparse import urlsplit, urlunsplit
+
+import boto3
+from mock import patch
+from requests.adapters import HTTPAdapter
+
+from stream_alert.alert_processor import main as alert_processor
+from stream_alert.alert_processor.outputs.output_base import (
+    OutputDispatcher,
+    StreamAlertOutput
+)
+from stream_alert.rule_processor.handler import StreamAlert
+from stream_alert.rule_processor.sink import LambdaAlertTransport
+# import all rules loaded from the main handler
+import stream_alert.rule_processor.main  # pylint: disable=unused-import
+from stream_alert.shared.stats import TIMERS
+from stream_alert_cli import helpers
+from stream_alert_cli.manage_lambda.package import RuleProcessorPackage
+from stream_alert_cli.logger import LOGGER_CLI, LOGGER_SA, LOGGER_SH, LOGGER_SO
+
+# Default values used for each type declared in a log schema
+SYNTHETIC_VALUES = {
+    'string': 'streamalert-benchmark',
+    'integer': 100,
+    'float': 1.5,
+    'boolean': True
+}
+
+# Descriptor used for the output configured for each dispatcher
+BENCHMARK_DESCRIPTOR = 'benchmark'
+
+# The unmocked send method of requests, since moto intercepts all HTTP requests
+# while it is active, including those sent to the local stub server
+_HTTP_SEND = HTTPAdapter.send
+
+# Sections of the results that are reported, and the rate reported for each
+RESULT_SECTIONS = (
+    ('log_types', 'records_per_second'),
+    ('parsers', 'records_per_second'),
+    ('outputs', 'alerts_per_second')
+)
+
+
+def _synthetic_json(schema):
+    """Generate a record that conforms to a json schema
+
+    Args:
+        schema (dict): Log schema, mapping keys to their type
+
+    Returns:
+        dict: A record with a value for every key in the schema
+    """
+    record = {}
+    for key, value_type in schema.iteritems():
+        if isinstance(value_type, dict):
+            # An empty dict in a schema allows any keys
+            record[key] = _synthetic_json(value_type) if value_type else {'key': 'value'}
+        elif isinstance(value_type, list):
+            record[key] = []
+        else:
+            record[key] = SYNTHETIC_VALUES.get(value_type, SYNTHETIC_VALUES['string'])
+
+    return record
+
+
+def _apply_log_patterns(record, log_patterns):
+    """Set the value of each log pattern field to a value that will match its pattern
+
+    Args:
+        record (dict): The record to update in place
+        log_patterns (dict): Log patterns from the log's configuration
+    """
+    for field, patterns in log_patterns.iteritems():
+        if isinstance(patterns, dict):
+            _apply_log_patterns(record[field], patterns)
+        elif patterns:
+            record[field] = patterns[0].replace('*', '')
+
+
+def _nest_json_path(record, json_path):
+    """Nest a record within a parent at the given json path, ie: 'Records[*]'
+
+    Args:
+        record (dict): The record to be extracted with the json path
+        json_path (str): Simple json path of dotted keys, each with an optional '[*]' suffix
+
+    Returns:
+        dict: The parent of the nested record
+    """
+    if json_path.startswith('$.'):
+        json_path = json_path[2:]
+
+    for key in reversed(json_path.split('.')):
+        if key.endswith('[*]'):
+            record = {key[:-3]: [record]}
+        else:
+            record = {key: record}
+
+    return record
+
+
+def _to_csv(values, delimiter):
+    """Join the values as a single csv row, with nested dicts as nested csv rows"""
+    row = [_to_csv(value.values(), delimiter) if isinstance(value, dict) else value
+           for value in values]
+
+    output = StringIO()
+    csv.writer(output, delimiter=delimiter).writerow(row)
+    return output.getvalue().rstrip('\r\n')
+
+
+def synthetic_record(log_config):
+    """Generate a raw record for a log type, ready to be wrapped in an event
+
+    Args:
+        log_config (dict): The log type's config from conf/logs.json
+
+    Returns:
+        str: The raw log data, or None if the parser is not supported
+    """
+    parser = log_config['parser']
+    options = log_config.get('configuration', {})
+
+    # Ordered schemas ensure csv columns are generated in the declared order
+    schema = log_config['schema']
+    record = _synthetic_json(schema)
+    _apply_log_patterns(record, options.get('log_patterns', {}))
+
+    if parser == 'json':
+        if options.get('json_regex_key'):
+            record = {options['json_regex_key']: 'message {}'.format(json.dumps(record))}
+        elif options.get('json_path'):
+            record = _nest_json_path(record, options['json_path'])
+
+        if options.get('envelope_keys'):
+            record.update(_synthetic_json(options['envelope_keys']))
+
+        return json.dumps(record)
+
+    if parser == 'csv':
+        return _to_csv([record[key] for key in schema], options.get('delimiter', ','))
+
+    if parser == 'kv':
+        separator = options.get('separator', '=')
+        return options.get('delimiter', ' ').join(
+            '{}{}{}'.format(key, separator, record[key]) for key in schema)
+
+    if parser == 'syslog':
+        return 'Jan 01 12:00:00 benchmark-host streamalert[1]: streamalert benchmark message'
+
+    LOGGER_CLI.error('Unsupported parser for benchmarks: %s', parser)
+
+
+def _wrap_records(service, source, data, count):
+    """Wrap the synthetic data as an event for the given service
+
+    Args:
+        service (str): The service of the source (kinesis, s3, sns, stream_alert_app)
+        source (str): The name of the source entity
+        data (str): A single raw record
+        count (int): The number of records to include in the event
+
+    Returns:
+        dict: An event that is passed to the rule processor
+    """
+    test_record = {'service': service, 'source': source}
+
+    # S3 objects and app events contain many records, while kinesis and
+    # sns events contain many records that each contain a single log
+    if service == 's3':
+        test_record['data'] = '\n'.join([data] * count)
+        return {'Records': [helpers.format_lambda_test_record(test_record)]}
+
+    test_record['data'] = data
+    if service == 'stream_alert_app':
+        record = helpers.format_lambda_test_record(test_record)
+        record['logs'] = [data] * count
+        return {'Records': [record]}
+
+    return {'Records': [helpers.format_lambda_test_record(dict(test_record))
+                        for _ in range(count)]}
+
+
+class _StubAlertTransport(LambdaAlertTransport):
+    """Accept every batch of alerts without sending it
+
+    The batch limits of the Lambda transport are kept, so serializing, batching
+    and queueing alerts to the sink's workers are included in the benchmark.
+    """
+
+    def send(self, alerts):
+        return len(alerts)
+
+
+class RuleProcessorBenchmark(object):
+    """Benchmark the rule processor with synthetic records for each log type
+
+    Triggered alerts are sent through the sink to a stub transport, so only the
+    request to the alert processor itself is excluded from the results.
+    """
+
+    def __init__(self, context, config, records, iterations):
+        """
+        Args:
+            context (namedtuple): A constructed aws context object
+            config (CLIConfig): Configuration for this StreamAlert setup
+            records (int): Number of records included in each event
+            iterations (int): Number of times each event is processed
+        """
+        with patch('stream_alert.rule_processor.sink.load_alert_transport',
+                   lambda env, _: _StubAlertTransport(env)):
+            self.processor = StreamAlert(context)
+        self.config = config
+        self.records = records
+        self.iterations = iterations
+
+    def _log_sources(self, log_type):
+        """Find the sources configured to send this log type
+
+        Args:
+            log_type (str): The log type, ie: cloudtrail:events
+
+        Yields:
+            tuple: The (service, source) of each source sending this log type
+        """
+        log_prefix = log_type.split(':')[0]
+        for service, sources in sorted(self.config['sources'].iteritems()):
+            for source, source_config in sorted(sources.iteritems()):
+                if log_prefix in source_config['logs']:
+                    yield service, source
+                    # One source per service is enough to benchmark this log type
+                    break
+
+    def _run_event(self, event):
+        """Process an event the configured number of times
+
+        Returns:
+            tuple: The elapsed time in seconds, and whether all records matched a schema
+        """
+        all_matched = True
+        elapsed = 0.0
+        for _ in range(self.iterations):
+            start = time.time()
+            all_matched = self.processor.run(event) and all_matched
+            elapsed += time.time() - start
+
+        return elapsed, all_matched
+
+    def run(self, log_types_filter=None):
+        """Run the benchmark for each log type
+
+        Args:
+            log_types_filter (set): If provided, only these log types are benchmarked
+
+        Returns:
+            dict: The benchmark results for each log type and parser
+        """
+        results = OrderedDict()
+        parsers = {}
+
+        TIMERS.enabled = True
+        with patch.object(TIMERS, 'report'):
+            for log_type, log_config in sorted(self.config['logs'].iteritems()):
+                if log_types_filter and log_type not in log_types_filter:
+                    continue
+
+                sources = list(self._log_sources(log_type))
+                if not sources:
+                    LOGGER_CLI.warn('No sources are configured to send \'%s\' logs, skipping',
+                                    log_type)
+                    continue
+
+                data = synthetic_record(log_config)
+                if not data:
+                    continue
+
+                for service, source in sources:
+                    TIMERS.reset()
+                    elapsed, all_matched = self._run_event(
+                        _wrap_records(service, source, data, self.records))
+
+                    total_records = self.records * self.iterations
+                    results['{}/{}'.format(log_type, service)] = {
+                        'log_type': log_type,
+                        'service': service,
+                        'parser': log_config['parser'],
+                        'records': total_records,
+                        'seconds': round(elapsed, 6),
+                        'records_per_second': round(total_records / elapsed, 2),
+                        'all_records_matched_schema': all_matched,
+                        'stages': TIMERS.stats()
+                    }
+
+                    parser_totals = parsers.setdefault(log_config['parser'], [0, 0.0])
+                    parser_totals[0] += total_records
+                    parser_totals[1] += elapsed
+
+        TIMERS.reset()
+
+        return {
+            'parsers': {parser: {'records': records,
+                                 'seconds': round(elapsed, 6),
+                                 'records_per_second': round(records / elapsed, 2)}
+                        for parser, (records, elapsed) in parsers.iteritems()},
+            'log_types': results
+        }
+
+
+class _StubHTTPHandler(BaseHTTPRequestHandler):
+    """Respond to every request with a body that satisfies each HTTP output
+
+    The last segment of the path is included as a list of one item, since this
+    is how the PagerDuty API returns users, services, priorities, etc.
+    """
+
+    def _respond(self):
+        """Read the request body and write a successful json response"""
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+
+        response = {os.path.basename(urlsplit(self.path).path): [
+            {'id': '1', 'name': BENCHMARK_DESCRIPTOR}
+        ]}
+        response.update({
+            'id': '1',
+            'count': 0,
+            'data': [],
+            'dedup_key': BENCHMARK_DESCRIPTOR,
+            'incident': {'id': '1'},
+            'session': {'name': BENCHMARK_DESCRIPTOR, 'value': BENCHMARK_DESCRIPTOR}
+        })
+        body = json.dumps(response)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = _respond
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Suppress logging of each request"""
+
+
+def _percentile(values, percent):
+    """Return the nearest-rank percentile of a sorted list of values"""
+    index = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return values[index]
+
+
+class AlertProcessorBenchmark(object):
+    """Benchmark the alert processor by dispatching synthetic alerts to every output
+
+    AWS outputs are sent to moto, while all HTTP requests are redirected to a
+    local stub server so the full request path of each output is exercised.
+    """
+
+    def __init__(self, context, config, alerts):
+        """
+        Args:
+            context (namedtuple): A constructed aws context object
+            config (CLIConfig): Configuration for this StreamAlert setup
+            alerts (int): Number of alerts sent to each output
+        """
+        self.context = context
+        self.region = config['global']['account']['region']
+        self.alerts = alerts
+        self.kms_alias = 'alias/stream_alert_secrets_test'
+        # pylint: disable=protected-access
+        self.secrets_bucket = OutputDispatcher._get_secrets_bucket_name(context.function_name)
+        self.outputs_config = {}
+        self._creds_times = {}
+
+    def _setup_output(self, service, output):
+        """Configure an output for this dispatcher, and mock its resources and credentials
+
+        Args:
+            service (str): The name of the output service
+            output (OutputDispatcher): The dispatcher class for this service
+        """
+        resource_name = '{}-{}'.format(BENCHMARK_DESCRIPTOR, service)
+        props = OrderedDict()
+        for name, prop in output.get_user_defined_properties().iteritems():
+            if name == 'descriptor':
+                value = BENCHMARK_DESCRIPTOR
+            elif name == 'aws_value':
+                value = resource_name
+            elif name in ('url', 'api'):
+                value = 'https://{}.benchmark.local'.format(service)
+            else:
+                value = BENCHMARK_DESCRIPTOR
+            props[name] = prop._replace(value=value)
+
+        self.outputs_config[service] = output.format_output_config(self.outputs_config, props)
+
+        if service == 'aws-s3':
+            boto3.client('s3', region_name=self.region).create_bucket(Bucket=resource_name)
+        elif service == 'aws-firehose':
+            helpers.create_delivery_stream(self.region, resource_name)
+        elif service == 'aws-lambda':
+            helpers.create_lambda_function(resource_name, self.region)
+
+        creds = {name: prop.value for name, prop in props.iteritems() if prop.cred_requirement}
+        if creds:
+            helpers.put_mock_creds(output.output_cred_name(BENCHMARK_DESCRIPTOR), creds,
+                                   self.secrets_bucket, self.region, self.kms_alias)
+
+    def _timed_load_creds(self):
+        """Return a replacement for OutputDispatcher._load_creds that times each call"""
+        load_creds = OutputDispatcher._load_creds  # pylint: disable=protected-access
+        creds_times = self._creds_times
+
+        def _load_creds(dispatcher, descriptor):
+            """Time the loading of credentials for this dispatcher"""
+            start = time.time()
+            try:
+                return load_creds(dispatcher, descriptor)
+            finally:
+                creds_times.setdefault(dispatcher.__service__, []).append(
+                    (time.time() - start) * 1000)
+
+        return _load_creds
+
+    @staticmethod
+    def _redirect_send(address):
+        """Return a replacement for HTTPAdapter.send that sends requests to the stub server"""
+        def _send(adapter, request, **kwargs):
+            """Send the request to the stub server, keeping the original path and query"""
+            url = urlsplit(request.url)
+            request.url = urlunsplit(('http', address, url.path, url.query, ''))
+            return _HTTP_SEND(adapter, request, **kwargs)
+
+        return _send
+
+    @staticmethod
+    def _synthetic_alert(service):
+        """Create a synthetic alert that is sent to the benchmark output of a service"""
+        return {
+            'record': _synthetic_json({'key_{:02}'.format(index): 'string'
+                                       for index in range(20)}),
+            'rule_name': 'benchmark_rule',
+            'rule_description': 'Synthetic alert used to benchmark the alert processor',
+            'log_type': 'json',
+            'log_source': 'benchmark:log',
+            'outputs': ['{}:{}'.format(service, BENCHMARK_DESCRIPTOR)],
+            'source_service': 'kinesis',
+            'source_entity': 'benchmark_stream',
+            'context': {}
+        }
+
+    def _run_output(self, service):
+        """Send the alerts to the output of a service
+
+        Returns:
+            dict: The benchmark results for this output
+        """
+        # Remove any cached credentials so the first load is measured from S3
+        # pylint: disable=protected-access
+        shutil.rmtree(OutputDispatcher._local_temp_dir(), ignore_errors=True)
+
+        alert = self._synthetic_alert(service)
+        latencies = []
+        sent = 0
+        for _ in range(self.alerts):
+            start = time.time()
+            for success, _ in alert_processor.run(alert, self.region,
+                                                  self.context.function_name,
+                                                  self.outputs_config):
+                sent += bool(success)
+            latencies.append((time.time() - start) * 1000)
+
+        elapsed = sum(latencies) / 1000
+        latencies.sort()
+        creds_times = self._creds_times.get(service, [])
+
+        return {
+            'alerts': self.alerts,
+            'sent': sent,
+            'seconds': round(elapsed, 6),
+            'alerts_per_second': round(self.alerts / elapsed, 2),
+            'latency_ms': {'p50': round(_percentile(latencies, 50), 4),
+                           'p90': round(_percentile(latencies, 90), 4),
+                           'p99': round(_percentile(latencies, 99), 4),
+                           'max': round(latencies[-1], 4)},
+            'load_creds_ms': {'count': len(creds_times),
+                              'first': round(creds_times[0], 4) if creds_times else 0,
+                              'total': round(sum(creds_times), 4)},
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+
+    def run(self, outputs_filter=None):
+        """Run the benchmark for each registered output
+
+        Args:
+            outputs_filter (set): If provided, only these outputs are benchmarked
+
+        Returns:
+            dict: The benchmark results for each output
+        """
+        dispatchers = StreamAlertOutput.get_all_outputs()
+        services = sorted(service for service in dispatchers
+                          if not outputs_filter or service in outputs_filter)
+        for service in services:
+            self._setup_output(service, dispatchers[service])
+
+        server = HTTPServer(('127.0.0.1', 0), _StubHTTPHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        address = '{}:{}'.format(*server.server_address)
+        results = OrderedDict()
+        try:
+            with patch.object(HTTPAdapter, 'send', self._redirect_send(address)), \
+                    patch.object(OutputDispatcher, '_load_creds', self._timed_load_creds()):
+                for service in services:
+                    results[service] = self._run_output(service)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        return {'outputs': results}
+
+
+class ColdStartBenchmark(object):
+    """Measure the time taken to import the Rule Processor and its rules in a new process
+
+    The Rule Processor deployment package is copied to a temporary directory,
+    including the rule manifest, and imported from there both with and without
+    lazy rule loading.
+    """
+    # Python source run in a new interpreter to time the import of the Rule Processor
+    IMPORT_SCRIPT = (
+        'import json, time\n'
+        'start = time.time()\n'
+        'from stream_alert.rule_processor import main\n'
+        'print(json.dumps({"import_ms": (time.time() - start) * 1000, '
+        '"modules": main.RULE_IMPORT_TIMES}))\n'
+    )
+
+    def __init__(self, config, iterations):
+        self.config = config
+        self.iterations = iterations
+
+    def _import_times(self, package_path, lazy):
+        """Import the Rule Processor in new processes and average the import times
+
+        Returns:
+            dict: Average total import time, and average import time of each rule module
+        """
+        env = dict(os.environ, LAZY_RULE_LOADING='1' if lazy else '0')
+        import_ms = 0.0
+        modules = {}
+        for _ in range(self.iterations):
+            output = subprocess.check_output(  # nosec
+                [sys.executable, '-c', self.IMPORT_SCRIPT], cwd=package_path, env=env)
+            times = json.loads(output.splitlines()[-1])
+            import_ms += times['import_ms']
+            for module, module_ms in times['modules'].iteritems():
+                modules[module] = modules.get(module, 0.0) + module_ms
+
+        modules = {module: round(total / self.iterations, 4)
+                   for module, total in modules.iteritems()}
+        return {
+            'import_ms': round(import_ms / self.iterations, 4),
+            'rules_import_ms': round(sum(modules.itervalues()), 4),
+            'modules_imported': len(modules),
+            'modules': modules
+        }
+
+    def run(self):
+        """Run the cold start benchmark with eager and lazy rule loading
+
+        Returns:
+            dict: Import times for each mode, keyed by 'eager' and 'lazy'
+        """
+        package_path = os.path.join(tempfile.mkdtemp(), 'rule_processor')
+        try:
+            RuleProcessorPackage(self.config)._copy_files(  # pylint: disable=protected-access
+                package_path)
+            results = OrderedDict()
+            for mode in ('eager', 'lazy'):
+                results[mode] = self._import_times(package_path, mode == 'lazy')
+        finally:
+            shutil.rmtree(os.path.dirname(package_path))
+
+        return {'cold_start': results}
+
+
+def report_cold_start(results, baseline=None, count=10):
+    """Print the cold start import times and the slowest rule modules to import
+
+    Args:
+        results (dict): Results returned from the cold start benchmark
+        baseline (dict): Results of a previous benchmark to compare against
+        count (int): Number of the slowest modules to print
+    """
+    for mode, result in results['cold_start'].iteritems():
+        change = ''
+        if baseline and mode in baseline.get('cold_start', {}):
+            previous = baseline['cold_start'][mode]['import_ms']
+            change = ' ({:+.1f}%)'.format(
+                (result['import_ms'] - previous) * 100.0 / previous)
+
+        LOGGER_CLI.info('Cold start with %s rule loading: %.2fms%s, %d rule modules '
+                        'imported in %.2fms', mode, result['import_ms'], change,
+                        result['modules_imported'], result['rules_import_ms'])
+
+    slowest = sorted(results['cold_start']['eager']['modules'].iteritems(),
+                     key=lambda item: item[1], reverse=True)[:count]
+    LOGGER_CLI.info('Slowest rule modules to import:')
+    for module, module_ms in slowest:
+        LOGGER_CLI.info('%s: %.2fms', module, module_ms)
+
+
+def report_results(results, baseline=None):
+    """Print a summary of the benchmark results, compared to a baseline if provided
+
+    Args:
+        results (dict): Results returned from a benchmark
+        baseline (dict): Results of a previous benchmark to compare against
+    """
+    def _change(section, name, rate_key, value):
+        """Return the percent change of the rate from the baseline"""
+        if not baseline or name not in baseline.get(section, {}):
+            return ''
+
+        previous = baseline[section][name][rate_key]
+        return ' ({:+.1f}%)'.format((value - previous) * 100.0 / previous)
+
+    for section, rate_key in RESULT_SECTIONS:
+        if section not in results:
+            continue
+
+        LOGGER_CLI.info('%s by %s:', rate_key.replace('_', ' ').capitalize(),
+                        section[:-1].replace('_', ' '))
+        for name, result in sorted(results[section].iteritems()):
+            rate = result[rate_key]
+            LOGGER_CLI.info('%s: %.2f%s', name, rate, _change(section, name, rate_key, rate))
+
+            if result.get('all_records_matched_schema') is False:
+                LOGGER_CLI.warn('Not all records for %s matched a schema', name)
+
+            if 'sent' in result and result['sent'] < result['alerts']:
+                LOGGER_CLI.warn('Only %d of %d alerts were sent to %s',
+                                result['sent'], result['alerts'], name)
+
+
+def benchmark_handler(options, config):
+    """Run the benchmark for a processor and save the results
+
+    Args:
+        options (namedtuple): CLI options (processor, records, iterations, etc)
+        config (CLIConfig): Configuration for this StreamAlert setup
+    """
+    if options.cold_start:
+        _cold_start_handler(options, config)
+        return
+
+    context = helpers.get_context_from_config(None, config)
+
+    @helpers.mock_me(context)
+    def run_benchmark(options, context):
+        """Run the benchmark within the mocked AWS services"""
+        if not options.debug:
+            for logger in (LOGGER_SA, LOGGER_SH, LOGGER_SO):
+                logger.setLevel(logging.WARN)
+
+        if options.processor == 'alert':
+            benchmark = AlertProcessorBenchmark(context, config, options.alerts)
+            results = benchmark.run(options.outputs)
+            results['alerts'] = options.alerts
+            return results
+
+        helpers.setup_mock_firehose_delivery_streams(config)
+        helpers.setup_mock_dynamodb_ioc_table(config)
+
+        benchmark = RuleProcessorBenchmark(context, config, options.records, options.iterations)
+        results = benchmark.run(options.log_types)
+        results.update({'records': options.records, 'iterations': options.iterations})
+        return results
+
+    results = run_benchmark(options, context)
+    results.update({
+        'processor': options.processor,
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report_results(results, baseline)
+
+    output = options.output or '{}_processor_benchmark.json'.format(options.processor)
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    LOGGER_CLI.info('Benchmark results saved to %s', output)
+
+
+def _cold_start_handler(options, config):
+    """Run the cold start benchmark of the Rule Processor and save the results
+
+    Args:
+        options (namedtuple): CLI options (iterations, output, baseline)
+        config (CLIConfig): Configuration for this StreamAlert setup
+    """
+    results = ColdStartBenchmark(config, options.iterations).run()
+    results.update({
+        'iterations': options.iterations,
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report_cold_start(results, baseline)
+
+    output = options.output or 'rule_processor_cold_start.json'
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    LOGGER_CLI.info('Benchmark results saved to %s', output)
@@ -16,6 +16,7 @@ limitations under the License.
 import base64
 from datetime import datetime
 import hashlib
+import json
 import os
 import shutil
 import tempfile
@@ -26,6 +27,7 @@ from botocore.exceptions import ClientError
 
 from app_integrations import __version__ as apps_version
 from stream_alert import __version__ as stream_alert_version
+from stream_alert.rule_processor.config import write_config_snapshot
 from stream_alert.threat_intel_downloader import __version__ as ti_downloader_version
 from stream_alert_cli.helpers import run_command
 from stream_alert_cli.logger import LOGGER_CLI
@@ -289,6 +291,18 @@ class RuleProcessorPackage(LambdaPackage):
     third_party_libs = {'backoff', 'jsonpath_rw'}
     version = stream_alert_version
 
+    def _copy_files(self, temp_package_path):
+        """Copy all files and folders, and write the config snapshot and the rule manifest"""
+        # The rule processor loads its rules when it is imported, so only import it here
+        from stream_alert.rule_processor.main import build_rules_manifest, RULES_MANIFEST
+
+        super(RuleProcessorPackage, self)._copy_files(temp_package_path)
+
+        write_config_snapshot(os.path.join(temp_package_path, 'conf'))
+
+        with open(os.path.join(temp_package_path, RULES_MANIFEST), 'w') as manifest_file:
+            json.dump(build_rules_manifest(), manifest_file, indent=2, sort_keys=True)
+
 
 class AlertProcessorPackage(LambdaPackage):
     """Deployment package class for the StreamAlert Alert Processor function"""
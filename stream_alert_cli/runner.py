@@ -17,6 +17,7 @@ from app_integrations.apps.app_base import StreamAlertApp
 from stream_alert.alert_processor.outputs.output_base import StreamAlertOutput
 from stream_alert_cli.apps import save_app_auth_info
 from stream_alert_cli.athena.handler import athena_handler
+from stream_alert_cli.benchmark import benchmark_handler
 from stream_alert_cli.config import CLIConfig
 from stream_alert_cli.helpers import user_input
 from stream_alert_cli.kinesis.handler import kinesis_handler
@@ -87,6 +88,9 @@ def cli_runner(options):
     elif options.command == 'threat_intel_downloader':
         threat_intel_downloader_handler(options, CONFIG)
 
+    elif options.command == 'benchmark':
+        benchmark_handler(options, CONFIG)
+
 
 def configure_handler(options):
     """Configure StreamAlert main settings
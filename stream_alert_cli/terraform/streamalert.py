@@ -57,6 +57,7 @@ def generate_stream_alert(cluster_name, cluster_dict, config):
             },
             "log_level": "info",
             "memory": 128,
+            "metrics_format": "log",
             "timeout": 10
           }
         }
@@ -78,6 +79,8 @@ def generate_stream_alert(cluster_name, cluster_dict, config):
             ['rule_processor'].get('enable_metrics', True),
         'rule_processor_log_level': modules['stream_alert'] \
             ['rule_processor'].get('log_level', 'info'),
+        'rule_processor_metrics_format': modules['stream_alert'] \
+            ['rule_processor'].get('metrics_format', 'log'),
         'rule_processor_memory': modules['stream_alert']['rule_processor']['memory'],
         'rule_processor_timeout': modules['stream_alert']['rule_processor']['timeout'],
         'rule_processor_version': modules['stream_alert']['rule_processor']['current_version'],
@@ -98,6 +101,46 @@ def generate_stream_alert(cluster_name, cluster_dict, config):
             ['dynamodb_ioc_table'] = config['global']['threat_intel']['dynamodb_table']
         cluster_dict['module']['stream_alert_{}'.format(cluster_name)] \
             ['threat_intel_enabled'] = config['global']['threat_intel']['enabled']
+
+    # Allow the IOC files of the local Threat Intel backend to be read from S3
+    threat_intel_config = config['global'].get('threat_intel', {})
+    if threat_intel_config.get('enabled') and threat_intel_config.get('backend') == 'local':
+        ioc_s3_objects = [ioc_file[len('s3://'):]
+                          for ioc_file in threat_intel_config.get('ioc_files', [])
+                          if ioc_file.startswith('s3://')]
+        if ioc_s3_objects:
+            cluster_dict['module']['stream_alert_{}'.format(cluster_name)] \
+                ['threat_intel_ioc_s3_objects'] = ioc_s3_objects
+
+    # Create the alerts queue, and the schedule that sends alerts from it,
+    # if it is enabled within the global infrastructure settings
+    queue_config = config['global'].get('infrastructure', {}).get('alerts_queue', {})
+    if queue_config.get('enabled'):
+        cluster_dict['module']['stream_alert_{}'.format(cluster_name)] \
+            ['alerts_queue_enabled'] = True
+        if 'schedule_expression' in queue_config:
+            cluster_dict['module']['stream_alert_{}'.format(cluster_name)] \
+                ['alerts_queue_schedule_expression'] = queue_config['schedule_expression']
+
+    # Allow records that fail to be sent to Firehose to be written to the dead letter location
+    firehose_config = config['global'].get('infrastructure', {}).get('firehose', {})
+    if firehose_config.get('enabled') and firehose_config.get('dead_letter_bucket'):
+        cluster_dict['module']['stream_alert_{}'.format(cluster_name)].update({
+            'firehose_dead_letter_enabled': True,
+            'firehose_dead_letter_bucket': firehose_config['dead_letter_bucket'],
+            'firehose_dead_letter_prefix': firehose_config.get('dead_letter_prefix',
+                                                               'dead_letter')
+        })
+
+    # Allow alerts to be offloaded to, and fetched from, the large alerts bucket
+    large_alerts_config = config['global'].get('infrastructure', {}).get('large_alerts', {})
+    if large_alerts_config.get('enabled'):
+        cluster_dict['module']['stream_alert_{}'.format(cluster_name)].update({
+            'large_alerts_enabled': True,
+            'large_alerts_bucket': large_alerts_config.get(
+                'bucket', '{}.streamalerts'.format(account['prefix']))
+        })
+
     # Add Alert Processor output config from the loaded cluster file
     output_config = modules['stream_alert']['alert_processor'].get('outputs')
     if output_config:
@@ -13,6 +13,7 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+# pylint: disable=too-many-lines
 from collections import namedtuple
 import logging
 import os
@@ -33,6 +34,7 @@ from stream_alert.rule_processor.handler import StreamAlert
 import stream_alert.rule_processor.main  # pylint: disable=unused-import
 from stream_alert.rule_processor.payload import load_stream_payload
 from stream_alert.rule_processor.rules_engine import StreamRules
+from stream_alert.shared.stats import MATCHER_STATS, RULE_STATS
 from stream_alert_cli import helpers
 from stream_alert_cli.logger import (
     get_log_memory_hanlder,
@@ -65,7 +67,7 @@ class StatusMessage(StatusMessageBase):
 class RuleProcessorTester(object):
     """Class to encapsulate testing the rule processor"""
 
-    def __init__(self, context, config, print_output):
+    def __init__(self, context, config, print_output, rule_stats=False):
         """RuleProcessorTester initializer
 
         Args:
@@ -75,6 +77,8 @@ class RuleProcessorTester(object):
                 true for rule processor tests and end-to-end tests.
                 Warnings and errors captrued during rule processor testing
                 will still be written to stdout regardless of this setting.
+            rule_stats (bool): Whether the execution cost of the rules and
+                matchers should be reported after all tests have run
         """
         helpers.setup_mock_dynamodb_ioc_table(config)
         # Create the RuleProcessor. Passing a mocked context object with fake
@@ -86,6 +90,7 @@ class RuleProcessorTester(object):
         self.total_tests = 0
         self.all_tests_passed = True
         self.print_output = print_output
+        self.rule_stats = rule_stats
         helpers.setup_mock_firehose_delivery_streams(config)
 
     def test_processor(self, rules_filter, files_filter, validate_only):
@@ -156,6 +161,9 @@ class RuleProcessorTester(object):
         # Report on the final test results
         self.report_output_summary()
 
+        if self.rule_stats:
+            self.report_rule_stats()
+
     def _filter_files(self, file_info, files_filter):
         """Filter the test files based in input from the user
 
@@ -437,6 +445,27 @@ class RuleProcessorTester(object):
                 LOGGER_CLI.warn('%s(%d/%d) %s%s', COLOR_YELLOW, index, warning_count,
                                 warning.message, COLOR_RESET)
 
+    @staticmethod
+    def report_rule_stats(count=10):
+        """Print the execution cost of the most expensive rules and matchers
+
+        Args:
+            count (int): Number of the most expensive rules and matchers to print
+        """
+        for call_stats in (RULE_STATS, MATCHER_STATS):
+            top = call_stats.top(count)
+            if not top:
+                continue
+
+            LOGGER_CLI.info('Top %d %s(s) by cumulative time:', len(top), call_stats.kind.lower())
+            for name, stats in top:
+                LOGGER_CLI.info('%s: %d call(s), %.4f ms total, %.4f ms avg, '
+                                '%d exception(s), %.2f%% hit rate', name, stats['calls'],
+                                stats['total_ms'], stats['avg_ms'], stats['exceptions'],
+                                stats['hit_rate'] * 100)
+
+            call_stats.reset()
+
     def test_rule(self, record):
         """Feed formatted records into StreamAlert and check for alerts
 
@@ -448,13 +477,12 @@ class RuleProcessorTester(object):
             list: alerts that hit for this rule
             bool: False if errors occurred during processing
         """
-        # Clear out any old alerts or errors from the previous test run
-        # pylint: disable=protected-access
-        del self.processor._alerts[:]
-        self.processor._failed_record_count = 0
-
-        # Run the rule processor
-        all_records_matched_schema = self.processor.run(record)
+        # Run the rule processor, keeping rule stats across all of the test runs
+        # and only enabling them for the duration of this run
+        with patch.object(RULE_STATS, 'enabled', self.rule_stats), \
+                patch.object(MATCHER_STATS, 'enabled', self.rule_stats), \
+                patch.object(RULE_STATS, 'report'), patch.object(MATCHER_STATS, 'report'):
+            all_records_matched_schema = self.processor.run(record)
 
         alerts = self.processor.get_alerts()
 
@@ -942,7 +970,8 @@ def stream_alert_test(options, config):
                        if run_options.get('processor') else
                        run_options.get('command') == 'live-test')
 
-        rule_proc_tester = RuleProcessorTester(context, config, test_rules)
+        rule_proc_tester = RuleProcessorTester(context, config, test_rules,
+                                               run_options.get('rule_stats', False))
         alert_proc_tester = AlertProcessorTester(config, context)
 
         validate_schemas = options.command == 'validate-schemas'
@@ -75,6 +75,54 @@ data "aws_iam_policy_document" "streamalert_rule_processor_firehose" {
   }
 }
 
+// IAM Role Policy: Allow the Rule Processor to write records that failed to
+//                  be sent to Firehose to the dead letter location
+resource "aws_iam_role_policy" "streamalert_rule_processor_firehose_dead_letter" {
+  count  = "${var.firehose_dead_letter_enabled ? 1 : 0}"
+  name   = "S3WriteFirehoseDeadLetter"
+  role   = "${aws_iam_role.streamalert_rule_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.rule_processor_firehose_dead_letter.json}"
+}
+
+// IAM Policy Doc: Allow putting failed records in the dead letter location
+data "aws_iam_policy_document" "rule_processor_firehose_dead_letter" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "s3:PutObject",
+    ]
+
+    resources = [
+      "arn:aws:s3:::${var.firehose_dead_letter_bucket}/${var.firehose_dead_letter_prefix}/*",
+    ]
+  }
+}
+
+// IAM Role Policy: Allow the Rule Processor to publish buffered metrics
+resource "aws_iam_role_policy" "streamalert_rule_processor_put_metric_data" {
+  count  = "${var.rule_processor_metrics_format == "api" ? 1 : 0}"
+  name   = "CloudwatchPutMetricData"
+  role   = "${aws_iam_role.streamalert_rule_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.rule_processor_put_metric_data.json}"
+}
+
+// IAM Policy Doc: Allow publishing metrics with PutMetricData
+data "aws_iam_policy_document" "rule_processor_put_metric_data" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "cloudwatch:PutMetricData",
+    ]
+
+    # PutMetricData does not support resource-level permissions
+    resources = [
+      "*",
+    ]
+  }
+}
+
 // IAM Role Policy: Allow Rule Processor to read DynamoDB table (Threat Intel)
 resource "aws_iam_role_policy" "streamalert_rule_processor_dynamodb" {
   count  = "${var.threat_intel_enabled ? 1 : 0}"
@@ -99,6 +147,75 @@ data "aws_iam_policy_document" "streamalert_rule_processor_read_dynamodb" {
   }
 }
 
+// IAM Role Policy: Allow the Rule Processor to send alerts to the alerts queue
+resource "aws_iam_role_policy" "streamalert_rule_processor_sqs" {
+  count  = "${var.alerts_queue_enabled ? 1 : 0}"
+  name   = "SQSSendAlerts"
+  role   = "${aws_iam_role.streamalert_rule_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.rule_processor_send_alerts_queue.json}"
+}
+
+// IAM Policy Doc: Allow sending messages to the alerts queue
+//                 SendMessageBatch requests are authorized by sqs:SendMessage
+data "aws_iam_policy_document" "rule_processor_send_alerts_queue" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "sqs:GetQueueUrl",
+      "sqs:SendMessage",
+    ]
+
+    resources = [
+      "arn:aws:sqs:${var.region}:${var.account_id}:${var.prefix}_${var.cluster}_streamalert_alerts",
+    ]
+  }
+}
+
+// IAM Role Policy: Allow the Rule Processor to write large alerts to S3
+resource "aws_iam_role_policy" "streamalert_rule_processor_large_alerts" {
+  count  = "${var.large_alerts_enabled ? 1 : 0}"
+  name   = "S3WriteLargeAlerts"
+  role   = "${aws_iam_role.streamalert_rule_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.rule_processor_write_large_alerts.json}"
+}
+
+// IAM Policy Doc: Allow putting large alerts in the configured bucket
+data "aws_iam_policy_document" "rule_processor_write_large_alerts" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "s3:PutObject",
+    ]
+
+    resources = [
+      "arn:aws:s3:::${var.large_alerts_bucket}/large_alerts/*",
+    ]
+  }
+}
+
+// IAM Role Policy: Allow the Rule Processor to read IOC files from S3 (Threat Intel)
+resource "aws_iam_role_policy" "streamalert_rule_processor_ioc_files" {
+  count  = "${length(var.threat_intel_ioc_s3_objects) > 0 ? 1 : 0}"
+  name   = "S3ReadIocFiles"
+  role   = "${aws_iam_role.streamalert_rule_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.rule_processor_read_ioc_files.json}"
+}
+
+// IAM Policy Doc: Allow getting the configured IOC files
+data "aws_iam_policy_document" "rule_processor_read_ioc_files" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "s3:GetObject",
+    ]
+
+    resources = ["${formatlist("arn:aws:s3:::%s", var.threat_intel_ioc_s3_objects)}"]
+  }
+}
+
 // IAM Role: Alert Processor Execution Role
 resource "aws_iam_role" "streamalert_alert_processor_role" {
   name = "${var.prefix}_${var.cluster}_streamalert_alert_processor_role"
@@ -168,6 +285,55 @@ data "aws_iam_policy_document" "alert_processor_s3" {
   }
 }
 
+// IAM Role Policy: Allow the Alert Processor to receive alerts from the alerts queue
+resource "aws_iam_role_policy" "streamalert_alert_processor_sqs" {
+  count  = "${var.alerts_queue_enabled ? 1 : 0}"
+  name   = "SQSReceiveAlerts"
+  role   = "${aws_iam_role.streamalert_alert_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.alert_processor_receive_alerts_queue.json}"
+}
+
+// IAM Policy Doc: Allow receiving and deleting messages from the alerts queue
+//                 DeleteMessageBatch requests are authorized by sqs:DeleteMessage
+data "aws_iam_policy_document" "alert_processor_receive_alerts_queue" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "sqs:GetQueueUrl",
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+    ]
+
+    resources = [
+      "arn:aws:sqs:${var.region}:${var.account_id}:${var.prefix}_${var.cluster}_streamalert_alerts",
+    ]
+  }
+}
+
+// IAM Role Policy: Allow the Alert Processor to read large alerts from S3
+resource "aws_iam_role_policy" "streamalert_alert_processor_large_alerts" {
+  count  = "${var.large_alerts_enabled ? 1 : 0}"
+  name   = "S3ReadLargeAlerts"
+  role   = "${aws_iam_role.streamalert_alert_processor_role.id}"
+  policy = "${data.aws_iam_policy_document.alert_processor_read_large_alerts.json}"
+}
+
+// IAM Policy Doc: Allow getting large alerts from the configured bucket
+data "aws_iam_policy_document" "alert_processor_read_large_alerts" {
+  statement {
+    effect = "Allow"
+
+    actions = [
+      "s3:GetObject",
+    ]
+
+    resources = [
+      "arn:aws:s3:::${var.large_alerts_bucket}/large_alerts/*",
+    ]
+  }
+}
+
 // IAM Role Policy: Allow the Alert Processor to write CloudWatch logs
 resource "aws_iam_role_policy" "streamalert_alert_processor_cloudwatch" {
   name = "CloudwatchWriteLogs"
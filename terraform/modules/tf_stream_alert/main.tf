@@ -16,6 +16,7 @@ resource "aws_lambda_function" "streamalert_rule_processor" {
       CLUSTER        = "${var.cluster}"
       LOGGER_LEVEL   = "${var.rule_processor_log_level}"
       ENABLE_METRICS = "${var.rule_processor_enable_metrics}"
+      METRICS_FORMAT = "${var.rule_processor_metrics_format}"
     }
   }
 
@@ -0,0 +1,45 @@
+// SQS Queue: Alerts sent from the Rule Processor to the Alert Processor
+resource "aws_sqs_queue" "alerts_queue" {
+  count = "${var.alerts_queue_enabled ? 1 : 0}"
+  name  = "${var.prefix}_${var.cluster}_streamalert_alerts"
+
+  # Messages that could not be sent are received again once the Alert Processor times out
+  visibility_timeout_seconds = "${var.alert_processor_timeout}"
+
+  tags {
+    Name = "StreamAlert"
+  }
+}
+
+// Cloudwatch Event Rule: Invoke the Alert Processor periodically to drain the alerts queue
+resource "aws_cloudwatch_event_rule" "alerts_queue_schedule" {
+  count       = "${var.alerts_queue_enabled ? 1 : 0}"
+  name        = "${var.prefix}_${var.cluster}_streamalert_alerts_queue"
+  description = "Invoke the Alert Processor periodically to send alerts from the alerts queue"
+
+  schedule_expression = "${var.alerts_queue_schedule_expression}"
+}
+
+// Cloudwatch Event Target: Point the alerts queue rule to the Alert Processor
+resource "aws_cloudwatch_event_target" "alerts_queue_alert_processor" {
+  count = "${var.alerts_queue_enabled ? 1 : 0}"
+  rule  = "${aws_cloudwatch_event_rule.alerts_queue_schedule.name}"
+  arn   = "arn:aws:lambda:${var.region}:${var.account_id}:function:${var.prefix}_${var.cluster}_streamalert_alert_processor:production"
+
+  # explicit dependency
+  depends_on = ["aws_lambda_alias.alert_processor_production", "aws_lambda_alias.alert_processor_production_vpc"]
+}
+
+// Lambda Permission: Allow Cloudwatch Scheduled Events to invoke the Alert Processor
+resource "aws_lambda_permission" "alerts_queue_schedule" {
+  count         = "${var.alerts_queue_enabled ? 1 : 0}"
+  statement_id  = "CloudwatchEventsInvokeAlertProcessor"
+  action        = "lambda:InvokeFunction"
+  function_name = "${var.prefix}_${var.cluster}_streamalert_alert_processor"
+  principal     = "events.amazonaws.com"
+  source_arn    = "${aws_cloudwatch_event_rule.alerts_queue_schedule.arn}"
+  qualifier     = "production"
+
+  # explicit dependency
+  depends_on = ["aws_lambda_alias.alert_processor_production", "aws_lambda_alias.alert_processor_production_vpc"]
+}
@@ -2,6 +2,15 @@ variable "account_id" {
   default = ""
 }
 
+variable "alerts_queue_enabled" {
+  default = false
+}
+
+variable "alerts_queue_schedule_expression" {
+  type    = "string"
+  default = "rate(1 minute)"
+}
+
 variable "alert_processor_config" {
   type    = "map"
   default = {}
@@ -49,6 +58,20 @@ variable "cluster" {
   type = "string"
 }
 
+variable "firehose_dead_letter_enabled" {
+  default = false
+}
+
+variable "firehose_dead_letter_bucket" {
+  type    = "string"
+  default = ""
+}
+
+variable "firehose_dead_letter_prefix" {
+  type    = "string"
+  default = "dead_letter"
+}
+
 variable "input_sns_topics" {
   type    = "list"
   default = []
@@ -58,6 +81,15 @@ variable "kms_key_arn" {
   type = "string"
 }
 
+variable "large_alerts_enabled" {
+  default = false
+}
+
+variable "large_alerts_bucket" {
+  type    = "string"
+  default = ""
+}
+
 variable "metric_alarms" {
   type    = "list"
   default = []
@@ -100,6 +132,11 @@ variable "rule_processor_enable_metrics" {
   default = false
 }
 
+variable "rule_processor_metrics_format" {
+  type    = "string"
+  default = "log"
+}
+
 variable "rule_processor_version" {}
 
 variable "rule_processor_memory" {}
@@ -117,6 +154,11 @@ variable "threat_intel_enabled" {
   default = false
 }
 
+variable "threat_intel_ioc_s3_objects" {
+  type    = "list"
+  default = []
+}
+
 variable "dynamodb_ioc_table" {
   default = "streamalert_threat_intel_ioc_table"
 }
@@ -17,7 +17,9 @@ limitations under the License.
 from collections import OrderedDict
 import json
 
+import boto3
 from mock import call, mock_open, patch
+from moto import mock_s3, mock_sqs
 from nose.tools import (
     assert_equal,
     assert_is_instance,
@@ -26,7 +28,13 @@ from nose.tools import (
 )
 
 import stream_alert.alert_processor as ap
-from stream_alert.alert_processor.main import _load_output_config, _sort_dict, handler
+from stream_alert.alert_processor.main import (
+    _load_output_config,
+    _resolve_alerts,
+    _sort_dict,
+    handler,
+    queue_handler
+)
 from tests.unit.stream_alert_alert_processor import FUNCTION_NAME, REGION
 from tests.unit.stream_alert_alert_processor.helpers import get_alert, get_mock_context
 
@@ -114,6 +122,111 @@ def test_running_success(creds_mock, config_mock, get_mock):
     assert_true(result[0][0])
 
 
+@patch('requests.post')
+@patch('stream_alert.alert_processor.main._load_output_config')
+@patch('stream_alert.alert_processor.outputs.output_base.OutputDispatcher._load_creds')
+def test_running_batched_alerts(creds_mock, config_mock, get_mock):
+    """Alert Processor run handler - batched alerts"""
+    config_mock.return_value = _load_output_config('tests/unit/conf/outputs.json')
+    creds_mock.return_value = {'url': 'http://mock.url'}
+    get_mock.return_value.status_code = 200
+
+    context = get_mock_context()
+
+    result = handler({'alerts': [get_alert(), get_alert()]}, context)
+    assert_equal(len(result), 2)
+    assert_true(all(sent for sent, _ in result))
+
+
+@mock_sqs
+@patch('stream_alert.alert_processor.main.QUEUE_WAIT_TIME_SECONDS', 0)
+@patch('stream_alert.alert_processor.main.run')
+@patch('logging.Logger.error')
+def test_queue_handler(log_mock, run_mock):
+    """Alert Processor queue handler - alerts received and deleted"""
+    run_mock.return_value = [(True, 'slack:unit_test_channel')]
+    client = boto3.client('sqs', region_name=REGION)
+    queue_url = client.create_queue(QueueName='corp-prefix_prod_streamalert_alerts')['QueueUrl']
+    for index in range(12):
+        client.send_message(QueueUrl=queue_url,
+                            MessageBody=json.dumps({'alerts': [{'id': index}]}))
+    client.send_message(QueueUrl=queue_url, MessageBody='bad message')
+
+    context = get_mock_context()
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    result = queue_handler(None, context)
+
+    assert_equal(len(result), 12)
+    assert_equal(sorted(args[0]['id'] for args, _ in run_mock.call_args_list), range(12))
+    log_mock.assert_called_with('Invalid message received from \'%s\': %s',
+                                'corp-prefix_prod_streamalert_alerts', 'bad message')
+    assert_equal(client.receive_message(QueueUrl=queue_url).get('Messages'), None)
+
+
+@mock_sqs
+@patch('stream_alert.alert_processor.main.QUEUE_WAIT_TIME_SECONDS', 0)
+@patch('stream_alert.alert_processor.main.run')
+@patch('logging.Logger.error')
+def test_queue_handler_failed_alerts(log_mock, run_mock):
+    """Alert Processor queue handler - messages with failed alerts are not deleted"""
+    run_mock.side_effect = lambda alert, *_: [(alert['id'] != 1, 'slack:unit_test_channel')]
+    client = boto3.client('sqs', region_name=REGION)
+    queue_url = client.create_queue(QueueName='corp-prefix_prod_streamalert_alerts')['QueueUrl']
+    for index in range(3):
+        client.send_message(QueueUrl=queue_url,
+                            MessageBody=json.dumps({'alerts': [{'id': index}]}))
+
+    context = get_mock_context()
+    context.get_remaining_time_in_millis.return_value = 60000
+
+    result = queue_handler(None, context)
+
+    assert_equal(sorted(result), [(False, 'slack:unit_test_channel'),
+                                  (True, 'slack:unit_test_channel'),
+                                  (True, 'slack:unit_test_channel')])
+    assert_equal(log_mock.call_args[0][0], 'Failed to send alerts from message %s, leaving '
+                                           'it on \'%s\' to be retried')
+    attributes = client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+    assert_equal(attributes['ApproximateNumberOfMessagesNotVisible'], '1')
+
+
+@patch('stream_alert.alert_processor.main.queue_handler')
+def test_handler_scheduled_event(queue_mock):
+    """Main handler sends alerts from the queue for scheduled events"""
+    context = get_mock_context()
+    event = {'source': 'aws.events', 'detail-type': 'Scheduled Event'}
+    handler(event, context)
+
+    queue_mock.assert_called_with(event, context)
+
+
+@mock_s3
+@patch('logging.Logger.exception')
+def test_resolve_alerts(log_mock):
+    """Alert Processor - Resolve Alerts Offloaded to S3"""
+    client = boto3.client('s3', region_name=REGION)
+    client.create_bucket(Bucket='corp-prefix.streamalerts')
+    large_alert = get_alert()
+    client.put_object(Bucket='corp-prefix.streamalerts', Key='large_alerts/alert.json',
+                      Body=json.dumps(large_alert))
+
+    alerts = [
+        {'rule_name': 'small_alert'},
+        {'streamalert:alert_reference': {'bucket': 'corp-prefix.streamalerts',
+                                         'key': 'large_alerts/alert.json'}},
+        {'streamalert:alert_reference': {'bucket': 'corp-prefix.streamalerts',
+                                         'key': 'large_alerts/missing.json'}}
+    ]
+
+    result = list(_resolve_alerts(alerts, REGION))
+
+    assert_equal(result, [{'rule_name': 'small_alert'}, large_alert])
+    assert_equal(log_mock.call_args[0][1:3],
+                 ('corp-prefix.streamalerts', 'large_alerts/missing.json'))
+
+
 @patch('logging.Logger.error')
 @patch('stream_alert.alert_processor.main._load_output_config')
 def test_running_bad_output(config_mock, log_mock):
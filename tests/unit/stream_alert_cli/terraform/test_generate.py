@@ -259,6 +259,7 @@ class TestTerraformGenerate(object):
                     'threat_intel_enabled': False,
                     'rule_processor_enable_metrics': True,
                     'rule_processor_log_level': 'info',
+                    'rule_processor_metrics_format': 'log',
                     'rule_processor_memory': 128,
                     'rule_processor_timeout': 25,
                     'rule_processor_version': '$LATEST',
@@ -297,6 +298,7 @@ class TestTerraformGenerate(object):
                     'threat_intel_enabled': False,
                     'rule_processor_enable_metrics': True,
                     'rule_processor_log_level': 'info',
+                    'rule_processor_metrics_format': 'log',
                     'rule_processor_memory': 128,
                     'rule_processor_timeout': 25,
                     'rule_processor_version': '$LATEST',
@@ -321,6 +323,68 @@ class TestTerraformGenerate(object):
         assert_equal(self.cluster_dict['module']['stream_alert_advanced'],
                      expected_advanced_cluster['module']['stream_alert_advanced'])
 
+    def test_generate_stream_alert_alerts_queue(self):
+        """CLI - Terraform Generate StreamAlert - Alerts Queue"""
+        self.config['global']['infrastructure']['alerts_queue'] = {
+            'enabled': True,
+            'schedule_expression': 'rate(5 minutes)'
+        }
+        streamalert.generate_stream_alert(
+            'test',
+            self.cluster_dict,
+            self.config
+        )
+
+        module = self.cluster_dict['module']['stream_alert_test']
+        assert_true(module['alerts_queue_enabled'])
+        assert_equal(module['alerts_queue_schedule_expression'], 'rate(5 minutes)')
+
+    def test_generate_stream_alert_large_alerts(self):
+        """CLI - Terraform Generate StreamAlert - Large Alerts"""
+        self.config['global']['infrastructure']['large_alerts'] = {'enabled': True}
+        streamalert.generate_stream_alert(
+            'test',
+            self.cluster_dict,
+            self.config
+        )
+
+        module = self.cluster_dict['module']['stream_alert_test']
+        assert_true(module['large_alerts_enabled'])
+        assert_equal(module['large_alerts_bucket'], 'unit-testing.streamalerts')
+
+    def test_generate_stream_alert_firehose_dead_letter(self):
+        """CLI - Terraform Generate StreamAlert - Firehose Dead Letter"""
+        self.config['global']['infrastructure']['firehose'] = {
+            'enabled': True,
+            'dead_letter_bucket': 'unit-testing.streamalert.data'
+        }
+        streamalert.generate_stream_alert(
+            'test',
+            self.cluster_dict,
+            self.config
+        )
+
+        module = self.cluster_dict['module']['stream_alert_test']
+        assert_true(module['firehose_dead_letter_enabled'])
+        assert_equal(module['firehose_dead_letter_bucket'], 'unit-testing.streamalert.data')
+        assert_equal(module['firehose_dead_letter_prefix'], 'dead_letter')
+
+    def test_generate_stream_alert_ioc_files(self):
+        """CLI - Terraform Generate StreamAlert - Threat Intel IOC Files in S3"""
+        self.config['global']['threat_intel'] = {
+            'backend': 'local',
+            'enabled': True,
+            'ioc_files': ['conf/iocs/ip.csv.gz', 's3://ioc-bucket/iocs/domain.csv.gz']
+        }
+        streamalert.generate_stream_alert(
+            'test',
+            self.cluster_dict,
+            self.config
+        )
+
+        assert_equal(self.cluster_dict['module']['stream_alert_test']
+                     ['threat_intel_ioc_s3_objects'], ['ioc-bucket/iocs/domain.csv.gz'])
+
     def test_generate_flow_logs(self):
         """CLI - Terraform Generate Flow Logs"""
         cluster_name = 'advanced'
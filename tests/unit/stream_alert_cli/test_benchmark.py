@@ -0,0 +1,164 @@
+"""
+Copyright 2017-present, Airbnb Inc.
+
+Licensed under the Apache License, Version 2.0 (the 'License');
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an 'AS IS' BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint: disable=protected-access
+from collections import namedtuple
+import json
+
+from mock import patch
+from moto import mock_kms, mock_s3
+from nose.tools import assert_equal, assert_is_none, assert_true
+
+from stream_alert.rule_processor.config import load_config
+from stream_alert.rule_processor.parsers import get_parser
+from stream_alert_cli import benchmark
+from tests.unit.stream_alert_rule_processor.test_helpers import get_mock_context
+
+
+def test_synthetic_records_parse():
+    """CLI - Benchmark, Synthetic Records Parse for Every Log Type"""
+    logs = load_config('tests/unit/conf')['logs']
+    for log_type, log_config in logs.iteritems():
+        yield _check_synthetic_record, log_type, log_config
+
+
+def _check_synthetic_record(log_type, log_config):
+    """Check that the synthetic record for a log type is parsed by its parser"""
+    data = benchmark.synthetic_record(log_config)
+    parser = get_parser(log_config['parser'])(log_config.get('configuration'))
+
+    assert_true(parser.parse(log_config['schema'], data), log_type)
+
+
+def test_synthetic_record_json_path():
+    """CLI - Benchmark, Synthetic Record Nested at a JSON Path with Envelope Keys"""
+    log_config = {
+        'parser': 'json',
+        'schema': {'key': 'string', 'count': 'integer'},
+        'configuration': {
+            'envelope_keys': {'owner': 'integer'},
+            'json_path': 'logEvents[*].extractedFields'
+        }
+    }
+
+    assert_equal(json.loads(benchmark.synthetic_record(log_config)), {
+        'owner': 100,
+        'logEvents': [{'extractedFields': {'key': 'streamalert-benchmark', 'count': 100}}]
+    })
+
+
+def test_synthetic_record_log_patterns():
+    """CLI - Benchmark, Synthetic Record Matches Log Patterns"""
+    log_config = {
+        'parser': 'json',
+        'schema': {'type': 'string', 'data': {'name': 'string'}},
+        'configuration': {
+            'log_patterns': {'type': ['watchlist.*'], 'data': {'name': ['test']}}
+        }
+    }
+
+    assert_equal(json.loads(benchmark.synthetic_record(log_config)),
+                 {'type': 'watchlist.', 'data': {'name': 'test'}})
+
+
+@patch('stream_alert_cli.benchmark.LOGGER_CLI.error')
+def test_synthetic_record_bad_parser(log_mock):
+    """CLI - Benchmark, Synthetic Record for Unsupported Parser"""
+    assert_is_none(benchmark.synthetic_record({'parser': 'xml', 'schema': {}}))
+    log_mock.assert_called_with('Unsupported parser for benchmarks: %s', 'xml')
+
+
+@patch('stream_alert_cli.helpers.put_mock_s3_object')
+def test_wrap_records(put_mock):
+    """CLI - Benchmark, Wrap Records for Each Service"""
+    event = benchmark._wrap_records('kinesis', 'stream', '{"key": "value"}', 3)
+    assert_equal(len(event['Records']), 3)
+
+    event = benchmark._wrap_records('stream_alert_app', 'app', '{"key": "value"}', 3)
+    assert_equal(len(event['Records']), 1)
+    assert_equal(len(event['Records'][0]['logs']), 3)
+
+    event = benchmark._wrap_records('s3', 'bucket', '{"key": "value"}', 3)
+    assert_equal(len(event['Records']), 1)
+    assert_equal(put_mock.call_args[0][2], '\n'.join(['{"key": "value"}'] * 3))
+
+
+@patch('stream_alert_cli.benchmark.LOGGER_CLI.info')
+def test_report_results_baseline(log_mock):
+    """CLI - Benchmark, Report Results Compared to a Baseline"""
+    results = {
+        'log_types': {'cloudtrail:events/s3': {'records_per_second': 150.0}},
+        'parsers': {'json': {'records_per_second': 150.0}}
+    }
+    baseline = {
+        'log_types': {'cloudtrail:events/s3': {'records_per_second': 100.0}},
+        'parsers': {}
+    }
+
+    benchmark.report_results(results, baseline)
+
+    log_mock.assert_any_call('%s: %.2f%s', 'cloudtrail:events/s3', 150.0, ' (+50.0%)')
+    log_mock.assert_any_call('%s: %.2f%s', 'json', 150.0, '')
+
+
+@patch('stream_alert_cli.benchmark.LOGGER_CLI.info')
+def test_report_cold_start(log_mock):
+    """CLI - Benchmark, Report Cold Start Compared to a Baseline"""
+    results = {'cold_start': {
+        'eager': {'import_ms': 150.0, 'rules_import_ms': 10.0, 'modules_imported': 2,
+                  'modules': {'matchers.matchers': 2.0, 'rules.example': 8.0}}
+    }}
+    baseline = {'cold_start': {'eager': {'import_ms': 200.0}}}
+
+    benchmark.report_cold_start(results, baseline, count=1)
+
+    log_mock.assert_any_call('Cold start with %s rule loading: %.2fms%s, %d rule modules '
+                             'imported in %.2fms', 'eager', 150.0, ' (-25.0%)', 2, 10.0)
+    log_mock.assert_called_with('%s: %.2fms', 'rules.example', 8.0)
+
+
+def test_percentile():
+    """CLI - Benchmark, Nearest Rank Percentile"""
+    values = range(1, 101)
+    assert_equal(benchmark._percentile(values, 50), 50)
+    assert_equal(benchmark._percentile(values, 99), 99)
+    assert_equal(benchmark._percentile([5], 90), 5)
+
+
+@patch('stream_alert.rule_processor.handler.load_config',
+       lambda: load_config('tests/unit/conf/'))
+def test_rule_processor_benchmark_sink():
+    """CLI - Benchmark, Rule Processor Sends Alerts to the Stub Transport"""
+    processor = benchmark.RuleProcessorBenchmark(get_mock_context(), {}, 1, 1).processor
+
+    assert_true(processor.enable_alert_processor)
+    assert_true(isinstance(processor.sinker._transport, benchmark._StubAlertTransport))
+    assert_equal(processor.sinker._transport.send(['{}', '{}']), 2)
+
+
+@mock_kms
+@mock_s3
+def test_alert_processor_benchmark():
+    """CLI - Benchmark, Alert Processor Sends to Outputs Through the Stub Server"""
+    context = namedtuple('Context', 'function_name')('prefix_streamalert_alert_processor')
+    config = {'global': {'account': {'region': 'us-east-1'}}}
+
+    results = benchmark.AlertProcessorBenchmark(context, config, 3).run({'aws-s3', 'slack'})
+
+    assert_equal(results['outputs'].keys(), ['aws-s3', 'slack'])
+    assert_equal(results['outputs']['slack']['sent'], 3)
+    assert_equal(results['outputs']['slack']['load_creds_ms']['count'], 3)
+    assert_equal(results['outputs']['aws-s3']['sent'], 3)
+    assert_equal(results['outputs']['aws-s3']['load_creds_ms']['count'], 0)
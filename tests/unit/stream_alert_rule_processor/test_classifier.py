@@ -269,6 +269,19 @@ class TestStreamClassifier(object):
 
         assert_list_equal(logs.keys(), ['unit_test_simple_log'])
 
+    def test_get_json_stream_paths(self):
+        """StreamClassifier - JSON Stream Paths for Source"""
+        self.classifier.load_sources('kinesis', 'test_cloudtrail_bucket')
+        assert_equal(self.classifier.get_json_stream_paths(), ['Records'])
+
+        self.classifier.load_sources('kinesis', 'unit_test_default_stream')
+        assert_equal(self.classifier.get_json_stream_paths(), [])
+
+    def test_get_json_stream_paths_mixed_parsers(self):
+        """StreamClassifier - JSON Stream Paths for Source, Not Only JSON Parsers"""
+        self.classifier._entity_log_sources = ['test_cloudtrail', 'test_log_type_kv_auditd']
+        assert_equal(self.classifier.get_json_stream_paths(), [])
+
     @patch('logging.Logger.error')
     def test_parse_convert_fail(self, log_mock):
         """StreamClassifier - Convert Failed"""
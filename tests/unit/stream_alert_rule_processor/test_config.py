@@ -17,14 +17,23 @@ limitations under the License.
 # specific test: nosetests -v -s tests/unit/file.py:TestStreamPayload.test_name
 
 # pylint: disable=protected-access
+from collections import OrderedDict
+import json
+import os
+import shutil
+import tempfile
+
 from mock import mock_open, patch
-from nose.tools import assert_equal, raises, nottest
+from nose.tools import assert_equal, assert_raises, assert_true, raises, nottest
 
 from stream_alert.rule_processor.config import (
     _validate_config,
+    CONFIG_SNAPSHOT,
     ConfigError,
     load_config,
-    load_env
+    load_env,
+    SnapshotLogs,
+    write_config_snapshot
 )
 
 from tests.unit.stream_alert_rule_processor.test_helpers import get_mock_context, get_valid_config
@@ -112,6 +121,109 @@ def test_load_env():
     assert_equal(env['lambda_alias'], 'development')
 
 
+class TestConfigSnapshot(object):
+    """Test class for loading the config from a snapshot"""
+    def __init__(self):
+        self.conf_dir = None
+
+    def setup(self):
+        """Setup before each method"""
+        self.conf_dir = os.path.join(tempfile.mkdtemp(), 'conf')
+        shutil.copytree('tests/unit/conf', self.conf_dir)
+
+    def teardown(self):
+        """Teardown after each method"""
+        shutil.rmtree(os.path.dirname(self.conf_dir))
+
+    def test_load_config_snapshot(self):
+        """Config - Load Config from a Snapshot"""
+        write_config_snapshot(self.conf_dir)
+
+        with patch.dict('os.environ', {'CLUSTER': 'advanced'}):
+            expected = load_config('tests/unit/conf')
+            config = load_config(self.conf_dir)
+
+        derived = config.pop('derived')
+        assert_equal(config, expected)
+        assert_equal(derived['classifier_plans'][('test_cloudtrail',)], ['test_cloudtrail'])
+        assert_equal(derived['firehose']['log_names']['cloudwatch:test_match_types'],
+                     'cloudwatch_test_match_types')
+        assert_true('sourceAddress' in derived['normalized_ioc_types'])
+
+    def test_snapshot_logs_decoded_on_access(self):
+        """Config - Snapshot Logs Are Decoded When Accessed"""
+        write_config_snapshot(self.conf_dir)
+        logs = load_config(self.conf_dir)['logs']
+
+        assert_true(isinstance(logs, SnapshotLogs))
+        assert_true(isinstance(dict.get(logs, 'test_log_type_csv'), basestring))
+        assert_equal(logs.get('test_log_type_csv')['schema'].keys(),
+                     ['date', 'time', 'host', 'message'])
+        assert_true(isinstance(dict.get(logs, 'test_log_type_csv'), OrderedDict))
+        assert_equal(logs.get('missing_log', 'default'), 'default')
+
+    def test_load_config_snapshot_key_order(self):
+        """Config - Load Config from a Snapshot Preserves Key Order"""
+        logs = OrderedDict([
+            ('test_ordered_kv', OrderedDict([
+                ('schema', OrderedDict([
+                    ('zeta', 'string'),
+                    ('alpha', 'integer'),
+                    ('mid', OrderedDict([('second', 'string'), ('first', 'string')]))])),
+                ('parser', 'kv'),
+                ('configuration', OrderedDict([('delimiter', ' '), ('separator', '=')]))]))
+        ])
+        with open(os.path.join(self.conf_dir, 'logs.json'), 'w') as logs_file:
+            json.dump(logs, logs_file)
+
+        expected = load_config(self.conf_dir)
+        write_config_snapshot(self.conf_dir)
+        config = load_config(self.conf_dir)
+
+        config.pop('derived')
+        assert_equal(config['logs']['test_ordered_kv']['schema'].keys(), ['zeta', 'alpha', 'mid'])
+        for key in ('sources', 'logs', 'types', 'global'):
+            _assert_same_order(config[key], expected[key])
+
+    @patch('stream_alert.rule_processor.config.LOGGER.error')
+    def test_load_config_snapshot_invalid(self, log_mock):
+        """Config - Load Config from an Invalid Snapshot Falls Back to JSON"""
+        with open(os.path.join(self.conf_dir, CONFIG_SNAPSHOT), 'w') as snapshot_file:
+            snapshot_file.write('not a snapshot')
+
+        config = load_config(self.conf_dir)
+
+        assert_true('derived' not in config)
+        assert_equal(log_mock.call_args[0][0],
+                     'Invalid config snapshot %s, loading JSON files: %s')
+
+    @patch('stream_alert.rule_processor.config.LOGGER.error')
+    def test_load_config_snapshot_missing_cluster(self, log_mock):
+        """Config - Load Config from a Snapshot Without the Current Cluster"""
+        write_config_snapshot(self.conf_dir)
+
+        with patch.dict('os.environ', {'CLUSTER': 'missing'}):
+            assert_raises(IOError, load_config, self.conf_dir)
+
+        log_mock.assert_called_with(
+            'Cluster %s not found in config snapshot, loading JSON files', 'missing')
+
+
+def _assert_same_order(value, expected):
+    """Assert two config values are equal, with the same type and key order at every level"""
+    assert_equal(isinstance(value, OrderedDict), isinstance(expected, OrderedDict))
+    if isinstance(expected, dict):
+        assert_equal(value.keys(), expected.keys())
+        for key in expected:
+            _assert_same_order(value[key], expected[key])
+    elif isinstance(expected, list):
+        assert_equal(len(value), len(expected))
+        for item, expected_item in zip(value, expected):
+            _assert_same_order(item, expected_item)
+    else:
+        assert_equal(value, expected)
+
+
 @nottest
 #TODO(chunyong) add assertions to this test
 def test_config_valid_types():
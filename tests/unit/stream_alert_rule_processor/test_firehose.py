@@ -14,8 +14,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 # pylint: disable=protected-access,no-self-use
-from mock import patch
-from moto import mock_kinesis
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+from mock import call, patch
+from moto import mock_kinesis, mock_s3
 from nose.tools import (assert_equal, assert_false, assert_true)
 
 from stream_alert.rule_processor.config import load_config
@@ -79,7 +83,7 @@ class TestStreamAlertFirehose(object):
 
         # Add sample categorized payloads
         for payload_type, logs in self._sample_categorized_payloads().iteritems():
-            self.__sa_firehose.categorized_payloads[payload_type].extend(logs)
+            self.__sa_firehose.add_records(payload_type, logs)
 
         # Setup mocked Delivery Streams
         self._mock_delivery_streams(
@@ -143,7 +147,7 @@ class TestStreamAlertFirehose(object):
 
         # Add sample categorized payloads
         for payload_type, logs in self._sample_categorized_payloads().iteritems():
-            self.__sa_firehose.categorized_payloads[payload_type].extend(logs)
+            self.__sa_firehose.add_records(payload_type, logs)
 
         # Setup mocked Delivery Streams
         self._mock_delivery_streams(
@@ -166,7 +170,7 @@ class TestStreamAlertFirehose(object):
 
         # Add sample categorized payloads
         for payload_type, logs in self._sample_categorized_payloads().iteritems():
-            self.__sa_firehose.categorized_payloads[payload_type].extend(logs)
+            self.__sa_firehose.add_records(payload_type, logs)
 
         # Setup mocked Delivery Streams
         self._mock_delivery_streams(
@@ -198,10 +202,7 @@ class TestStreamAlertFirehose(object):
 
         test_events = [
             # unit_test_simple_log
-            {
-                'unit_key_01': 2,
-                'unit_key_02': 'testtest'
-            } for _ in range(10)
+            '{"unit_key_01":2,"unit_key_02":"testtest"}\n' for _ in range(10)
         ]
 
         sa_firehose._firehose_request_helper('invalid_stream', test_events)
@@ -211,6 +212,159 @@ class TestStreamAlertFirehose(object):
             'operation: Stream invalid_stream under account 123456789012 not found.'
         assert_true(mock_logging.error.called_with(missing_stream_message))
 
+    @patch('stream_alert.rule_processor.firehose.MetricLogger.log_metric')
+    def test_record_delivery_retry_failed_only(self, metric_mock):
+        """StreamAlertFirehose - Record Delivery - Retry Only Failed Records"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+        sa_firehose.MAX_BACKOFF_ATTEMPTS = 3
+        records = ['{"key":1}\n', '{"key":2}\n', '{"key":3}\n']
+
+        with patch.object(sa_firehose._firehose_client, 'put_record_batch') as firehose_mock:
+            firehose_mock.side_effect = [
+                {
+                    'FailedPutCount': 2,
+                    'RequestResponses': [
+                        {'ErrorCode': 'ServiceUnavailableException'},
+                        {'RecordId': '12345'},
+                        {'ErrorCode': 'ServiceUnavailableException'}
+                    ]
+                },
+                {'FailedPutCount': 0, 'RequestResponses': [{'RecordId': '1'}, {'RecordId': '2'}]}
+            ]
+            sa_firehose._firehose_request_helper('streamalert_data_unit_test', records)
+
+            assert_equal(firehose_mock.call_args_list[1][1]['Records'],
+                         [{'Data': '{"key":1}\n'}, {'Data': '{"key":3}\n'}])
+
+        metric_mock.assert_has_calls([
+            call('rule_processor', 'FirehoseRecordsSent', 1),
+            call('rule_processor', 'FirehoseRetriedRecords', 2),
+            call('rule_processor', 'FirehoseRecordsSent', 2)
+        ])
+        assert_true(call('rule_processor', 'FirehoseFailedRecords', 2)
+                    not in metric_mock.call_args_list)
+
+    @patch('time.sleep')
+    @patch('stream_alert.rule_processor.firehose.LOGGER')
+    def test_record_delivery_client_error_retries(self, mock_logging, _):
+        """StreamAlertFirehose - Record Delivery - Errors Share the Attempt Budget"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+        sa_firehose.MAX_BACKOFF_ATTEMPTS = 3
+        records = ['{"key":1}\n', '{"key":2}\n']
+
+        error = ClientError({'Error': {'Code': 'ServiceUnavailableException'}}, 'PutRecordBatch')
+        with patch.object(sa_firehose._firehose_client, 'put_record_batch') as firehose_mock:
+            firehose_mock.side_effect = [
+                error,
+                {
+                    'FailedPutCount': 1,
+                    'RequestResponses': [{'RecordId': '12345'}, {'ErrorCode': '300'}]
+                },
+                error,
+                error
+            ]
+            sa_firehose._firehose_request_helper('streamalert_data_unit_test', records)
+
+            assert_equal(firehose_mock.call_count, 3)
+
+        mock_logging.error.assert_any_call(error)
+
+    @mock_s3
+    @patch('stream_alert.rule_processor.firehose.LOGGER')
+    def test_record_delivery_dead_letter(self, mock_logging):
+        """StreamAlertFirehose - Record Delivery - Failed Records to Dead Letter"""
+        s3_client = boto3.client('s3', region_name='us-east-1')
+        s3_client.create_bucket(Bucket='corp-prefix.streamalert.data')
+        sa_firehose = StreamAlertFirehose(
+            region='us-east-1',
+            firehose_config={'dead_letter_bucket': 'corp-prefix.streamalert.data'},
+            log_sources={})
+        records = ['{"key":1}\n', '{"key":2}\n']
+
+        with patch.object(sa_firehose._firehose_client, 'put_record_batch') as firehose_mock:
+            firehose_mock.return_value = {
+                'FailedPutCount': 1,
+                'RequestResponses': [{'RecordId': '12345'}, {'ErrorCode': '300'}]
+            }
+            sa_firehose._firehose_request_helper('streamalert_data_unit_test', records)
+
+        assert_true(mock_logging.error.called)
+        objects = s3_client.list_objects(Bucket='corp-prefix.streamalert.data')['Contents']
+        assert_equal(len(objects), 1)
+        assert_true(objects[0]['Key'].startswith('dead_letter/streamalert_data_unit_test/dt='))
+        body = s3_client.get_object(Bucket='corp-prefix.streamalert.data',
+                                    Key=objects[0]['Key'])['Body'].read()
+        assert_equal(body, '{"key":2}\n')
+
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_add_records_aggregated(self, request_mock):
+        """StreamAlertFirehose - Add Records, Aggregated into Firehose Records"""
+        sa_firehose = StreamAlertFirehose(
+            region='us-east-1', firehose_config={'aggregate_records': True}, log_sources={})
+
+        # Each record is ~100KB, so 9 fit within a single 1000KB Firehose record
+        records = [{'index': index, 'data': 'a' * 100000} for index in range(20)]
+        sa_firehose.add_records('unit_test_simple_log', records)
+        sa_firehose.send()
+
+        assert_equal(request_mock.call_count, 1)
+        stream_name, batch = request_mock.call_args[0]
+        assert_equal(stream_name, 'streamalert_data_unit_test_simple_log')
+        assert_equal([data.count('\n') for data in batch], [9, 9, 2])
+        assert_true(all(len(data) <= StreamAlertFirehose.MAX_RECORD_SIZE for data in batch))
+        assert_equal([json.loads(line)['index'] for line in ''.join(batch).splitlines()],
+                     range(20))
+
+    @patch('stream_alert.rule_processor.firehose.MetricLogger.log_metric')
+    def test_record_delivery_aggregated_metrics(self, metric_mock):
+        """StreamAlertFirehose - Record Delivery - Aggregated Records Counted"""
+        sa_firehose = StreamAlertFirehose(
+            region='us-east-1', firehose_config={'aggregate_records': True}, log_sources={})
+
+        with patch.object(sa_firehose._firehose_client, 'put_record_batch') as firehose_mock:
+            firehose_mock.return_value = {'FailedPutCount': 0}
+            sa_firehose._firehose_request_helper(
+                'streamalert_data_unit_test', ['{"key":1}\n{"key":2}\n', '{"key":3}\n'])
+
+        metric_mock.assert_called_with('rule_processor', 'FirehoseRecordsSent', 3)
+
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_send_concurrent_streams(self, request_mock):
+        """StreamAlertFirehose - Send, Batches Ordered Within Each Stream"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+
+        for log_type in ('log_type_{:02d}'.format(index) for index in range(20)):
+            sa_firehose.add_records(log_type, [{'index': index} for index in range(1250)])
+        sa_firehose.send()
+
+        batches_by_stream = {}
+        for args, _ in request_mock.call_args_list:
+            batches_by_stream.setdefault(args[0], []).append(
+                [json.loads(data)['index'] for data in args[1]])
+
+        assert_equal(len(batches_by_stream), 20)
+        for batches in batches_by_stream.itervalues():
+            assert_equal([len(batch) for batch in batches], [500, 500, 250])
+            assert_equal(sum(batches, []), range(1250))
+        assert_equal(sa_firehose._workers, {})
+
+    @patch('stream_alert.rule_processor.firehose.MetricLogger.log_metric')
+    @patch('stream_alert.rule_processor.firehose.LOGGER.exception')
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_send_worker_exception(self, request_mock, log_mock, metric_mock):
+        """StreamAlertFirehose - Send, Worker Survives Unexpected Exception"""
+        request_mock.side_effect = [ValueError('bad'), None]
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+
+        sa_firehose.add_records('unit_test_simple_log', [{'index': index} for index in range(501)])
+        sa_firehose.send()
+
+        assert_equal(request_mock.call_count, 2)
+        log_mock.assert_called_with(
+            '[Firehose] An error occurred while sending %d records to %s',
+            500, 'streamalert_data_unit_test_simple_log')
+        metric_mock.assert_called_with('rule_processor', 'FirehoseFailedRecords', 500)
+
     @mock_kinesis
     def test_load_enabled_sources(self):
         """StreamAlertFirehose - Load Enabled Sources"""
@@ -240,26 +394,66 @@ class TestStreamAlertFirehose(object):
         assert_equal(len(sa_firehose._enabled_logs), 0)
         assert_true(mock_logging.error.called)
 
-    def test_segment_records_by_size(self):
-        """StreamAlertFirehose - Segment Large Records"""
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_add_records_flush_count(self, request_mock):
+        """StreamAlertFirehose - Add Records, Flush at Batch Count"""
         sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
 
-        record_batch = [
-            # unit_test_simple_log
-            {
-                'unit_key_01': 2,
-                'unit_key_02': 'testtest' * 10000
-            } for _ in range(100)
-        ]
+        records = [{'unit_key_01': index, 'unit_key_02': 'test'} for index in range(1001)]
+        sa_firehose.add_records('unit_test_simple_log', records)
+
+        # Two full batches are queued while adding and the remainder stays buffered
+        assert_equal(len(sa_firehose.categorized_payloads['unit_test_simple_log']), 1)
+
+        sa_firehose.send()
+
+        assert_equal([len(args[1]) for args, _ in request_mock.call_args_list], [500, 500, 1])
+        assert_equal(request_mock.call_args[0][0], 'streamalert_data_unit_test_simple_log')
+        assert_equal(sa_firehose.categorized_payloads['unit_test_simple_log'], [])
+
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_add_records_flush_size(self, request_mock):
+        """StreamAlertFirehose - Add Records, Flush at Batch Size"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+
+        # Each record is ~800KB, so only 4 fit within the 4MB batch limit
+        records = [{'unit_key_01': index, 'unit_key_02': 'test' * 200000} for index in range(10)]
+        sa_firehose.add_records('unit_test_simple_log', records)
+        sa_firehose.send()
+
+        assert_equal([len(args[1]) for args, _ in request_mock.call_args_list], [4, 4, 2])
+
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose._firehose_request_helper')
+    def test_add_records_exact_size(self, request_mock):
+        """StreamAlertFirehose - Add Records, Batches Packed by Exact Size"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+
+        records = [{'unit_key_01': 2, 'unit_key_02': 'testtest' * 10000} for _ in range(100)]
+        sa_firehose.add_records('unit_test_simple_log', records)
+        sa_firehose.send()
 
-        sized_batches = []
+        batches = [args[1] for args, _ in request_mock.call_args_list]
+        assert_equal([len(batch) for batch in batches], [49, 49, 2])
+        for batch in batches:
+            assert_true(sum(len(data) for data in batch) <= StreamAlertFirehose.MAX_BATCH_SIZE)
+            assert_true(all(data.endswith('\n') for data in batch))
 
-        for sized_batch in sa_firehose._segment_records_by_size(record_batch):
-            sized_batches.append(sized_batch)
+    @patch('stream_alert.rule_processor.firehose.MetricLogger.log_metric')
+    def test_add_records_serialized_once(self, _):
+        """StreamAlertFirehose - Add Records, Sanitized and Serialized Once"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
+
+        with patch('stream_alert.rule_processor.firehose.json.dumps',
+                   side_effect=json.dumps) as dumps_mock:
+            sa_firehose.add_records('unit_test_simple_log', [{'key-01': 1}, {'key-02': 2}])
+            with patch.object(sa_firehose._firehose_client, 'put_record_batch') as firehose_mock:
+                firehose_mock.return_value = {'FailedPutCount': 0}
+                sa_firehose.send()
 
-        assert_true(len(str(sized_batches[0])) < 4000000)
-        assert_equal(len(sized_batches), 4)
-        assert_true(isinstance(sized_batches[3][0], dict))
+        assert_equal(dumps_mock.call_count, 2)
+        firehose_mock.assert_called_with(
+            DeliveryStreamName='streamalert_data_unit_test_simple_log',
+            Records=[{'Data': '{"key_01":1}\n'}, {'Data': '{"key_02":2}\n'}])
 
     def test_sanitize_keys(self):
         """StreamAlertFirehose - Sanitize Keys"""
@@ -293,9 +487,39 @@ class TestStreamAlertFirehose(object):
         sanitized_event = StreamAlertFirehose.sanitize_keys(test_event)
         assert_equal(sanitized_event, expected_sanitized_event)
 
+    def test_sanitize_keys_unchanged(self):
+        """StreamAlertFirehose - Sanitize Keys, Clean Record Not Rebuilt"""
+        test_event = {'host': 'my-host', 'data': {'super': 'secret'}}
+        assert_true(StreamAlertFirehose.sanitize_keys(test_event) is test_event)
+
+        # Nested objects that need no sanitization are also reused
+        test_event = {'host-name': 'my-host', 'data': {'super': 'secret'}}
+        sanitized_event = StreamAlertFirehose.sanitize_keys(test_event)
+        assert_equal(sanitized_event, {'host_name': 'my-host', 'data': {'super': 'secret'}})
+        assert_true(sanitized_event['data'] is test_event['data'])
+
+    def test_sanitize_keys_cached(self):
+        """StreamAlertFirehose - Sanitize Keys, Sanitized Keys Cached"""
+        StreamAlertFirehose._SANITIZED_KEYS.clear()
+        with patch.object(StreamAlertFirehose, 'SPECIAL_CHAR_REGEX') as regex_mock:
+            regex_mock.sub.return_value = 'key_01'
+            for _ in range(10):
+                StreamAlertFirehose.sanitize_keys({'key-01': 1})
+
+        regex_mock.sub.assert_called_once_with('_', 'key-01')
+
+    @patch('stream_alert.rule_processor.firehose.StreamAlertFirehose.MAX_SANITIZED_KEYS', 2)
+    def test_sanitize_keys_cache_bounded(self):
+        """StreamAlertFirehose - Sanitize Keys, Cache Size Bounded"""
+        StreamAlertFirehose._SANITIZED_KEYS.clear()
+        StreamAlertFirehose.sanitize_keys({'key-01': 1, 'key-02': 2, 'key-03': 3})
+        assert_true(len(StreamAlertFirehose._SANITIZED_KEYS) <= 2)
+
+    @patch('stream_alert.rule_processor.firehose.MetricLogger.log_metric')
     @patch('stream_alert.rule_processor.firehose.LOGGER')
-    def test_limit_record_size(self, mock_logging):
+    def test_serialize_record_too_large(self, mock_logging, metric_mock):
         """StreamAlertFirehose - Record Size Check"""
+        sa_firehose = StreamAlertFirehose(region='us-east-1', firehose_config={}, log_sources={})
         test_events = [
             # unit_test_simple_log
             {
@@ -305,19 +529,13 @@ class TestStreamAlertFirehose(object):
             {
                 'unit_key_01': 2,
                 'unit_key_02': 'test'
-            },
-            # test_log_type_json_nested
-            {
-                'date': 'January 01, 3005',
-                'unixtime': '32661446400',
-                'host': 'my-host.name.website.com',
-                'data': {
-                    'super': 'secret'
-                }
             }
         ]
 
-        StreamAlertFirehose._limit_record_size(test_events)
+        sa_firehose.add_records('unit_test_simple_log', test_events)
 
-        assert_true(len(test_events), 2)
+        assert_equal([json.loads(data) for data
+                      in sa_firehose.categorized_payloads['unit_test_simple_log']],
+                     [test_events[1]])
         assert_true(mock_logging.error.called)
+        metric_mock.assert_called_with('rule_processor', 'FirehoseFailedRecords', 1)
@@ -17,6 +17,8 @@ limitations under the License.
 import base64
 import json
 import logging
+import os
+import tempfile
 
 from mock import call, patch
 from moto import mock_kinesis
@@ -114,7 +116,8 @@ class TestStreamAlert(object):
         load_payload_mock.assert_called_with(
             'lambda',
             'entity',
-            'record'
+            'record',
+            json_stream_paths=None
         )
 
     @patch('stream_alert.rule_processor.handler.StreamRules.process')
@@ -136,6 +139,51 @@ class TestStreamAlert(object):
         self.__sa_handler.run(get_valid_event(count))
         assert_equal(self.__sa_handler._processed_record_count, count)
 
+    @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
+    def test_run_resets_state(self, extract_mock):
+        """StreamAlert Class - Run, State Reset for Each Invocation"""
+        extract_mock.return_value = ('kinesis', 'unit_test_default_stream')
+        self.__sa_handler._alerts = ['previous_alert']
+
+        with patch.object(self.__sa_handler.sinker, 'reset') as reset_mock:
+            self.__sa_handler.run(get_valid_event(2))
+            self.__sa_handler.run(get_valid_event(3))
+
+        assert_equal(self.__sa_handler._processed_record_count, 3)
+        assert_list_equal(self.__sa_handler.get_alerts(), [])
+        assert_equal(reset_mock.call_count, 2)
+
+    @patch('stream_alert.rule_processor.payload.S3Payload._get_object')
+    @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
+    def test_run_streamed_s3_processed_size(self, extract_mock, get_object_mock):
+        """StreamAlert Class - Run, Processed Size of Streamed S3 Records"""
+        extract_mock.return_value = ('s3', 'unit_test_bucket')
+        self.__sa_handler.config['sources']['s3'] = {
+            'unit_test_bucket': {'logs': ['test_cloudtrail']}}
+
+        temp_file_path = os.path.join(tempfile.gettempdir(), 's3_test.json')
+        with open(temp_file_path, 'w') as temp_file:
+            temp_file.write('{"Records": [{"key": "value"}, {"key": "value2"}]}')
+        get_object_mock.return_value = temp_file_path
+
+        self.__sa_handler.run({'Records': ['record']})
+
+        assert_equal(self.__sa_handler._processed_size,
+                     len('{"key": "value"}') + len('{"key": "value2"}'))
+
+    @mock_kinesis
+    @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
+    def test_run_reuses_firehose_client(self, extract_mock):
+        """StreamAlert Class - Run, Firehose Client Reused by Warm Invocations"""
+        extract_mock.return_value = ('kinesis', 'unit_test_default_stream')
+        self.__sa_handler.config['global']['infrastructure']['firehose'] = {'enabled': True}
+
+        self.__sa_handler.run(get_valid_event())
+        firehose_client = self.__sa_handler._firehose_client
+        self.__sa_handler.run(get_valid_event())
+
+        assert_true(firehose_client is self.__sa_handler._firehose_client)
+
     @patch('logging.Logger.debug')
     @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
     def test_run_no_alerts(self, extract_mock, log_mock):
@@ -186,6 +234,21 @@ class TestStreamAlert(object):
 
         sink_mock.assert_called_with(['success!!'])
 
+    @patch('stream_alert.rule_processor.sink.StreamSink.flush')
+    @patch('stream_alert.rule_processor.sink.StreamSink.sink')
+    @patch('stream_alert.rule_processor.handler.StreamRules.process')
+    @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
+    def test_run_flush_alerts(self, extract_mock, rules_mock, sink_mock, flush_mock):
+        """StreamAlert Class - Run, Flush Alerts"""
+        extract_mock.return_value = ('kinesis', 'unit_test_default_stream')
+        rules_mock.return_value = (['success!!'], ['normalized_records'])
+
+        self.__sa_handler.enable_alert_processor = True
+        self.__sa_handler.run(get_valid_event())
+
+        sink_mock.assert_called_with(['success!!'])
+        flush_mock.assert_called_once()
+
     @patch('logging.Logger.debug')
     @patch('stream_alert.rule_processor.handler.StreamRules.process')
     @patch('stream_alert.rule_processor.handler.StreamClassifier.extract_service_and_entity')
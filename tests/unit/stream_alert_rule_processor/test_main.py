@@ -13,8 +13,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from mock import call, patch
-from nose.tools import assert_equal, assert_raises
+# pylint: disable=protected-access
+from mock import call, Mock, patch
+from nose.tools import assert_equal, assert_raises, assert_true
 from pyfakefs import fake_filesystem_unittest
 
 from stream_alert.rule_processor import main
@@ -22,7 +23,6 @@ from stream_alert.rule_processor import main
 
 class RuleImportTest(fake_filesystem_unittest.TestCase):
     """Test rule import logic with a mocked filesystem."""
-    # pylint: disable=protected-access
 
     def setUp(self):
         self.setUpPyfakefs()
@@ -76,11 +76,82 @@ class RuleImportTest(fake_filesystem_unittest.TestCase):
         ], any_order=True)
 
     @staticmethod
+    @patch.object(main, 'load_config')
+    @patch.object(main, 'importlib')
+    def test_import_rules_lazy(mock_importlib, mock_config):
+        """Rule Processor Main - Lazily import rule modules from the manifest."""
+        manifest = {
+            'matchers.matchers': {'logs': [], 'datatypes': []},
+            'rules.example': {'logs': ['osquery:differential'], 'datatypes': []}
+        }
+        mock_config.return_value = {
+            'sources': {'kinesis': {'stream': {'logs': ['cloudtrail']}}},
+            'logs': {'cloudtrail:events': {}, 'osquery:differential': {}},
+            'types': {}
+        }
+        with patch.object(main, 'LAZY_RULE_LOADING', True), \
+                patch.object(main.StreamAlert, 'config', {}), \
+                patch.object(main, '_load_rules_manifest', return_value=manifest):
+            main._import_rules()
+
+        assert_equal(mock_importlib.mock_calls, [call.import_module('matchers.matchers')])
+        assert_true('matchers.matchers' in main.RULE_IMPORT_TIMES)
+
+    @staticmethod
+    @patch.object(main, '_PROCESSORS', {})
     @patch.object(main, 'StreamAlert')
     def test_handler(mock_stream_alert):
-        """Rule Processor Main - Handler is invoked"""
-        main.handler('event', 'context')
+        """Rule Processor Main - Handler is invoked, reusing the processor"""
+        context = Mock(invoked_function_arn='arn')
+        main.handler('event', context)
+        main.handler('event_2', context)
         mock_stream_alert.assert_has_calls([
-            call('context'),
-            call().run('event')
+            call(context),
+            call().run('event'),
+            call().run('event_2')
         ])
+
+
+def test_build_rules_manifest():
+    """Rule Processor Main - Build the rule manifest"""
+    manifest = main.build_rules_manifest()
+
+    assert_equal(manifest['matchers.matchers'], {'logs': [], 'datatypes': []})
+    assert_equal(manifest['rules.community.cloudtrail.cloudtrail_critical_api_calls'],
+                 {'logs': ['cloudtrail:events'], 'datatypes': []})
+
+
+def test_select_rule_modules():
+    """Rule Processor Main - Select rule modules for the configured sources"""
+    manifest = {
+        'matchers.matchers': {'logs': [], 'datatypes': []},
+        'rules.cloudtrail': {'logs': ['cloudtrail:events'], 'datatypes': []},
+        'rules.ghe': {'logs': ['ghe:general'], 'datatypes': []},
+        'rules.normalized': {'logs': [], 'datatypes': ['sourceAddress']},
+        'rules.unused': {'logs': [], 'datatypes': ['userName']}
+    }
+    config = {
+        'sources': {'s3': {'bucket': {'logs': ['cloudtrail']}}},
+        'logs': {'cloudtrail:events': {}, 'ghe:general': {}},
+        'types': {'cloudtrail': {'sourceAddress': ['sourceIPAddress']},
+                  'ghe': {'userName': ['actor']}}
+    }
+
+    assert_equal(main._select_rule_modules(manifest, config),
+                 ['matchers.matchers', 'rules.cloudtrail', 'rules.normalized'])
+
+
+def test_select_rule_modules_ioc_types():
+    """Rule Processor Main - Select rule modules for normalized types with IOC types"""
+    manifest = {
+        'rules.command': {'logs': [], 'datatypes': ['command']},
+        'rules.ioc': {'logs': [], 'datatypes': ['sourceAddress']}
+    }
+    config = {
+        'sources': {'s3': {'bucket': {'logs': ['cloudtrail']}}},
+        'logs': {'cloudtrail:events': {}},
+        'types': {'cloudtrail': {'sourceAddress:ioc_ip': ['sourceIPAddress'],
+                                 'command': ['eventName']}}
+    }
+
+    assert_equal(main._select_rule_modules(manifest, config), ['rules.command', 'rules.ioc'])
@@ -14,11 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 # pylint: disable=protected-access
+import base64
+import bz2
+import hashlib
 import json
 import gzip
 import logging
 import os
+from StringIO import StringIO
 import tempfile
+import zlib
 
 from mock import call, patch
 from nose.tools import (
@@ -26,12 +31,22 @@ from nose.tools import (
     assert_false,
     assert_is_instance,
     assert_is_none,
+    assert_true,
     raises,
     with_setup
 )
 
 from stream_alert.rule_processor import LOGGER
-from stream_alert.rule_processor.payload import load_stream_payload, S3ObjectSizeError, S3Payload
+from stream_alert.rule_processor.payload import (
+    decode_data,
+    decode_text,
+    detect_codec,
+    JSONArrayStream,
+    KPL_MAGIC,
+    load_stream_payload,
+    S3ObjectSizeError,
+    S3Payload
+)
 from tests.unit.stream_alert_rule_processor.test_helpers import (
     make_kinesis_raw_record,
     make_s3_raw_record,
@@ -134,6 +149,67 @@ def test_pre_parse_kinesis(log_mock):
                                 .format(entity))
 
 
+def _gzip_data(data):
+    """Compress the data with gzip"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _protobuf_field(field, value):
+    """Encode a length delimited protobuf field with a short value"""
+    return chr(field << 3 | 2) + chr(len(value)) + value
+
+
+def _kpl_aggregated_record(*user_records):
+    """Build a record using the KPL aggregated record format"""
+    message = _protobuf_field(1, 'partition-key')
+    for data in user_records:
+        # Record with a partition_key_index varint, the data and a tag
+        record = '\x08\x00' + _protobuf_field(3, data) + _protobuf_field(4, 'tag')
+        message += _protobuf_field(3, record)
+
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+
+@patch('stream_alert.rule_processor.payload.MetricLogger.log_metric')
+def test_pre_parse_kinesis_aggregated(metric_mock):
+    """KinesisPayload - Pre Parse, KPL Aggregated Record"""
+    data = _kpl_aggregated_record('{"key": "value1"}', zlib.compress('{"key": "value2"}'))
+    kinesis_payload = load_stream_payload(
+        'kinesis', 'unit_test_entity', make_kinesis_raw_record('unit_test_entity', data))
+
+    records = [payload.pre_parsed_record for payload in kinesis_payload.pre_parse()]
+
+    assert_equal(records, ['{"key": "value1"}', '{"key": "value2"}'])
+    metric_mock.assert_called_with('rule_processor', 'TotalKinesisUserRecords', 2)
+
+
+def test_pre_parse_kinesis_aggregated_bad_digest():
+    """KinesisPayload - Pre Parse, KPL Magic Number With a Bad Digest"""
+    data = _kpl_aggregated_record('{"key": "value"}')[:-1] + 'X'
+    kinesis_payload = load_stream_payload(
+        'kinesis', 'unit_test_entity', make_kinesis_raw_record('unit_test_entity', data))
+
+    records = [payload.pre_parsed_record for payload in kinesis_payload.pre_parse()]
+
+    assert_equal(records, [data])
+
+
+@patch('logging.Logger.error')
+def test_pre_parse_kinesis_aggregated_truncated(log_mock):
+    """KinesisPayload - Pre Parse, KPL Aggregated Record With a Truncated Message"""
+    message = _protobuf_field(3, _protobuf_field(3, '{"key": "value"}'))[:-2]
+    data = KPL_MAGIC + message + hashlib.md5(message).digest()
+    kinesis_payload = load_stream_payload(
+        'kinesis', 'unit_test_entity', make_kinesis_raw_record('unit_test_entity', data))
+
+    records = [payload.pre_parsed_record for payload in kinesis_payload.pre_parse()]
+
+    assert_equal(records, [data])
+    assert_equal(log_mock.call_args[0][0], 'Invalid KPL aggregated record: %s')
+    assert_equal(str(log_mock.call_args[0][1]), 'truncated field 3 at offset 6')
+
+
 @patch('logging.Logger.debug')
 def test_pre_parse_sns(log_mock):
     """SNSPayload - Pre Parse"""
@@ -156,7 +232,7 @@ def test_pre_parse_sns(log_mock):
 def test_pre_parse_s3(s3_mock, *_):
     """S3Payload - Pre Parse"""
     records = ['{"record01": "value01"}', '{"record02": "value02"}']
-    s3_mock.side_effect = [((0, records[0]), (1, records[1]))]
+    s3_mock.side_effect = [((0, records[0], len(records[0])), (1, records[1], len(records[1])))]
 
     raw_record = make_s3_raw_record('unit_bucket_name', 'unit_key_name')
     s3_payload = load_stream_payload('s3', 'unit_key_name', raw_record)
@@ -180,7 +256,8 @@ def test_pre_parse_s3_debug(s3_mock, log_mock, _):
     records = ['_first_line_test_' * 10,
                '_second_line_test_' * 10]
 
-    s3_mock.side_effect = [((100, records[0]), (200, records[1]))]
+    s3_mock.side_effect = [((100, records[0], len(records[0])),
+                            (200, records[1], len(records[1])))]
 
     raw_record = make_s3_raw_record('unit_bucket_name', 'unit_key_name')
     s3_payload = load_stream_payload('s3', 'unit_key_name', raw_record)
@@ -265,7 +342,7 @@ def test_read_local_s3_obj_gz():
     with gzip.open(temp_gzip_file_path, 'w') as temp_gzip_file:
         temp_gzip_file.write('test line of gzip data')
 
-    for line_num, line in S3Payload._read_downloaded_s3_object(temp_gzip_file_path):
+    for line_num, line, _ in S3Payload._read_downloaded_s3_object(temp_gzip_file_path):
         assert_equal(line_num, 1)
         assert_equal(line, 'test line of gzip data')
 
@@ -277,11 +354,188 @@ def test_read_local_s3_obj_non_gz():
     with open(temp_file_path, 'w') as temp_file:
         temp_file.write('test line of data')
 
-    for line_num, line in S3Payload._read_downloaded_s3_object(temp_file_path):
+    for line_num, line, _ in S3Payload._read_downloaded_s3_object(temp_file_path):
         assert_equal(line_num, 1)
         assert_equal(line, 'test line of data')
 
 
+def test_read_local_s3_obj_codecs():
+    """S3Payload - Read S3 Object On Disk, Codec Detected Without an Extension"""
+    temp_file_path = os.path.join(tempfile.gettempdir(), 's3_test')
+    data = '\n'.join('test line {} of data'.format(num) for num in range(10000))
+
+    for compress in (bz2.compress, zlib.compress):
+        with open(temp_file_path, 'wb') as temp_file:
+            temp_file.write(compress(data))
+
+        lines = [line for _, line, _ in S3Payload._read_downloaded_s3_object(temp_file_path)]
+        assert_equal(lines, data.split('\n'))
+
+
+def test_detect_codec():
+    """StreamPayload - Detect Codec From Magic Bytes"""
+    data = '{"key": "value"}'
+    assert_equal(detect_codec(_gzip_data(data)), 'gzip')
+    assert_equal(detect_codec(bz2.compress(data)), 'bz2')
+    assert_equal(detect_codec(zlib.compress(data)), 'zlib')
+    assert_is_none(detect_codec(data))
+    assert_is_none(detect_codec('BZh9 is not bzip2'))
+    assert_is_none(detect_codec('x^ is not zlib'))
+
+
+def test_decode_data():
+    """StreamPayload - Decode Data"""
+    data = '{"key": "value"}'
+    for encoded in (_gzip_data(data), bz2.compress(data), zlib.compress(data), data):
+        assert_equal(decode_data(encoded), data)
+
+    assert_equal(decode_data({'key': 'value'}), {'key': 'value'})
+
+
+@patch('logging.Logger.debug')
+def test_decode_data_invalid(log_mock):
+    """StreamPayload - Decode Data, Truncated Compressed Data"""
+    data = zlib.compress('{"key": "value"}' * 10)[:-8]
+
+    assert_equal(decode_data(data), data)
+    assert_equal(log_mock.call_args[0][:2],
+                 ('Failed to decompress %s data, treating it as plain data: %s', 'zlib'))
+
+
+def test_decode_text():
+    """StreamPayload - Decode Text"""
+    data = '{"key": "value"}'
+    for encoded in (_gzip_data(data), bz2.compress(data), zlib.compress(data)):
+        assert_equal(decode_text(unicode(base64.b64encode(encoded))), data)
+        assert_equal(decode_text(base64.b64encode(encoded)), data)
+        assert_equal(decode_text(encoded), data)
+
+    # Plain text, including valid base64 of uncompressed data, is left untouched
+    for text in (u'{"key": "value"}', u'abcd', unicode(base64.b64encode(data)), u'caf\xe9'):
+        assert_equal(decode_text(text), text)
+
+    assert_equal(decode_text({'key': 'value'}), {'key': 'value'})
+
+
+def test_pre_parse_sns_compressed():
+    """SNSPayload - Pre Parse, Base64 Encoded Compressed Message"""
+    message = unicode(base64.b64encode(_gzip_data('{"test": "value"}')))
+    raw_record = make_sns_raw_record('unit_topic', message)
+    sns_payload = load_stream_payload('sns', 'entity', raw_record)
+
+    sns_payload = sns_payload.pre_parse().next()
+
+    assert_equal(sns_payload.pre_parsed_record, '{"test": "value"}')
+
+
+def test_pre_parse_app_compressed():
+    """StreamAlertAppPayload - Pre Parse, Compressed Logs"""
+    raw_record = {'stream_alert_app': 'unit_test_app', 'logs': [
+        bz2.compress('{"key": "value"}'), unicode(base64.b64encode(zlib.compress('{"key": 1}'))),
+        {'key': 'value'}]}
+    app_payload = load_stream_payload('stream_alert_app', 'unit_test_app', raw_record)
+
+    records = [payload.pre_parsed_record for payload in app_payload.pre_parse()]
+
+    assert_equal(records, ['{"key": "value"}', '{"key": 1}', {'key': 'value'}])
+
+
+def test_read_local_s3_obj_json_stream():
+    """S3Payload - Read S3 Object On Disk, Streamed JSON Array"""
+    temp_file_path = os.path.join(tempfile.gettempdir(), 's3_test')
+    document = {'Records': [{'key': 'value1'}, {'key': 'value2'}]}
+
+    with open(temp_file_path, 'wb') as temp_file:
+        temp_file.write(zlib.compress(json.dumps(document)))
+
+    records = list(S3Payload._read_downloaded_s3_object(temp_file_path, ['Records']))
+
+    assert_equal(records, [(1, {'Records': [{'key': 'value1'}]}, 17),
+                           (2, {'Records': [{'key': 'value2'}]}, 17)])
+
+
+@patch('stream_alert.rule_processor.payload.S3Payload._get_object')
+def test_pre_parse_s3_json_stream_size(get_object_mock):
+    """S3Payload - Pre Parse, Size of Streamed JSON Records"""
+    temp_file_path = os.path.join(tempfile.gettempdir(), 's3_test.json')
+    with open(temp_file_path, 'w') as temp_file:
+        temp_file.write('{"Records": [{"key": "value1"}, {"key": 1}]}')
+    get_object_mock.return_value = temp_file_path
+
+    s3_payload = load_stream_payload('s3', 'unit_key_name', None, json_stream_paths=['Records'])
+
+    sizes = [payload.pre_parsed_size() for payload in s3_payload.pre_parse()]
+
+    assert_equal(sizes, [17, 10])
+
+
+def test_read_local_s3_obj_json_stream_lines():
+    """S3Payload - Read S3 Object On Disk, JSON Lines Without the Streamed Array"""
+    temp_file_path = os.path.join(tempfile.gettempdir(), 's3_test.json')
+
+    with open(temp_file_path, 'w') as temp_file:
+        temp_file.write('{"key": "value1"}\n{"key": "value2"}\n')
+
+    records = list(S3Payload._read_downloaded_s3_object(temp_file_path, ['Records']))
+
+    assert_equal(records, [(1, '{"key": "value1"}', 17), (2, '{"key": "value2"}', 17)])
+
+
+@patch('stream_alert.rule_processor.payload.READ_CHUNK_SIZE', 7)
+def test_json_array_stream():
+    """JSONArrayStream - Stream Nested Arrays Across Documents"""
+    data = '\n'.join([
+        '{"version": 1.5, "logs": {"owner": 123, "results": [{"id": 1}, {"id": 22}], '
+        '"after": [1, 2]}, "end": true}',
+        '{"other": "document"}',
+        '[1, 2]',
+        '{"logs": {"results": []}}',
+        '{"logs": {"results": [{"id": 333}]}}'
+    ])
+    json_stream = JSONArrayStream(StringIO(data), ['logs.results', 'Records'])
+
+    assert_true(json_stream.find())
+    assert_equal(list(json_stream), [
+        ({'version': 1.5, 'logs': {'owner': 123, 'results': [{'id': 1}]}}, 9),
+        ({'version': 1.5, 'logs': {'owner': 123, 'results': [{'id': 22}]}}, 10),
+        ({'other': 'document'}, 21),
+        ([1, 2], 6),
+        ({'logs': {'results': [{'id': 333}]}}, 11)
+    ])
+
+
+def test_json_array_stream_large_value():
+    """JSONArrayStream - Large Value Before the Streamed Array is Read in Growing Chunks"""
+    large_value = ['x' * 100] * 50000
+    data = StringIO('{{"meta": {}, "Records": [{{"id": 1}}]}}'.format(json.dumps(large_value)))
+    with patch.object(data, 'read', wraps=data.read) as read_mock:
+        json_stream = JSONArrayStream(data, ['Records'])
+        assert_true(json_stream.find())
+
+    # Roughly 5MB are read in a number of calls that grows logarithmically
+    assert_true(read_mock.call_count < 10)
+    records = [record for record, _ in json_stream]
+    assert_equal(len(records), 1)
+    assert_equal(records[0]['Records'], [{'id': 1}])
+    assert_true(records[0]['meta'] == large_value)
+
+
+@patch('logging.Logger.error')
+def test_json_array_stream_invalid(log_mock):
+    """JSONArrayStream - Stop Streaming at Invalid JSON"""
+    json_stream = JSONArrayStream(StringIO('{"Records": [{"id": 1}, {"id": 2'), ['Records'])
+
+    assert_true(json_stream.find())
+    assert_equal(list(json_stream), [({'Records': [{'id': 1}]}, 9)])
+    assert_equal(log_mock.call_args[0][0], 'Failed to stream JSON records: %s')
+
+
+def test_json_array_stream_not_found():
+    """JSONArrayStream - Array Not Found in the First Document"""
+    for data in ('{"Records": {"id": 1}}', 'not json', '{"Records" [{"id": 1}]}'):
+        assert_false(JSONArrayStream(StringIO(data), ['Records']).find())
+
+
 @patch('stream_alert.rule_processor.payload.LOGGER.error')
 @patch('stream_alert.rule_processor.payload.os.path.exists', return_value=True)
 def test_read_s3_failed_remove(_, log_mock):
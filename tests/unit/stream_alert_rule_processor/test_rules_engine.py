@@ -30,6 +30,7 @@ from stream_alert.rule_processor.config import load_config, load_env
 from stream_alert.rule_processor.parsers import get_parser
 from stream_alert.rule_processor.rules_engine import RuleAttributes, StreamRules
 from stream_alert.shared import NORMALIZATION_KEY
+from stream_alert.shared.stats import CallStats
 
 from tests.unit.stream_alert_rule_processor.test_helpers import (
     get_mock_context,
@@ -137,6 +138,50 @@ class TestStreamRules(object):
         log_mock.assert_called_with('Encountered error with rule: %s',
                                     'bad_rule_function')
 
+    def test_rule_stats(self):
+        """Rules Engine - Record Rule and Matcher Stats"""
+        @matcher
+        def prod(rec):  # pylint: disable=unused-variable
+            return rec['environment'] == 'prod'
+
+        @rule(matchers=['prod'],
+              logs=['test_log_type_json_nested_with_data'],
+              outputs=['s3:sample_bucket'])
+        def web_app(rec):  # pylint: disable=unused-variable
+            return rec['application'] == 'web-app'
+
+        @rule(logs=['test_log_type_json_nested_with_data'],
+              outputs=['s3:sample_bucket'])
+        def broken_rule(rec):  # pylint: disable=unused-variable
+            return rec['missing_key']
+
+        rule_stats = CallStats('Rule', 'RuleTime', enabled=True)
+        matcher_stats = CallStats('Matcher', 'MatcherTime', enabled=True)
+        kinesis_data = json.dumps({
+            'date': 'Dec 01 2016',
+            'unixtime': '1483139547',
+            'host': 'host1.web.prod.net',
+            'application': 'web-app',
+            'environment': 'prod',
+            'data': {'category': 'web-server', 'type': '1', 'source': 'eu'}
+        })
+
+        service, entity = 'kinesis', 'test_kinesis_stream'
+        raw_record = make_kinesis_raw_record(entity, kinesis_data)
+        payload = load_and_classify_payload(self.config, service, entity, raw_record)
+
+        with patch('stream_alert.rule_processor.rules_engine.RULE_STATS', rule_stats), \
+                patch('stream_alert.rule_processor.rules_engine.MATCHER_STATS', matcher_stats), \
+                patch('stream_alert.rule_processor.rules_engine.LOGGER.exception'):
+            self.rules_engine.process(payload)
+
+        stats = rule_stats.stats()
+        assert_equal(stats['web_app']['calls'], 1)
+        assert_equal(stats['web_app']['hit_rate'], 1.0)
+        assert_equal(stats['broken_rule']['exceptions'], 1)
+        assert_equal(stats['broken_rule']['hit_rate'], 0.0)
+        assert_equal(matcher_stats.stats()['prod']['calls'], 1)
+
     def test_basic_rule_matcher_process(self):
         """Rules Engine - Basic Rule/Matcher"""
         @matcher
@@ -854,6 +899,41 @@ class TestStreamRules(object):
 
             assert_equal(len(new_rules_engine.process(payload)[0]), 1)
 
+    @patch('boto3.client')
+    def test_process_normalized_records_context(self, mock_client):
+        """Rules Engine - Normalized Records Share the Context of Their Payload"""
+        @rule(datatypes=['sourceAddress'], outputs=['s3:sample_bucket'])
+        def match_ipaddress_context(_): # pylint: disable=unused-variable
+            """Testing dummy rule"""
+            return True
+
+        mock_client.return_value = MockDynamoDBClient()
+        toggled_config = self.config
+        toggled_config['global']['threat_intel']['enabled'] = True
+        toggled_config['global']['threat_intel']['dynamodb_table'] = 'test_table_name'
+
+        new_rules_engine = StreamRules(toggled_config)
+        data = {
+            'account': 123456,
+            'region': '123456123456',
+            'source': '1.1.1.2',
+            'detail': {'eventName': 'ConsoleLogin', 'sourceIPAddress': '1.1.1.2',
+                       'recipientAccountId': '654321'}
+        }
+        raw_record = make_kinesis_raw_record('test_kinesis_stream', json.dumps(data))
+        payload = load_and_classify_payload(toggled_config, 'kinesis', 'test_kinesis_stream',
+                                            raw_record)
+        payload.records = [payload.records[0], dict(payload.records[0], source='1.1.1.3')]
+
+        normalized_records = new_rules_engine.process(payload)[1]
+
+        assert_equal(len(normalized_records), 2)
+        assert_true(normalized_records[0].context is normalized_records[1].context)
+        assert_equal(normalized_records[1].pre_parsed_record['source'], '1.1.1.3')
+        assert_equal(normalized_records[1].log_source, payload.log_source)
+        assert_equal(normalized_records[1].service(), 'kinesis')
+        assert_false(hasattr(normalized_records[1], 'raw_record'))
+
     @patch('boto3.client')
     def test_threat_intel_match(self, mock_client):
         """Rules Engine - Threat Intel is enabled when threat_intel_match is called"""
@@ -13,14 +13,22 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+# pylint: disable=attribute-defined-outside-init,protected-access
 from datetime import datetime
+import json
 
 from botocore.exceptions import ClientError
-from mock import patch
-from nose.tools import assert_equal
+import boto3
+from mock import call, patch
+from moto import mock_s3, mock_sqs
+from nose.tools import assert_equal, assert_is_instance, assert_true
 
 from stream_alert.rule_processor.config import load_env
-from stream_alert.rule_processor.sink import StreamSink
+from stream_alert.rule_processor.sink import (
+    LambdaAlertTransport,
+    SQSAlertTransport,
+    StreamSink
+)
 from tests.unit.stream_alert_rule_processor.test_helpers import get_mock_context
 
 
@@ -29,8 +37,8 @@ class TestStreamSink(object):
     @classmethod
     def setup_class(cls):
         """Setup the class before any methods"""
-        patcher = patch('stream_alert.rule_processor.sink.boto3.client')
-        cls.boto_mock = patcher.start()
+        cls.boto_patcher = patch('stream_alert.rule_processor.sink.boto3.client')
+        cls.boto_mock = cls.boto_patcher.start()
         context = get_mock_context()
         env = load_env(context)
         cls.sinker = StreamSink(env)
@@ -39,15 +47,21 @@ class TestStreamSink(object):
     def teardown_class(cls):
         """Teardown the class after any methods"""
         cls.sinker = None
-        cls.boto_mock.stop()
+        cls.boto_patcher.stop()
+
+    def setup(self):
+        """Setup before each method"""
+        self.boto_mock.return_value.invoke.reset_mock()
+        self.boto_mock.return_value.invoke.side_effect = None
 
     def teardown(self):
         """Teardown the class after each methods"""
         self.sinker.env['lambda_alias'] = 'development'
+        self.sinker.flush()
 
     def test_streamsink_init(self):
         """StreamSink - Init"""
-        assert_equal(self.sinker.function, 'corp-prefix_prod_streamalert_alert_processor')
+        assert_equal(str(self.sinker._transport), 'corp-prefix_prod_streamalert_alert_processor')
 
     @patch('stream_alert.rule_processor.sink.LOGGER.exception')
     def test_streamsink_sink_boto_error(self, log_mock):
@@ -60,12 +74,14 @@ class TestStreamSink(object):
             err_response, 'operation')
 
         self.sinker.sink(['alert!!!'])
+        self.sinker.flush()
 
-        log_mock.assert_called_with('An error occurred while sending alert to '
-                                    '\'%s:production\'. Error is: %s. Alert: %s',
+        log_mock.assert_called_with('An error occurred while sending %d alert(s) to '
+                                    '\'%s:production\'. Error is: %s. Alerts: %s',
+                                    1,
                                     'corp-prefix_prod_streamalert_alert_processor',
                                     err_response,
-                                    '"alert!!!"')
+                                    '{"alerts":["alert!!!"]}')
 
     @patch('stream_alert.rule_processor.sink.LOGGER.error')
     def test_streamsink_sink_resp_error(self, log_mock):
@@ -74,10 +90,12 @@ class TestStreamSink(object):
             'ResponseMetadata': {'HTTPStatusCode': 201}}]
 
         self.sinker.sink(['alert!!!'])
+        self.sinker.flush()
 
-        log_mock.assert_called_with('Failed to send alert to \'%s\': %s',
+        log_mock.assert_called_with('Failed to send %d alert(s) to \'%s\': %s',
+                                    1,
                                     'corp-prefix_prod_streamalert_alert_processor',
-                                    '"alert!!!"')
+                                    '{"alerts":["alert!!!"]}')
 
     @patch('stream_alert.rule_processor.sink.LOGGER.info')
     def test_streamsink_sink_success(self, log_mock):
@@ -92,9 +110,11 @@ class TestStreamSink(object):
         # Swap out the alias so the logging occurs
         self.sinker.env['lambda_alias'] = 'production'
 
-        self.sinker.sink(['alert!!!'])
+        self.sinker.sink(['alert!!!', 'alert2!!!'])
+        self.sinker.flush()
 
-        log_mock.assert_called_with('Sent alert to \'%s\' with Lambda request ID \'%s\'',
+        log_mock.assert_called_with('Sent %d alert(s) to \'%s\' with Lambda request ID \'%s\'',
+                                    2,
                                     'corp-prefix_prod_streamalert_alert_processor',
                                     'reqID')
 
@@ -108,3 +128,242 @@ class TestStreamSink(object):
             'An error occurred while dumping alert to JSON: %s Alert: %s',
             '\'datetime.datetime\' object has no attribute \'__dict__\'',
             bad_object)
+
+    def test_streamsink_sink_batches(self):
+        """StreamSink - Alerts Batched by Payload Size"""
+        self.boto_mock.return_value.invoke.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 202, 'RequestId': 'reqID'}}
+
+        # Each alert is ~10KB, so 13 of these fit in a single 128KB payload
+        alerts = [{'rule_name': 'rule_{:02d}'.format(index), 'data': 'a' * 10000}
+                  for index in range(30)]
+        self.sinker.sink(alerts)
+        self.sinker.flush()
+
+        invoke_calls = self.boto_mock.return_value.invoke.call_args_list
+        assert_equal(len(invoke_calls), 3)
+
+        # Batches are sent concurrently, so they may complete in any order
+        payloads = [json.loads(invoke_call[1]['Payload']) for invoke_call in invoke_calls]
+        for payload in payloads:
+            assert_true(len(json.dumps(payload, separators=(',', ':'))) <=
+                        LambdaAlertTransport.MAX_BATCH_SIZE)
+
+        assert_equal(sorted(len(payload['alerts']) for payload in payloads), [4, 13, 13])
+        assert_equal(sorted(alert['rule_name']
+                            for payload in payloads for alert in payload['alerts']),
+                     [alert['rule_name'] for alert in alerts])
+
+    @patch('stream_alert.rule_processor.sink.MetricLogger.log_metric')
+    def test_streamsink_flush_metrics(self, metric_mock):
+        """StreamSink - Flush Logs Sent and Failed Metrics"""
+        self.boto_mock.return_value.invoke.side_effect = [
+            {'ResponseMetadata': {'HTTPStatusCode': 202, 'RequestId': 'reqID'}},
+            {'ResponseMetadata': {'HTTPStatusCode': 500, 'RequestId': 'reqID'}}
+        ]
+
+        # Force each alert into its own batch
+        with patch.object(LambdaAlertTransport, 'MAX_BATCH_SIZE', 50):
+            self.sinker.sink([{'rule_name': 'rule_01'}, {'rule_name': 'rule_02'}])
+            self.sinker.flush()
+
+        metric_mock.assert_has_calls([
+            call('rule_processor', 'SentAlerts', 1),
+            call('rule_processor', 'FailedAlerts', 1)
+        ])
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.exception')
+    @patch('stream_alert.rule_processor.sink.MetricLogger.log_metric')
+    def test_streamsink_worker_exception(self, metric_mock, log_mock):
+        """StreamSink - Worker Survives Unexpected Exception"""
+        self.boto_mock.return_value.invoke.side_effect = ValueError('bad')
+
+        self.sinker.sink(['alert!!!'])
+        self.sinker.flush()
+
+        log_mock.assert_called_with('An error occurred while sending %d alert(s) to \'%s\'',
+                                    1, self.sinker._transport)
+        metric_mock.assert_has_calls([
+            call('rule_processor', 'SentAlerts', 0),
+            call('rule_processor', 'FailedAlerts', 1)
+        ])
+
+    def test_streamsink_flush_empty(self):
+        """StreamSink - Flush With No Pending Alerts"""
+        self.sinker.flush()
+        self.boto_mock.return_value.invoke.assert_not_called()
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.error')
+    def test_streamsink_sink_too_large(self, log_mock):
+        """StreamSink - Alert Too Large"""
+        self.sinker.sink([{'data': 'a' * LambdaAlertTransport.MAX_BATCH_SIZE}])
+        self.sinker.flush()
+
+        self.boto_mock.return_value.invoke.assert_not_called()
+        assert_equal(log_mock.call_args[0][0],
+                     'Alert is too large to send to \'%s\' (%d bytes). Alert: %s')
+
+
+class TestSQSAlertTransport(object):
+    """Test class for SQSAlertTransport"""
+    # pylint: disable=no-self-use
+    QUEUE_NAME = 'corp-prefix_prod_streamalert_alerts'
+
+    def setup(self):
+        """Setup before each method"""
+        self.sqs_mock = mock_sqs()
+        self.sqs_mock.start()
+        self.client = boto3.client('sqs', region_name='us-east-1')
+        self.queue_url = self.client.create_queue(QueueName=self.QUEUE_NAME)['QueueUrl']
+        self.env = load_env(get_mock_context())
+        self.config = {'global': {'infrastructure': {'alerts_queue': {'enabled': True}}}}
+
+    def teardown(self):
+        """Teardown after each method"""
+        self.sqs_mock.stop()
+
+    def _received_alerts(self):
+        """Helper to receive all alerts sent to the queue"""
+        alerts = []
+        while True:
+            messages = self.client.receive_message(
+                QueueUrl=self.queue_url, MaxNumberOfMessages=10).get('Messages', [])
+            if not messages:
+                return alerts
+            for message in messages:
+                alerts.extend(json.loads(message['Body'])['alerts'])
+
+    def test_transport_selection(self):
+        """StreamSink - SQS Transport Enabled in Config"""
+        sinker = StreamSink(self.env, self.config)
+        assert_is_instance(sinker._transport, SQSAlertTransport)
+        assert_equal(sinker._transport.queue_url, self.queue_url)
+
+    def test_transport_default(self):
+        """StreamSink - Lambda Transport by Default"""
+        with patch('stream_alert.rule_processor.sink.boto3.client'):
+            sinker = StreamSink(self.env, {'global': {'infrastructure': {}}})
+        assert_is_instance(sinker._transport, LambdaAlertTransport)
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.error')
+    def test_transport_missing_queue(self, log_mock):
+        """StreamSink - SQS Transport Falls Back to Lambda When the Queue is Missing"""
+        self.client.delete_queue(QueueUrl=self.queue_url)
+        sinker = StreamSink(self.env, self.config)
+
+        assert_is_instance(sinker._transport, LambdaAlertTransport)
+        assert_equal(log_mock.call_args[0][0],
+                     'Unable to load the alerts queue, sending alerts to the alert '
+                     'processor function instead. Error is: %s')
+
+    @patch('stream_alert.rule_processor.sink.MetricLogger.log_metric')
+    def test_sink_alerts(self, metric_mock):
+        """StreamSink - Send Alerts to SQS in Batches of 10"""
+        sinker = StreamSink(self.env, self.config)
+        alerts = [{'rule_name': 'rule_{:02d}'.format(index)} for index in range(25)]
+
+        with patch.object(SQSAlertTransport, 'send', wraps=sinker._transport.send) as send:
+            sinker.sink(alerts)
+            sinker.flush()
+
+        assert_equal(sorted(len(args[0]) for args, _ in send.call_args_list), [5, 10, 10])
+        assert_equal(sorted(alert['rule_name'] for alert in self._received_alerts()),
+                     [alert['rule_name'] for alert in alerts])
+        metric_mock.assert_has_calls([
+            call('rule_processor', 'SentAlerts', 25),
+            call('rule_processor', 'FailedAlerts', 0)
+        ])
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.error')
+    def test_send_failed_entries(self, log_mock):
+        """SQSAlertTransport - Failed Entries Counted"""
+        transport = SQSAlertTransport(self.env)
+        response = {
+            'Successful': [{'Id': '0'}],
+            'Failed': [{'Id': '1', 'Code': 'InternalError', 'SenderFault': False}]
+        }
+        with patch.object(transport.client_sqs, 'send_message_batch', return_value=response):
+            assert_equal(transport.send(['{"a":1}', '{"b":2}']), 1)
+
+        assert_equal(log_mock.call_args[0][1:3], (1, self.QUEUE_NAME))
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.exception')
+    def test_send_client_error(self, log_mock):
+        """SQSAlertTransport - Boto Error"""
+        transport = SQSAlertTransport(self.env)
+        err = ClientError({'Error': {'Code': 100}}, 'operation')
+        with patch.object(transport.client_sqs, 'send_message_batch', side_effect=err):
+            assert_equal(transport.send(['{"a":1}']), 0)
+
+        log_mock.assert_called_with('An error occurred while sending %d alert(s) to '
+                                    '\'%s\'. Error is: %s',
+                                    1, self.QUEUE_NAME, {'Error': {'Code': 100}})
+
+
+class TestStreamSinkLargeAlerts(object):
+    """Test class for offloading large alerts to S3"""
+    BUCKET = 'corp-prefix.streamalerts'
+
+    def setup(self):
+        """Setup before each method"""
+        self.s3_mock = mock_s3()
+        self.s3_mock.start()
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket=self.BUCKET)
+        self.config = {
+            'global': {
+                'account': {'prefix': 'corp-prefix'},
+                'infrastructure': {'large_alerts': {'enabled': True}}
+            }
+        }
+        self.lambda_patcher = patch.object(LambdaAlertTransport, 'send',
+                                           side_effect=len)
+        self.send_mock = self.lambda_patcher.start()
+        self.sinker = StreamSink(load_env(get_mock_context()), self.config)
+
+    def teardown(self):
+        """Teardown after each method"""
+        self.lambda_patcher.stop()
+        self.s3_mock.stop()
+
+    def _sent_alerts(self):
+        """Helper to get all alerts passed to the transport"""
+        return [json.loads(alert) for args, _ in self.send_mock.call_args_list
+                for alert in args[0]]
+
+    def test_offload_too_large(self):
+        """StreamSink - Large Alert Offloaded to S3"""
+        large_alert = {'rule_name': 'large', 'data': 'a' * LambdaAlertTransport.MAX_BATCH_SIZE}
+        self.sinker.sink([{'rule_name': 'small'}, large_alert])
+        self.sinker.flush()
+
+        sent = self._sent_alerts()
+        assert_equal(sent[0], {'rule_name': 'small'})
+
+        reference = sent[1]['streamalert:alert_reference']
+        assert_equal(reference['bucket'], self.BUCKET)
+        body = self.client.get_object(Bucket=self.BUCKET, Key=reference['key'])['Body']
+        assert_equal(json.loads(body.read()), large_alert)
+
+    def test_offload_threshold(self):
+        """StreamSink - Alerts Above Threshold Offloaded to S3"""
+        self.config['global']['infrastructure']['large_alerts']['size_threshold'] = 100
+        sinker = StreamSink(load_env(get_mock_context()), self.config)
+        sinker.sink([{'rule_name': 'small'}, {'rule_name': 'large', 'data': 'a' * 100}])
+        sinker.flush()
+
+        sent = self._sent_alerts()
+        assert_equal(sent[0], {'rule_name': 'small'})
+        assert_true('streamalert:alert_reference' in sent[1])
+
+    @patch('stream_alert.rule_processor.sink.LOGGER.exception')
+    def test_offload_error(self, log_mock):
+        """StreamSink - Large Alert Offload Error"""
+        self.client.delete_bucket(Bucket=self.BUCKET)
+        self.sinker.sink([{'data': 'a' * LambdaAlertTransport.MAX_BATCH_SIZE}])
+        self.sinker.flush()
+
+        self.send_mock.assert_not_called()
+        assert_equal(log_mock.call_args[0][0],
+                     'An error occurred while writing large alert to '
+                     '\'%s\'. Error is: %s. Alert: %s')
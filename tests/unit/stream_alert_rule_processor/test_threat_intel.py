@@ -14,8 +14,11 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 # pylint: disable=protected-access,no-self-use
+import boto3
 from botocore.exceptions import ClientError, ParamValidationError
-from mock import patch
+from mock import ANY, patch
+from moto import mock_s3
+from netaddr import IPAddress, IPNetwork
 from nose.tools import (
     assert_equal,
     assert_false,
@@ -25,7 +28,14 @@ from nose.tools import (
 )
 
 from stream_alert.rule_processor.config import load_config
-from stream_alert.rule_processor.threat_intel import StreamThreatIntel, StreamIoc
+from stream_alert.rule_processor.threat_intel import (
+    IocIndex,
+    IpRangeIndex,
+    parse_ip_network,
+    StreamIoc,
+    StreamThreatIntel,
+    StreamThreatIntelLocal
+)
 from tests.unit.stream_alert_rule_processor.test_helpers import (
     MockDynamoDBClient,
     mock_normalized_records,
@@ -458,6 +468,41 @@ class TestStreamThreatIntel(object):
         assert_false(ioc_collections[1].is_ioc)
         assert_false(ioc_collections[2].is_ioc)
 
+    @patch('boto3.client')
+    def test_process_ioc_with_subdomain(self, mock_client):
+        """Threat Intel - Test private method process_ioc matches parent domains"""
+        mock_client.return_value = MockDynamoDBClient()
+        threat_intel = StreamThreatIntel.load_from_config(self.config)
+
+        ioc_collections = [
+            StreamIoc(value='a.b.evil.com', ioc_type='domain'),
+            StreamIoc(value='b.evil.com', ioc_type='domain'),
+            StreamIoc(value='evil.com.org', ioc_type='domain')
+        ]
+        with patch.object(threat_intel, '_query', wraps=threat_intel._query) as mock_query:
+            threat_intel._process_ioc(ioc_collections)
+            # Parent domains are looked up in the same batch, without duplicates
+            mock_query.assert_called_once_with(
+                ['a.b.evil.com', 'b.evil.com', 'evil.com', 'evil.com.org', 'com.org'])
+
+        assert_true(ioc_collections[0].is_ioc)
+        assert_equal(ioc_collections[0].sub_type, 'c2_domain')
+        assert_true(ioc_collections[1].is_ioc)
+        assert_false(ioc_collections[2].is_ioc)
+
+    def test_lookup_values(self):
+        """Threat Intel - Test lookup values for IOCs"""
+        assert_equal(StreamThreatIntel._lookup_values(StreamIoc(value='1.1.1.2', ioc_type='ip')),
+                     ['1.1.1.2'])
+        assert_equal(StreamThreatIntel._lookup_values(StreamIoc(value='com', ioc_type='domain')),
+                     ['com'])
+        assert_equal(
+            StreamThreatIntel._lookup_values(StreamIoc(value='evil.com', ioc_type='domain')),
+            ['evil.com'])
+        assert_equal(
+            StreamThreatIntel._lookup_values(StreamIoc(value='a.b.evil.com.', ioc_type='domain')),
+            ['a.b.evil.com.', 'b.evil.com', 'evil.com'])
+
     def test_segment(self):
         """Threat Intel - Test _segment method to segment a list to sub-list"""
         # it should only return 1 sub-list when length of list less than MAX_QUERY_CNT (100)
@@ -536,3 +581,227 @@ class TestStreamThreatIntel(object):
             {'test_number': 10, 'test_type': 'test_type'}
         ]
         assert_equal(result, expect_result)
+
+
+class TestIocIndex(object):
+    """Test class for IocIndex"""
+    def test_lookup(self):
+        """IocIndex - Lookup values by IOC type"""
+        index = IocIndex([('1.1.1.2', 'ip', 'mal_ip'),
+                          ('EVIL.com', 'domain', 'c2_domain'),
+                          ('0.0.0.1', 'ip', 'c2_ip')])
+        assert_equal(len(index), 3)
+        assert_equal(index.lookup('ip', '1.1.1.2'), 'mal_ip')
+        assert_equal(index.lookup('ip', '0.0.0.1'), 'c2_ip')
+        assert_equal(index.lookup('domain', 'evil.com'), 'c2_domain')
+        assert_equal(index.lookup('domain', '1.1.1.2'), None)
+        assert_equal(index.lookup('ip', '9.9.9.9'), None)
+        assert_equal(index.lookup('md5', 'abcdef'), None)
+
+
+class TestStreamThreatIntelLocal(object):
+    """Test class for StreamThreatIntelLocal"""
+    IOC_FILES = ['tests/unit/fixtures/ip.csv.gz',
+                 'tests/unit/fixtures/domain.csv.gz',
+                 'tests/unit/fixtures/md5.csv.gz']
+
+    @classmethod
+    def teardown_class(cls):
+        """Teardown the class after all methods"""
+        cls.config = None
+
+    def setup(self):
+        """Setup before each method"""
+        self.config = load_config('tests/unit/conf')
+        self.config['global']['threat_intel'] = {
+            'backend': 'local',
+            'enabled': True,
+            'ioc_files': self.IOC_FILES
+        }
+
+    def teardown(self):
+        """Teardown after each method"""
+        StreamThreatIntel._StreamThreatIntel__normalized_types.clear() # pylint: disable=no-member
+        StreamThreatIntelLocal._StreamThreatIntelLocal__index_cache.clear() # pylint: disable=no-member
+
+    def test_load_from_config(self):
+        """Threat Intel Local - Load local backend from config"""
+        threat_intel = StreamThreatIntel.load_from_config(self.config)
+        assert_is_instance(threat_intel, StreamThreatIntelLocal)
+        assert_equal(len(threat_intel._index), 30)
+
+    @patch('stream_alert.rule_processor.threat_intel.LOGGER.error')
+    def test_load_from_config_no_files(self, mock_logger):
+        """Threat Intel Local - Load local backend without ioc_files"""
+        del self.config['global']['threat_intel']['ioc_files']
+        assert_false(StreamThreatIntel.load_from_config(self.config))
+        mock_logger.assert_called_with('Threat Intel \'local\' backend requires \'ioc_files\'')
+
+    @patch('stream_alert.rule_processor.threat_intel.LOGGER.error')
+    def test_load_from_config_bad_backend(self, mock_logger):
+        """Threat Intel Local - Load unsupported backend from config"""
+        self.config['global']['threat_intel']['backend'] = 'foobar'
+        assert_false(StreamThreatIntel.load_from_config(self.config))
+        mock_logger.assert_called_with('Unsupported Threat Intel backend: %s', 'foobar')
+
+    @patch('stream_alert.rule_processor.threat_intel.IocIndex')
+    def test_index_cached(self, mock_index):
+        """Threat Intel Local - Index is only built once per set of files"""
+        StreamThreatIntel.load_from_config(self.config)
+        StreamThreatIntel.load_from_config(self.config)
+        assert_equal(mock_index.call_count, 1)
+
+    @patch('stream_alert.rule_processor.threat_intel.LOGGER.error')
+    def test_load_missing_file(self, mock_logger):
+        """Threat Intel Local - Missing IOC file is skipped"""
+        self.config['global']['threat_intel']['ioc_files'] = [
+            'tests/unit/fixtures/missing.csv.gz', self.IOC_FILES[0]
+        ]
+        threat_intel = StreamThreatIntel.load_from_config(self.config)
+        assert_equal(len(threat_intel._index), 10)
+        assert_equal(mock_logger.call_args[0][:2], ('[Threat Intel] Unable to read IOC file %s: %s',
+                                                    'tests/unit/fixtures/missing.csv.gz'))
+        # A partial index is not cached, so the missing file is retried
+        assert_equal(StreamThreatIntelLocal._StreamThreatIntelLocal__index_cache, {}) # pylint: disable=no-member
+
+    @mock_s3
+    @patch('stream_alert.rule_processor.threat_intel.LOGGER.error')
+    def test_load_missing_s3_object(self, mock_logger):
+        """Threat Intel Local - Missing IOC object in S3 results in an empty index"""
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='ioc-bucket')
+
+        threat_intel = StreamThreatIntelLocal(['s3://ioc-bucket/iocs/ip.csv.gz'])
+        assert_equal(len(threat_intel._index), 0)
+        mock_logger.assert_any_call('[Threat Intel] Unable to read IOC file %s: %s',
+                                    's3://ioc-bucket/iocs/ip.csv.gz', ANY)
+        mock_logger.assert_called_with('[Threat Intel] No IOCs were loaded from %d file(s), '
+                                       'records will not match any IOCs', 1)
+
+    @mock_s3
+    def test_load_from_s3(self):
+        """Threat Intel Local - Load IOC file from S3"""
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='ioc-bucket')
+        with open(self.IOC_FILES[0], 'rb') as ioc_fh:
+            client.put_object(Bucket='ioc-bucket', Key='iocs/ip.csv.gz', Body=ioc_fh.read())
+
+        threat_intel = StreamThreatIntelLocal(['s3://ioc-bucket/iocs/ip.csv.gz'])
+        assert_equal(len(threat_intel._index), 10)
+        assert_equal(threat_intel._index.lookup('ip', '90.163.54.11'), 'c2_ip')
+
+    def test_threat_detection(self):
+        """Threat Intel Local - Test threat_detection method"""
+        records = mock_normalized_records([
+            {
+                'source': '90.163.54.11',
+                'streamalert:normalization': {
+                    'sourceAddress': [['source']]
+                }
+            },
+            {
+                'domain': 'TEST.ddns.net',
+                'streamalert:normalization': {
+                    'destinationDomain': [['domain']]
+                }
+            },
+            {
+                'domain': 'not-evil.com',
+                'streamalert:normalization': {
+                    'destinationDomain': [['domain']]
+                }
+            },
+            {
+                'domain': 'sub.test_evil.net',
+                'streamalert:normalization': {
+                    'destinationDomain': [['domain']]
+                }
+            }
+        ])
+        threat_intel = StreamThreatIntel.load_from_config(self.config)
+        ioc_records = threat_intel.threat_detection(records)
+
+        assert_equal(len(ioc_records), 3)
+        assert_equal(ioc_records[0].pre_parsed_record['streamalert:ioc'],
+                     {'ip': ['90.163.54.11']})
+        assert_equal(ioc_records[1].pre_parsed_record['streamalert:ioc'],
+                     {'domain': ['test.ddns.net']})
+        assert_equal(ioc_records[2].pre_parsed_record['streamalert:ioc'],
+                     {'domain': ['sub.test_evil.net']})
+
+
+class TestIpRangeIndex(object):
+    """Test class for IpRangeIndex"""
+    @staticmethod
+    def _index(*networks):
+        return IpRangeIndex([(IPNetwork(net).first, IPNetwork(net).last, sub_type)
+                             for net, sub_type in networks])
+
+    @staticmethod
+    def _lookup(index, address):
+        return index.lookup(int(IPAddress(address)))
+
+    def test_lookup(self):
+        """IpRangeIndex - Lookup addresses in disjoint networks"""
+        index = self._index(('10.0.0.0/24', 'mal_ip'), ('192.168.0.0/16', 'c2_ip'))
+        assert_equal(self._lookup(index, '10.0.0.0'), 'mal_ip')
+        assert_equal(self._lookup(index, '10.0.0.255'), 'mal_ip')
+        assert_equal(self._lookup(index, '192.168.10.1'), 'c2_ip')
+        assert_equal(self._lookup(index, '10.0.1.0'), None)
+        assert_equal(self._lookup(index, '9.255.255.255'), None)
+        assert_equal(self._lookup(index, '200.0.0.1'), None)
+
+    def test_lookup_nested(self):
+        """IpRangeIndex - Most specific nested network wins"""
+        index = self._index(('10.0.0.0/8', 'mal_ip'),
+                            ('10.1.0.0/16', 'c2_ip'),
+                            ('10.1.2.0/24', 'scan_ip'),
+                            ('10.255.0.0/16', 'c2_ip'),
+                            ('10.0.0.0/8', 'mal_ip'))
+        assert_equal(len(index), 6)
+        assert_equal(self._lookup(index, '10.0.0.1'), 'mal_ip')
+        assert_equal(self._lookup(index, '10.1.1.1'), 'c2_ip')
+        assert_equal(self._lookup(index, '10.1.2.3'), 'scan_ip')
+        assert_equal(self._lookup(index, '10.1.3.0'), 'c2_ip')
+        assert_equal(self._lookup(index, '10.2.0.0'), 'mal_ip')
+        assert_equal(self._lookup(index, '10.255.255.255'), 'c2_ip')
+        assert_equal(self._lookup(index, '11.0.0.0'), None)
+
+    def test_lookup_empty(self):
+        """IpRangeIndex - Lookup with no networks"""
+        assert_equal(self._lookup(self._index(), '10.0.0.1'), None)
+
+
+class TestIocIndexIpRanges(object):
+    """Test class for CIDR IOCs in the IocIndex"""
+    def test_lookup_cidr(self):
+        """IocIndex - Lookup IP addresses within CIDR IOCs"""
+        index = IocIndex([('1.1.1.2', 'ip', 'mal_ip'),
+                          ('90.163.0.0/16', 'ip', 'c2_ip'),
+                          ('2001:db8::/32', 'ip', 'c2_ip'),
+                          ('evil.com/path', 'domain', 'c2_domain')])
+        assert_equal(len(index), 4)
+        assert_equal(index.lookup('ip', '1.1.1.2'), 'mal_ip')
+        assert_equal(index.lookup('ip', '90.163.54.11'), 'c2_ip')
+        assert_equal(index.lookup('ip', '2001:db8::1'), 'c2_ip')
+        assert_equal(index.lookup('ip', '90.164.0.1'), None)
+        assert_equal(index.lookup('ip', 'not-an-ip'), None)
+        assert_equal(index.lookup('domain', 'evil.com/path'), 'c2_domain')
+
+    @patch('stream_alert.rule_processor.threat_intel.LOGGER.error')
+    def test_invalid_cidr(self, mock_logger):
+        """IocIndex - Invalid CIDR IOC"""
+        index = IocIndex([('1.1.1.0/33', 'ip', 'mal_ip')])
+        assert_equal(len(index), 0)
+        mock_logger.assert_called_with('[Threat Intel] Invalid IP network IOC: %s', '1.1.1.0/33')
+
+
+def test_parse_ip_network():
+    """Threat Intel - Parse IP addresses and networks into integer ranges"""
+    assert_equal(parse_ip_network('10.0.0.0/8'), (4, 167772160, 184549375))
+    assert_equal(parse_ip_network('10.1.2.3/8'), (4, 167772160, 184549375))
+    assert_equal(parse_ip_network('1.1.1.2'), (4, 16843010, 16843010))
+    assert_equal(parse_ip_network('2001:db8::/32'),
+                 (6, IPNetwork('2001:db8::/32').first, IPNetwork('2001:db8::/32').last))
+    assert_equal(parse_ip_network('1.1.1.0/33'), None)
+    assert_equal(parse_ip_network('1.1.1.0/abc'), None)
+    assert_equal(parse_ip_network('evil.com'), None)
@@ -13,13 +13,23 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-# pylint: disable=no-self-use,protected-access
+# pylint: disable=attribute-defined-outside-init,no-self-use,protected-access
+import json
 import os
+from StringIO import StringIO
 
+from botocore.exceptions import ClientError
 from mock import call, patch
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_false, assert_is_instance, assert_true, raises
 
 from stream_alert import shared
+from stream_alert.shared.metrics import (
+    EmbeddedMetricSink,
+    LocalMetricSink,
+    MetricRegistry,
+    MetricSink,
+    PutMetricDataSink
+)
 
 
 class TestMetrics(object):
@@ -99,3 +109,162 @@ class TestMetrics(object):
             reload(shared)
 
             log_mock.assert_called_with(10)
+
+
+class TestMetricRegistry(object):
+    """Test class for MetricRegistry"""
+
+    def setup(self):
+        """Setup before each method"""
+        self.sink = LocalMetricSink()
+        self.registry = MetricRegistry(self.sink, {'Cluster': 'prod'})
+
+    def test_counter(self):
+        """MetricRegistry - Counters Summed"""
+        for _ in range(3):
+            self.registry.increment('TotalRecords', 2, {'LogSource': 'cloudtrail'})
+        self.registry.increment('TotalRecords', 1, {'LogSource': 'osquery'})
+        self.registry.flush()
+
+        assert_equal(self.sink.get('TotalRecords', {'Cluster': 'prod',
+                                                    'LogSource': 'cloudtrail'}), [6])
+        assert_equal(sorted(self.sink.get('TotalRecords')), [1, 6])
+
+    def test_histogram(self):
+        """MetricRegistry - Histograms Keep All Values"""
+        for value in (5, 1, 3):
+            self.registry.observe('S3DownloadTime', value)
+        self.registry.flush()
+
+        assert_equal(self.sink.get('S3DownloadTime'), [5, 1, 3])
+
+    def test_flush_resets(self):
+        """MetricRegistry - Flush Resets Metrics"""
+        self.registry.increment('TotalRecords')
+        self.registry.flush()
+        self.registry.flush()
+
+        assert_equal(self.sink.get('TotalRecords'), [1])
+
+    def test_disabled(self):
+        """MetricRegistry - Disabled Without a Sink"""
+        registry = MetricRegistry()
+        registry.increment('TotalRecords')
+        registry.flush()
+
+        assert_false(registry.enabled)
+        assert_equal(dict(registry._counters), {})
+
+    @patch('logging.Logger.info')
+    def test_log_metric_buffered(self, log_mock):
+        """MetricRegistry - MetricLogger Values Buffered When Enabled"""
+        with patch.object(shared.metrics, 'METRICS', self.registry), \
+                patch.object(shared.metrics, 'ENABLE_METRICS', True):
+            shared.metrics.MetricLogger.log_metric('rule_processor', 'FailedParses', 100)
+            shared.metrics.MetricLogger.log_metric('rule_processor', 'FailedParses', 50)
+
+        log_mock.assert_not_called()
+        self.registry.flush()
+        assert_equal(self.sink.get('FailedParses', {'Cluster': 'prod',
+                                                    'Function': 'RuleProcessor'}), [100, 50])
+
+    @patch('logging.Logger.info')
+    def test_log_metric_not_buffered(self, log_mock):
+        """MetricRegistry - MetricLogger Values Logged for Other Functions"""
+        with patch.object(shared.metrics, 'METRICS', self.registry), \
+                patch.object(shared.metrics, 'ENABLE_METRICS', True), \
+                patch.dict(shared.metrics.MetricLogger._available_metrics,
+                           {'alert_processor': {'SentAlerts': None}}):
+            shared.metrics.MetricLogger.log_metric('alert_processor', 'SentAlerts', 10)
+
+        log_mock.assert_called_with('{"metric_name": "%s", "metric_value": %s}',
+                                    'SentAlerts', 10)
+        self.registry.flush()
+        assert_equal(self.sink.metrics, [])
+
+    @patch('stream_alert.shared.metrics.boto3.client')
+    def test_load_metric_sink(self, _):
+        """MetricRegistry - Load Metric Sink"""
+        with patch.object(shared.metrics, 'ENABLE_METRICS', True):
+            assert_equal(shared.metrics.load_metric_sink('log'), None)
+            assert_is_instance(shared.metrics.load_metric_sink('emf'), EmbeddedMetricSink)
+            assert_is_instance(shared.metrics.load_metric_sink('api'), PutMetricDataSink)
+
+        with patch.object(shared.metrics, 'ENABLE_METRICS', False):
+            assert_equal(shared.metrics.load_metric_sink('emf'), None)
+
+
+@raises(TypeError)
+def test_metric_sink_abstract():
+    """MetricSink - Publish Must be Implemented by Subclasses"""
+    MetricSink()  # pylint: disable=abstract-class-instantiated
+
+
+class TestEmbeddedMetricSink(object):
+    """Test class for EmbeddedMetricSink"""
+
+    def setup(self):
+        """Setup before each method"""
+        self.stream = StringIO()
+        self.sink = EmbeddedMetricSink(stream=self.stream)
+
+    def _documents(self):
+        """Helper to parse the printed documents"""
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_publish(self):
+        """EmbeddedMetricSink - Publish Grouped by Dimensions"""
+        self.sink.publish([
+            ('TotalRecords', {'Cluster': 'prod'}, [10]),
+            ('S3DownloadTime', {'Cluster': 'prod'}, [1, 2]),
+            ('TotalRecords', {'Cluster': 'prod', 'LogSource': 'osquery'}, [4])
+        ])
+
+        documents = sorted(self._documents(), key=len)
+        assert_equal(len(documents), 2)
+        assert_equal(documents[0]['TotalRecords'], 4)
+        assert_equal(documents[0]['LogSource'], 'osquery')
+        assert_equal(documents[0]['_aws']['CloudWatchMetrics'][0]['Dimensions'],
+                     [['Cluster', 'LogSource']])
+        assert_equal(documents[1]['TotalRecords'], 10)
+        assert_equal(documents[1]['S3DownloadTime'], [1, 2])
+        assert_equal(documents[1]['_aws']['CloudWatchMetrics'][0]['Namespace'], 'StreamAlert')
+
+    def test_publish_split_values(self):
+        """EmbeddedMetricSink - Publish Splits Values Beyond Limit"""
+        self.sink.publish([('S3DownloadTime', {'Cluster': 'prod'}, range(250))])
+
+        documents = self._documents()
+        assert_equal([len(document['S3DownloadTime']) for document in documents],
+                     [100, 100, 50])
+
+
+class TestPutMetricDataSink(object):
+    """Test class for PutMetricDataSink"""
+
+    @patch('stream_alert.shared.metrics.boto3.client')
+    def test_publish(self, client_mock):
+        """PutMetricDataSink - Publish in Batches with Statistic Sets"""
+        sink = PutMetricDataSink(region='us-east-1')
+        metrics = [('Metric{:02d}'.format(index), {'Cluster': 'prod'}, [index])
+                   for index in range(25)]
+        metrics.append(('S3DownloadTime', {}, [1, 2, 6]))
+        sink.publish(metrics)
+
+        calls = client_mock.return_value.put_metric_data.call_args_list
+        assert_equal([len(args[1]['MetricData']) for args in calls], [20, 6])
+        assert_equal(calls[0][1]['MetricData'][0],
+                     {'MetricName': 'Metric00', 'Value': 0,
+                      'Dimensions': [{'Name': 'Cluster', 'Value': 'prod'}]})
+        assert_equal(calls[1][1]['MetricData'][-1]['StatisticValues'],
+                     {'SampleCount': 3, 'Sum': 9, 'Minimum': 1, 'Maximum': 6})
+
+    @patch('logging.Logger.error')
+    @patch('stream_alert.shared.metrics.boto3.client')
+    def test_publish_error(self, client_mock, log_mock):
+        """PutMetricDataSink - Publish Error"""
+        client_mock.return_value.put_metric_data.side_effect = ClientError(
+            {'Error': {'Code': 100}}, 'PutMetricData')
+        PutMetricDataSink(region='us-east-1').publish([('TotalRecords', {}, [1])])
+
+        assert_true(log_mock.called)
@@ -0,0 +1,184 @@
+"""
+Copyright 2017-present, Airbnb Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# pylint: disable=attribute-defined-outside-init,no-self-use
+import json
+
+from mock import patch
+from nose.tools import assert_equal, assert_true
+
+from stream_alert.shared import metrics
+from stream_alert.shared.metrics import LocalMetricSink, MetricRegistry
+from stream_alert.shared.stats import CallStats, StageTimers
+
+
+class TestStageTimers(object):
+    """Test class for StageTimers"""
+
+    def setup(self):
+        """Setup before each method"""
+        self.timers = StageTimers(enabled=True)
+
+    @patch('stream_alert.shared.stats.time.time')
+    def test_start_stop(self, time_mock):
+        """StageTimers - Accumulate Count, Total and Max"""
+        time_mock.side_effect = [1.0, 1.5, 2.0, 2.25]
+        for _ in range(2):
+            start = self.timers.start()
+            self.timers.stop('classify', start)
+
+        assert_equal(self.timers.stats(),
+                     {'classify': {'count': 2, 'total_ms': 750.0, 'max_ms': 500.0}})
+
+    @patch('stream_alert.shared.stats.time.time')
+    def test_disabled(self, time_mock):
+        """StageTimers - Disabled Timers Do Nothing"""
+        timers = StageTimers()
+
+        @timers.timed('parse')
+        def parse(value):
+            """Function to time"""
+            return value * 2
+
+        start = timers.start()
+        timers.stop('rules', start)
+
+        assert_equal(parse(2), 4)
+        assert_equal(list(timers.timed_iter('pre_parse', [1, 2])), [1, 2])
+        assert_equal(timers.stats(), {})
+        time_mock.assert_not_called()
+
+    def test_timed(self):
+        """StageTimers - Timed Decorator"""
+        @self.timers.timed('parse')
+        def parse(value):
+            """Function to time"""
+            if not value:
+                raise ValueError('bad')
+            return value
+
+        parse(1)
+        try:
+            parse(0)
+        except ValueError:
+            pass
+
+        assert_equal(parse.__name__, 'parse')
+        assert_equal(self.timers.stats()['parse']['count'], 2)
+
+    def test_timed_iter(self):
+        """StageTimers - Timed Iterable"""
+        def records():
+            """Generator to time"""
+            for index in range(3):
+                yield index
+
+        assert_equal(list(self.timers.timed_iter('pre_parse', records())), [0, 1, 2])
+        # One timing per item, plus the final call that ends the iteration
+        assert_equal(self.timers.stats()['pre_parse']['count'], 4)
+
+    @patch('stream_alert.shared.stats.LOGGER.info')
+    def test_report(self, log_mock):
+        """StageTimers - Report Logs, Records Metrics and Resets"""
+        sink = LocalMetricSink()
+        self.timers.stop('rules', self.timers.start())
+
+        with patch.object(metrics, 'METRICS', MetricRegistry(sink)) as registry, \
+                patch.object(metrics, 'ENABLE_METRICS', True):
+            self.timers.report()
+            registry.flush()
+
+        assert_equal(log_mock.call_args[0][0], '[Stage Timers] %s')
+        assert_equal(json.loads(log_mock.call_args[0][1]).keys(), ['rules'])
+        assert_equal(len(sink.get('StageTime', {'Function': 'RuleProcessor',
+                                                'Stage': 'rules'})), 1)
+        assert_equal(self.timers.stats(), {})
+
+    @patch('stream_alert.shared.metrics.LOGGER.info')
+    def test_report_log_format(self, log_mock):
+        """StageTimers - Report Logs Metrics When Not Buffered"""
+        self.timers.stop('rules', self.timers.start())
+
+        with patch.object(metrics, 'METRICS', MetricRegistry(None)), \
+                patch.object(metrics, 'ENABLE_METRICS', True):
+            self.timers.report()
+
+        assert_equal(log_mock.call_args[0][:2],
+                     ('{"metric_name": "%s", "metric_value": %s, "dimensions": %s}',
+                      'StageTime'))
+        assert_equal(json.loads(log_mock.call_args[0][3]), {'Stage': 'rules'})
+
+    @patch('stream_alert.shared.stats.LOGGER.info')
+    def test_report_empty(self, log_mock):
+        """StageTimers - Report Nothing When No Stages Were Timed"""
+        self.timers.report()
+        assert_true(not log_mock.called)
+
+
+class TestCallStats(object):
+    """Test class for CallStats"""
+
+    def setup(self):
+        """Setup before each method"""
+        self.call_stats = CallStats('Rule', 'RuleTime', enabled=True)
+
+    def test_record(self):
+        """CallStats - Accumulate Calls, Time, Exceptions and Hits"""
+        self.call_stats.record('rule_a', 0.5, True)
+        self.call_stats.record('rule_a', 0.25, False)
+        self.call_stats.record('rule_a', 0.25, False, error=True)
+        self.call_stats.record('rule_b', 0.1, False)
+
+        assert_equal(self.call_stats.stats()['rule_a'],
+                     {'calls': 3, 'total_ms': 1000.0, 'avg_ms': 333.3333,
+                      'exceptions': 1, 'hit_rate': 0.3333})
+
+    def test_top(self):
+        """CallStats - Top Entries by Cumulative Time"""
+        for index in range(5):
+            self.call_stats.record('rule_{}'.format(index), index / 10.0, False)
+
+        assert_equal([name for name, _ in self.call_stats.top(2)], ['rule_4', 'rule_3'])
+
+    @patch('stream_alert.shared.stats.LOGGER.info')
+    def test_report(self, log_mock):
+        """CallStats - Report Logs, Records Metrics and Resets"""
+        sink = LocalMetricSink()
+        self.call_stats.record('rule_a', 0.5, True)
+        self.call_stats.record('rule_b', 0.1, True)
+
+        with patch.object(metrics, 'METRICS', MetricRegistry(sink)) as registry, \
+                patch.object(metrics, 'ENABLE_METRICS', True):
+            self.call_stats.report(count=1)
+            registry.flush()
+
+        dimensions = {'Function': 'RuleProcessor', 'Rule': 'rule_a'}
+        assert_equal(log_mock.call_args[0][:2], ('[%s Stats] %s', 'Rule'))
+        assert_equal(sink.get('RuleTime', dimensions), [500.0])
+        assert_equal(sink.get('RuleTime', dict(dimensions, Rule='rule_b')), [])
+        assert_equal(self.call_stats.stats(), {})
+
+    @patch('stream_alert.shared.metrics.LOGGER.info')
+    def test_report_log_format(self, log_mock):
+        """CallStats - Report Logs Metrics When Not Buffered"""
+        self.call_stats.record('rule_a', 0.5, True)
+
+        with patch.object(metrics, 'METRICS', MetricRegistry(None)), \
+                patch.object(metrics, 'ENABLE_METRICS', True):
+            self.call_stats.report()
+
+        log_mock.assert_called_with(
+            '{"metric_name": "%s", "metric_value": %s, "dimensions": %s}',
+            'RuleTime', 500.0, '{"Rule": "rule_a"}')